@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'MediAlertServerApp.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -87,6 +88,44 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Segundos que se conservan las respuestas del dashboard (se invalidan por versión de datos)
+DASHBOARD_CACHE_TIMEOUT = 300
+
+# Exportaciones en segundo plano: carpeta de ficheros, hilos de trabajo y días que se conservan
+EXPORTS_ROOT = Path(os.environ.get('EXPORTS_ROOT', BASE_DIR / 'exports'))
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 2))
+EXPORT_RETENTION_DAYS = 7
+# Minutos tras los que un trabajo PENDING/RUNNING se da por perdido (p. ej. el proceso se reinició)
+EXPORT_JOB_TIMEOUT_MINUTES = int(os.environ.get('EXPORT_JOB_TIMEOUT_MINUTES', 30))
+# Procesos para renderizar los PDF grandes de las exportaciones (1 = en el propio hilo)
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', 1))
+
+# Sincronización móvil: filas por modelo y página, y segundos de margen para
+# transacciones en curso (las filas más recientes se entregan en la siguiente llamada)
+SYNC_PAGE_SIZE = 500
+SYNC_SETTLE_SECONDS = 2
+
+# Pantalla de inicio (home/): días de historial de tomas y máximo de filas por lista
+HOME_HISTORY_DAYS = 7
+HOME_LIST_LIMIT = 100
+
+# Compresión de respuestas (CompressionMiddleware): tamaño mínimo en bytes y niveles
+# de brotli (0-11, si está instalado) y gzip (1-9)
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_GZIP_LEVEL = 6
+
+# Horas que se conserva la respuesta de cada Idempotency-Key
+IDEMPOTENCY_KEY_TTL_HOURS = 24
+# Segundos tras los que una petición con clave que no terminó (p. ej. el proceso cayó) deja de bloquear la clave
+IDEMPOTENCY_IN_FLIGHT_SECONDS = 60
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
@@ -94,9 +133,16 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # JSON y MessagePack según Accept (o ?format=msgpack); la API navegable solo en DEBUG
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
+        'MediAlertServerApp.renderers.MessagePackRenderer',
+    ] + (['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'MediAlertServerApp.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
 }
 
@@ -138,6 +184,15 @@ CRONJOBS = [
     
     # Enviar recordatorios cada 5 minutos
     ('*/5 * * * *', 'django.core.management.call_command', ['send_reminders']),
+
+    # Asignar revisor a los reportes pendientes cada hora
+    ('0 * * * *', 'django.core.management.call_command', ['assign_backlog']),
+
+    # Eliminar exportaciones antiguas cada día a las 03:00
+    ('0 3 * * *', 'django.core.management.call_command', ['prune_exports']),
+
+    # Eliminar claves de idempotencia caducadas cada día a las 03:30
+    ('30 3 * * *', 'django.core.management.call_command', ['prune_idempotency_keys']),
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
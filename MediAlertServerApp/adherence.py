@@ -0,0 +1,289 @@
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+import numpy as np
+from django.utils import timezone
+from .models import MedicamentoMaestro
+
+class AdherenceAnalytics:
+    """
+    Análisis de adherencia a partir de los registros de toma, en una sola consulta.
+
+    Lee el queryset con values_list por bloques y lo guarda como arrays compactos
+    (paciente, medicamento, estado, hora programada y hora de toma en segundos
+    epoch); mapas de calor, adherencia por medicamento, adherencia móvil, rachas y
+    retrasos se calculan sobre esos arrays con bincount, cumsum y lexsort de NumPy.
+
+    Solo cuentan las tomas ya vencidas tomadas u omitidas: una toma pospuesta se
+    sustituye por el registro nuevo que crea posponer.
+    """
+    SECTIONS = ('summary', 'heatmap', 'medication', 'rolling', 'streaks', 'lateness')
+    WEEKDAYS = ['lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábado', 'domingo']
+
+    TAKEN, MISSED, POSTPONED = 0, 1, 2
+    STATES = {'TOMADO': TAKEN, 'OMITIDO': MISSED, 'POSPUESTO': POSTPONED}
+
+    FIELDS = (
+        'recordatorio__usuario_id',
+        'recordatorio__medicamento__medicamento_maestro_id',
+        'estado',
+        'fecha_programada',
+        'fecha_toma',
+    )
+
+    # Ventana de la adherencia móvil (días)
+    ROLLING_DAYS = 7
+    # Tramos de retraso de la toma en minutos (negativo = antes de la hora)
+    LATENESS_EDGES = [-np.inf, -30, -15, 0, 15, 30, 60, 120, np.inf]
+    LATENESS_LABELS = ['< -30', '-30 a -15', '-15 a 0', '0 a 15', '15 a 30', '30 a 60', '60 a 120', '> 120']
+    # Tramos de longitud de las rachas de tomas omitidas seguidas
+    MISSED_RUN_EDGES = [1, 2, 3, 4, 7, np.inf]
+    MISSED_RUN_LABELS = ['1', '2', '3', '4-6', '7+']
+
+    def __init__(self, queryset, chunk_size=5000):
+        self.queryset = queryset
+        self.chunk_size = chunk_size
+
+    def run(self, sections=None):
+        """
+        Calcular las secciones indicadas (todas por defecto) con una única consulta
+
+        Args:
+            sections (iterable, optional): Subconjunto de SECTIONS
+
+        Returns:
+            dict: Un resultado por sección
+        """
+        sections = set(sections or self.SECTIONS)
+        data = self._load()
+
+        result = {}
+        for section in self.SECTIONS:
+            if section in sections:
+                result[section] = getattr(self, f'_{section}')(data)
+        return result
+
+    def _load(self):
+        """Leer el queryset una sola vez y devolver las columnas como arrays"""
+        states = self.STATES
+        columns = {name: [] for name in ('patient', 'maestro', 'state', 'scheduled', 'taken_at')}
+
+        rows = self.queryset.order_by().values_list(*self.FIELDS).iterator(chunk_size=self.chunk_size)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            patient, maestro, state, scheduled, taken_at = zip(*chunk)
+            columns['patient'].append(np.array(patient, dtype=np.int64))
+            columns['maestro'].append(np.array(maestro, dtype=np.int64))
+            columns['state'].append(np.fromiter((states.get(value, -1) for value in state), np.int8, len(chunk)))
+            columns['scheduled'].append(np.fromiter((value.timestamp() for value in scheduled), np.float64, len(chunk)))
+            columns['taken_at'].append(np.fromiter(
+                (value.timestamp() if value is not None else np.nan for value in taken_at), np.float64, len(chunk)
+            ))
+
+        dtypes = {'patient': np.int64, 'maestro': np.int64, 'state': np.int8, 'scheduled': np.float64, 'taken_at': np.float64}
+        data = {
+            name: np.concatenate(parts) if parts else np.empty(0, dtype=dtypes[name])
+            for name, parts in columns.items()
+        }
+
+        # Tomas evaluables: vencidas y tomadas u omitidas
+        data['postponed'] = int(np.count_nonzero(data['state'] == self.POSTPONED))
+        due = (data['scheduled'] <= timezone.now().timestamp()) & (
+            (data['state'] == self.TAKEN) | (data['state'] == self.MISSED)
+        )
+        for name in dtypes:
+            data[name] = data[name][due]
+        data['taken'] = data['state'] == self.TAKEN
+
+        data['local'] = self._local_seconds(data['scheduled'])
+        data['day'] = (data['local'] // 86400).astype(np.int64)
+        data['hour'] = ((data['local'] % 86400) // 3600).astype(np.int64)
+        # 1970-01-01 fue jueves (3 con lunes = 0)
+        data['weekday'] = (data['day'] + 3) % 7
+
+        maestro_ids, data['maestro'] = np.unique(data['maestro'], return_inverse=True)
+        names = dict(MedicamentoMaestro.objects.filter(pk__in=maestro_ids.tolist()).values_list('id', 'nombre'))
+        data['maestro_names'] = [names.get(int(pk)) for pk in maestro_ids]
+        return data
+
+    @staticmethod
+    def _local_seconds(epoch):
+        """
+        Segundos epoch en hora local
+
+        El desfase de la zona horaria solo cambia en los cambios de hora: se calcula
+        una vez por cada hora UTC distinta y se aplica a todas las filas a la vez.
+        """
+        if not len(epoch):
+            return epoch
+        tz = timezone.get_current_timezone()
+        hours, inverse = np.unique(epoch // 3600, return_inverse=True)
+        offsets = np.array([
+            datetime.fromtimestamp(hour * 3600, dt_timezone.utc).astimezone(tz).utcoffset().total_seconds()
+            for hour in hours.tolist()
+        ])
+        return epoch + offsets[inverse]
+
+    @staticmethod
+    def _rate(taken, scheduled):
+        """Adherencia en % (None sin tomas programadas)"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.round(taken * 100.0 / scheduled, 2)
+        return [float(value) if count else None for value, count in zip(np.atleast_1d(rate), np.atleast_1d(scheduled))]
+
+    def _summary(self, data):
+        scheduled = len(data['taken'])
+        taken = int(np.count_nonzero(data['taken']))
+        return {
+            'patients': int(len(np.unique(data['patient']))),
+            'scheduled': scheduled,
+            'taken': taken,
+            'missed': scheduled - taken,
+            'postponed': data['postponed'],
+            'adherence': self._rate(np.array(taken), np.array(scheduled))[0]
+        }
+
+    def _heatmap(self, data):
+        """Tomas programadas, omitidas y adherencia por día de la semana y hora"""
+        cells = data['weekday'] * 24 + data['hour']
+        scheduled = np.bincount(cells, minlength=7 * 24).reshape(7, 24)
+        taken = np.bincount(cells[data['taken']], minlength=7 * 24).reshape(7, 24)
+        missed = scheduled - taken
+
+        return {
+            'by_weekday_hour': [{
+                'weekday': weekday,
+                'scheduled': scheduled[index].tolist(),
+                'missed': missed[index].tolist(),
+                'adherence': self._rate(taken[index], scheduled[index])
+            } for index, weekday in enumerate(self.WEEKDAYS)],
+            'by_hour': [{
+                'hour': hour,
+                'scheduled': int(count),
+                'missed': int(missed_count),
+                'adherence': rate
+            } for hour, (count, missed_count, rate) in enumerate(zip(
+                scheduled.sum(axis=0), missed.sum(axis=0), self._rate(taken.sum(axis=0), scheduled.sum(axis=0))
+            ))],
+            'by_weekday': [{
+                'weekday': weekday,
+                'scheduled': int(count),
+                'missed': int(missed_count),
+                'adherence': rate
+            } for weekday, count, missed_count, rate in zip(
+                self.WEEKDAYS, scheduled.sum(axis=1), missed.sum(axis=1), self._rate(taken.sum(axis=1), scheduled.sum(axis=1))
+            )]
+        }
+
+    def _medication(self, data):
+        """Adherencia por medicamento, de más a menos tomas omitidas"""
+        n_maestros = len(data['maestro_names'])
+        scheduled = np.bincount(data['maestro'], minlength=n_maestros)
+        taken = np.bincount(data['maestro'][data['taken']], minlength=n_maestros)
+        # Pacientes distintos por medicamento: pares (medicamento, paciente) únicos
+        pairs = np.unique(np.column_stack((data['maestro'], data['patient'])), axis=0)
+        patients = np.bincount(pairs[:, 0], minlength=n_maestros)
+
+        analysis = [{
+            'medicamento_maestro__nombre': name,
+            'patients': int(patients[index]),
+            'scheduled': int(scheduled[index]),
+            'missed': int(scheduled[index] - taken[index]),
+            'adherence': rate
+        } for index, (name, rate) in enumerate(zip(data['maestro_names'], self._rate(taken, scheduled)))]
+        return sorted(analysis, key=lambda row: (-row['missed'], row['medicamento_maestro__nombre'] or ''))
+
+    def _rolling(self, data):
+        """Adherencia diaria y media móvil de ROLLING_DAYS días"""
+        if not len(data['day']):
+            return []
+        first_day = data['day'].min()
+        offsets = data['day'] - first_day
+        n_days = int(offsets.max()) + 1
+        scheduled = np.bincount(offsets, minlength=n_days)
+        taken = np.bincount(offsets[data['taken']], minlength=n_days)
+
+        # Sumas móviles con cumsum: ventana [i - ROLLING_DAYS + 1, i]
+        window = self.ROLLING_DAYS
+        scheduled_sum = np.cumsum(scheduled)
+        taken_sum = np.cumsum(taken)
+        scheduled_sum[window:] = scheduled_sum[window:] - scheduled_sum[:-window]
+        taken_sum[window:] = taken_sum[window:] - taken_sum[:-window]
+
+        epoch = date(1970, 1, 1)
+        return [{
+            'date': epoch + timedelta(days=int(first_day) + index),
+            'scheduled': int(scheduled[index]),
+            'taken': int(taken[index]),
+            'adherence': daily,
+            'rolling_adherence': rolling
+        } for index, (daily, rolling) in enumerate(zip(
+            self._rate(taken, scheduled), self._rate(taken_sum, scheduled_sum)
+        ))]
+
+    def _runs(self, data):
+        """Rachas de tomas seguidas con el mismo resultado, por paciente y en orden"""
+        order = np.lexsort((data['scheduled'], data['patient']))
+        patient = data['patient'][order]
+        taken = data['taken'][order]
+
+        starts = np.ones(len(order), dtype=bool)
+        starts[1:] = (patient[1:] != patient[:-1]) | (taken[1:] != taken[:-1])
+        start_index = np.flatnonzero(starts)
+        lengths = np.diff(np.append(start_index, len(order)))
+        return patient[start_index], taken[start_index], lengths
+
+    def _streaks(self, data):
+        """Rachas más largas de tomas seguidas y distribución de las omisiones seguidas"""
+        if not len(data['taken']):
+            return {'longest_taken_streak': 0, 'current_taken_streak': 0, 'missed_runs': []}
+        run_patient, run_taken, lengths = self._runs(data)
+        patients, run_patient = np.unique(run_patient, return_inverse=True)
+
+        longest = np.zeros(len(patients), dtype=np.int64)
+        np.maximum.at(longest, run_patient[run_taken], lengths[run_taken])
+
+        # Racha actual: la última racha de cada paciente, si es de tomas
+        last_run = np.ones(len(run_patient), dtype=bool)
+        last_run[:-1] = run_patient[1:] != run_patient[:-1]
+        current = np.zeros(len(patients), dtype=np.int64)
+        current[run_patient[last_run]] = np.where(run_taken[last_run], lengths[last_run], 0)
+
+        missed_counts, _ = np.histogram(lengths[~run_taken], bins=self.MISSED_RUN_EDGES)
+        result = {
+            'missed_runs': [
+                {'length': label, 'count': int(count)} for label, count in zip(self.MISSED_RUN_LABELS, missed_counts)
+            ]
+        }
+        if len(patients) == 1:
+            result['longest_taken_streak'] = int(longest[0])
+            result['current_taken_streak'] = int(current[0])
+        else:
+            result.update({
+                'avg_longest_taken_streak': round(float(longest.mean()), 2),
+                'max_longest_taken_streak': int(longest.max()),
+                'avg_current_taken_streak': round(float(current.mean()), 2),
+                'patients_with_current_streak': int(np.count_nonzero(current))
+            })
+        return result
+
+    def _lateness(self, data):
+        """Distribución del retraso (minutos) entre la hora programada y la de toma"""
+        taken_at = data['taken_at'][data['taken']]
+        known = ~np.isnan(taken_at)
+        minutes = (taken_at[known] - data['scheduled'][data['taken']][known]) / 60
+        counts, _ = np.histogram(minutes, bins=self.LATENESS_EDGES)
+
+        result = {
+            'doses': int(len(minutes)),
+            'distribution': [{'minutes': label, 'count': int(count)} for label, count in zip(self.LATENESS_LABELS, counts)]
+        }
+        if len(minutes):
+            p50, p90 = np.percentile(minutes, [50, 90])
+            result.update({
+                'median_minutes': round(float(p50), 1),
+                'p90_minutes': round(float(p90), 1),
+                'on_time_percentage': round(float(np.count_nonzero(np.abs(minutes) <= 15) * 100.0 / len(minutes)), 2)
+            })
+        return result
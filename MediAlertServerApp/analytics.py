@@ -0,0 +1,218 @@
+from datetime import date, timedelta
+import numpy as np
+from django.utils import timezone
+from .models import AdverseEffect
+
+class AdverseEffectAnalytics:
+    """
+    Motor de análisis de efectos adversos en una sola pasada.
+
+    Recorre el queryset filtrado una vez (values_list + iterator por bloques),
+    codifica cada columna como enteros en arrays compactos y construye todos los
+    desgloses pedidos con bincount sobre NumPy, incluidas las tablas cruzadas.
+    """
+    SECTIONS = ('severity', 'medication', 'temporal', 'type', 'correlations')
+    SEVERITIES = [code for code, _ in AdverseEffect.SEVERITY_CHOICES]
+    TYPES = [code for code, _ in AdverseEffect.TYPE_CHOICES]
+    SEVERE = ('GRAVE', 'MUY_GRAVE')
+
+    FIELDS = (
+        'severity',
+        'type',
+        'administration_route',
+        'medication__medicamento_maestro_id',
+        'medication__medicamento_maestro__nombre',
+        'reported_at',
+        'resolution_time',
+    )
+
+    def __init__(self, queryset, chunk_size=2000):
+        self.queryset = queryset
+        self.chunk_size = chunk_size
+
+    def run(self, sections=None):
+        """
+        Calcular los desgloses indicados (todos por defecto) con una única consulta
+
+        Args:
+            sections (iterable, optional): Subconjunto de SECTIONS
+
+        Returns:
+            dict: Un resultado por sección
+        """
+        sections = set(sections or self.SECTIONS)
+        data = self._load()
+
+        result = {}
+        if 'severity' in sections:
+            result['severity_analysis'] = self._severity_analysis(data)
+        if 'medication' in sections:
+            result['medication_analysis'] = self._medication_analysis(data)
+        if 'temporal' in sections:
+            result['temporal_analysis'] = self._temporal_analysis(data)
+        if 'type' in sections:
+            result['type_analysis'] = self._type_analysis(data)
+        if 'correlations' in sections:
+            result.update(self._correlations(data))
+        return result
+
+    def _load(self):
+        """Leer el queryset una sola vez y devolver las columnas codificadas"""
+        severity_codes = {code: index for index, code in enumerate(self.SEVERITIES)}
+        type_codes = {code: index for index, code in enumerate(self.TYPES)}
+        routes = {}
+        maestros = {}
+        maestro_names = []
+        tz = timezone.get_current_timezone()
+
+        columns = {name: [] for name in ('severity', 'type', 'route', 'maestro', 'day', 'month', 'resolution')}
+        rows = self.queryset.order_by().values_list(*self.FIELDS)
+        for severity, effect_type, route, maestro_id, maestro_name, reported_at, resolution_time in rows.iterator(chunk_size=self.chunk_size):
+            if maestro_id not in maestros:
+                maestros[maestro_id] = len(maestro_names)
+                maestro_names.append(maestro_name)
+            reported_at = reported_at.astimezone(tz)
+
+            columns['severity'].append(severity_codes.get(severity, -1))
+            columns['type'].append(type_codes.get(effect_type, -1))
+            columns['route'].append(routes.setdefault(route, len(routes)))
+            columns['maestro'].append(maestros[maestro_id])
+            columns['day'].append(reported_at.toordinal())
+            columns['month'].append(reported_at.year * 12 + reported_at.month - 1)
+            columns['resolution'].append(resolution_time.total_seconds() if resolution_time is not None else np.nan)
+
+        data = {name: np.asarray(values, dtype=np.float64 if name == 'resolution' else np.int64)
+                for name, values in columns.items()}
+        data['routes'] = list(routes)
+        data['maestro_names'] = maestro_names
+        data['severe'] = np.isin(data['severity'], [severity_codes[code] for code in self.SEVERE])
+        return data
+
+    @staticmethod
+    def _crosstab(rows, columns, n_rows, n_columns, mask=None):
+        """Tabla de contingencia n_rows x n_columns de dos columnas codificadas"""
+        if mask is not None:
+            rows, columns = rows[mask], columns[mask]
+        valid = (rows >= 0) & (columns >= 0)
+        flat = rows[valid] * n_columns + columns[valid]
+        return np.bincount(flat, minlength=n_rows * n_columns).reshape(n_rows, n_columns)
+
+    def _severity_analysis(self, data):
+        """Análisis por severidad"""
+        n_severities = len(self.SEVERITIES)
+        valid = data['severity'] >= 0
+        counts = np.bincount(data['severity'][valid], minlength=n_severities)
+
+        resolved = valid & ~np.isnan(data['resolution'])
+        resolved_counts = np.bincount(data['severity'][resolved], minlength=n_severities)
+        resolution_totals = np.bincount(
+            data['severity'][resolved], weights=data['resolution'][resolved], minlength=n_severities
+        )
+
+        total = counts.sum()
+        analysis = [{
+            'severity': severity,
+            'count': int(counts[index]),
+            'percentage': counts[index] * 100.0 / total,
+            'avg_resolution_time': (
+                timedelta(seconds=resolution_totals[index] / resolved_counts[index])
+                if resolved_counts[index] else None
+            )
+        } for index, severity in enumerate(self.SEVERITIES) if counts[index]]
+        return sorted(analysis, key=lambda row: (-row['count'], row['severity']))
+
+    def _medication_analysis(self, data):
+        """Análisis por medicamento"""
+        n_maestros = len(data['maestro_names'])
+        if not n_maestros:
+            return []
+
+        maestro = data['maestro']
+        totals = np.bincount(maestro, minlength=n_maestros)
+        severe = np.bincount(maestro[data['severe']], minlength=n_maestros)
+        by_type = self._crosstab(maestro, data['type'], n_maestros, len(self.TYPES))
+
+        first_day = np.full(n_maestros, np.iinfo(np.int64).max)
+        last_day = np.full(n_maestros, np.iinfo(np.int64).min)
+        np.minimum.at(first_day, maestro, data['day'])
+        np.maximum.at(last_day, maestro, data['day'])
+
+        analysis = [{
+            'medication__medicamento_maestro__nombre': name,
+            'total_reports': int(totals[index]),
+            'severe_cases': int(severe[index]),
+            'most_common_type': self.TYPES[int(np.argmax(by_type[index]))],
+            'first_reported': date.fromordinal(int(first_day[index])),
+            'last_reported': date.fromordinal(int(last_day[index]))
+        } for index, name in enumerate(data['maestro_names'])]
+        return sorted(analysis, key=lambda row: (-row['total_reports'], row['medication__medicamento_maestro__nombre']))
+
+    def _temporal_analysis(self, data):
+        """Análisis temporal"""
+        months, month_counts = np.unique(data['month'], return_counts=True)
+        # El ordinal 1 (0001-01-01) es lunes: restar el día de la semana da el lunes
+        mondays = data['day'] - (data['day'] + 6) % 7
+        weeks, week_counts = np.unique(mondays, return_counts=True)
+
+        return {
+            'monthly': [{
+                'month': date(int(month) // 12, int(month) % 12 + 1, 1),
+                'count': int(count)
+            } for month, count in zip(months, month_counts)],
+            'weekly': [{
+                'week': date.fromordinal(int(week)),
+                'count': int(count)
+            } for week, count in zip(weeks, week_counts)]
+        }
+
+    def _type_analysis(self, data):
+        """Análisis por tipo de efecto"""
+        n_types = len(self.TYPES)
+        valid = data['type'] >= 0
+        counts = np.bincount(data['type'][valid], minlength=n_types)
+        severe = np.bincount(data['type'][valid & data['severe']], minlength=n_types)
+        by_medication = self._crosstab(data['type'], data['maestro'], n_types, len(data['maestro_names']))
+
+        analysis = [{
+            'type': effect_type,
+            'count': int(counts[index]),
+            'severe_cases': int(severe[index]),
+            'medications_affected': int(np.count_nonzero(by_medication[index]))
+        } for index, effect_type in enumerate(self.TYPES) if counts[index]]
+        return sorted(analysis, key=lambda row: (-row['count'], row['type']))
+
+    def _correlations(self, data):
+        """Tablas cruzadas severidad x tipo, tipo x medicamento y severidad x vía"""
+        n_severities, n_types = len(self.SEVERITIES), len(self.TYPES)
+        n_maestros, n_routes = len(data['maestro_names']), len(data['routes'])
+
+        severity_type = self._crosstab(data['severity'], data['type'], n_severities, n_types)
+        type_medication = self._crosstab(data['type'], data['maestro'], n_types, n_maestros)
+        severity_route = self._crosstab(data['severity'], data['route'], n_severities, n_routes)
+
+        type_by_medication = [{
+            'type': self.TYPES[row],
+            'medication__medicamento_maestro__nombre': data['maestro_names'][column],
+            'count': int(type_medication[row, column])
+        } for row, column in zip(*np.nonzero(type_medication))]
+
+        severity_by_route = []
+        for row in range(n_severities):
+            # Dentro de cada severidad, vías ordenadas por número de reportes
+            for column in np.argsort(-severity_route[row], kind='stable'):
+                if severity_route[row, column]:
+                    severity_by_route.append({
+                        'severity': self.SEVERITIES[row],
+                        'administration_route': data['routes'][column],
+                        'count': int(severity_route[row, column])
+                    })
+
+        return {
+            'severity_by_type': [{
+                'severity': self.SEVERITIES[row],
+                'type': self.TYPES[column],
+                'count': int(severity_type[row, column])
+            } for row, column in zip(*np.nonzero(severity_type))],
+            'type_by_medication': sorted(type_by_medication, key=lambda row: -row['count']),
+            'severity_by_route': severity_by_route
+        }
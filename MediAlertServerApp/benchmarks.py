@@ -0,0 +1,168 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .models import Institution, MedicamentoMaestro, Medicamento, AdverseEffect, UserProfile, Recordatorio, RegistroToma
+
+@contextmanager
+def rolled_back():
+    """Ejecutar el bloque en una transacción que siempre se deshace"""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+def measure(function, repeat=3):
+    """
+    Medir function() varias veces
+    
+    Returns:
+        tuple: (mejor tiempo en segundos, consultas ejecutadas en una llamada)
+    """
+    best = None
+    queries = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        queries = len(captured)
+    return best, queries
+
+def create_synthetic_reports(count, medications=50, days=365, seed=0):
+    """
+    Crear una institución, un paciente, medicamentos y count reportes sintéticos
+    
+    Se usa bulk_create, así que no se mantienen agregados ni contadores: los datos
+    solo sirven para medir consultas dentro de rolled_back().
+    
+    Returns:
+        Institution: Institución a la que pertenecen los reportes
+    """
+    rng = random.Random(seed)
+    institution = Institution.objects.create(name=f'Benchmark {timezone.now().timestamp()}')
+    patient = User.objects.create_user(f'benchmark_{timezone.now().timestamp()}')
+
+    maestros = MedicamentoMaestro.objects.bulk_create([
+        MedicamentoMaestro(nombre=f'Medicamento {index}', dosis='10 mg', principio_activo=f'Principio {index % 10}')
+        for index in range(medications)
+    ])
+    medicamentos = Medicamento.objects.bulk_create([
+        Medicamento(medicamento_maestro=maestro, usuario=patient) for maestro in maestros
+    ])
+
+    severities = [code for code, _ in AdverseEffect.SEVERITY_CHOICES]
+    statuses = [code for code, _ in AdverseEffect.STATUS_CHOICES]
+    routes = ['Oral', 'Intravenosa', 'Tópica', 'Subcutánea']
+    effects = []
+    for _ in range(count):
+        effect_status = rng.choice(statuses)
+        resolved = effect_status in AdverseEffect.RESOLVED_STATUSES
+        effects.append(AdverseEffect(
+            patient=patient,
+            medication=rng.choice(medicamentos),
+            description=f'Reacción sintética {rng.randint(0, 10 ** 6)}',
+            start_date=timezone.localdate(),
+            severity=rng.choice(severities),
+            type=rng.choice('AB'),
+            administration_route=rng.choice(routes),
+            dosage='1 comprimido',
+            frequency='Cada 8 horas',
+            status=effect_status,
+            resolution_time=timedelta(hours=rng.randint(1, 500)) if resolved else None,
+            institution=institution
+        ))
+    AdverseEffect.objects.bulk_create(effects, batch_size=1000)
+
+    # auto_now_add fija la fecha actual: repartir los reportes en el periodo indicado
+    ids = list(AdverseEffect.objects.filter(institution=institution).values_list('id', flat=True))
+    now = timezone.now()
+    for offset in range(min(days, len(ids))):
+        AdverseEffect.objects.filter(pk__in=ids[offset::days]).update(reported_at=now - timedelta(days=offset))
+    resolved = AdverseEffect.objects.filter(institution=institution, resolution_time__isnull=False)
+    resolved.update(resolved_at=F('reported_at') + F('resolution_time'))
+    # Ningún caso puede resolverse en el futuro
+    resolved.filter(resolved_at__gt=now).update(resolved_at=now)
+
+    return institution
+
+def create_synthetic_adherence(patients, days=30, doses_per_day=2, medications=50, seed=0):
+    """
+    Crear una institución con patients pacientes y sus registros de toma de los
+    últimos days días (doses_per_day tomas diarias por paciente)
+
+    Igual que create_synthetic_reports usa bulk_create: no se mantienen agregados
+    de adherencia y los datos solo sirven dentro de rolled_back().
+
+    Returns:
+        Institution: Institución de los pacientes
+    """
+    rng = random.Random(seed)
+    stamp = timezone.now().timestamp()
+    institution = Institution.objects.create(name=f'Benchmark adherencia {stamp}')
+
+    users = User.objects.bulk_create([User(username=f'adherence_{stamp}_{index}') for index in range(patients)])
+    UserProfile.objects.bulk_create([
+        UserProfile(user=user, user_type='PATIENT', institution=institution) for user in users
+    ])
+    maestros = MedicamentoMaestro.objects.bulk_create([
+        MedicamentoMaestro(nombre=f'Medicamento {index}', dosis='10 mg') for index in range(medications)
+    ])
+    medicamentos = Medicamento.objects.bulk_create([
+        Medicamento(medicamento_maestro=rng.choice(maestros), usuario=user) for user in users
+    ])
+    hours = [8, 14, 20, 23][:doses_per_day]
+    recordatorios = Recordatorio.objects.bulk_create([
+        Recordatorio(usuario=medicamento.usuario, medicamento=medicamento, dosis='1', hora=dt_time(hour))
+        for medicamento in medicamentos for hour in hours
+    ])
+
+    today = timezone.localdate()
+    estados = ['TOMADO'] * 16 + ['OMITIDO'] * 3 + ['POSPUESTO']
+    batch = []
+    for recordatorio in recordatorios:
+        for offset in range(1, days + 1):
+            fecha_programada = timezone.make_aware(datetime.combine(today - timedelta(days=offset), recordatorio.hora))
+            estado = rng.choice(estados)
+            batch.append(RegistroToma(
+                recordatorio=recordatorio,
+                fecha_programada=fecha_programada,
+                estado=estado,
+                fecha_toma=fecha_programada + timedelta(minutes=rng.gauss(10, 25)) if estado == 'TOMADO' else None
+            ))
+        if len(batch) >= 5000:
+            RegistroToma.objects.bulk_create(batch)
+            batch = []
+    RegistroToma.objects.bulk_create(batch)
+
+    return institution
+
+def create_synthetic_lists(rows):
+    """
+    Datos sintéticos para las listas principales de la API
+
+    Returns:
+        dict: Endpoint -> queryset de unas rows filas (medicamentos-maestros,
+        registros-toma y adverse-effects)
+    """
+    MedicamentoMaestro.objects.bulk_create([
+        MedicamentoMaestro(nombre=f'Benchmark {index}', dosis='10 mg', forma_farmaceutica='Comprimido',
+                           principio_activo=f'Principio {index % 10}', via_administracion='Oral')
+        for index in range(rows)
+    ])
+    patients = create_synthetic_adherence(max(1, rows // 60), days=30)
+    reports = create_synthetic_reports(rows)
+    return {
+        'medicamentos-maestros': MedicamentoMaestro.objects.filter(nombre__startswith='Benchmark ')[:rows],
+        'registros-toma': RegistroToma.objects.filter(
+            recordatorio__usuario__profile__institution=patients
+        ).select_related('recordatorio__medicamento__medicamento_maestro')[:rows],
+        'adverse-effects': AdverseEffect.objects.filter(
+            institution=reports
+        ).select_related('medication__medicamento_maestro')[:rows],
+    }
@@ -0,0 +1,96 @@
+import hashlib
+import json
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Sum
+from django.utils import timezone
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from .models import Institution
+
+def etag_matches(request, etag):
+    """
+    Si If-None-Match incluye etag. Comparación débil: la compresión de la
+    respuesta (CompressionMiddleware) devuelve el mismo ETag como W/"..."
+    """
+    return any(tag.removeprefix('W/') == etag for tag in parse_etags(request.headers.get('If-None-Match', '')))
+
+def get_data_version(user, field='data_version'):
+    """
+    Versión de los datos visibles para el usuario.
+    Admins: todas las instituciones; resto: la institución de su perfil.
+    field: data_version (reportes) o adherence_version (registros de toma)
+    """
+    profile = user.profile
+    if profile.user_type == 'ADMIN':
+        totals = Institution.objects.aggregate(version=Sum(field), institutions=Count('id'))
+        return f"all:{totals['institutions']}:{totals['version'] or 0}"
+
+    version = Institution.objects.filter(pk=profile.institution_id).values_list(field, flat=True).first()
+    return f"{profile.institution_id}:{version or 0}"
+
+def versioned_cache(endpoint, version_field='data_version', per_user=False):
+    """
+    Cachear la respuesta de un endpoint de solo lectura por ámbito y versión de datos.
+    
+    La clave combina endpoint, rol, versión de la institución, fecha y parámetros
+    normalizados; el mismo valor se devuelve como ETag para responder 304 a
+    peticiones con If-None-Match sin recalcular nada.
+
+    La clave no distingue usuarios de la misma institución y rol: los endpoints
+    cuya respuesta depende del usuario (sus registros, sus reportes) deben usar
+    per_user=True, que añade el id del usuario a la clave.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            params = sorted((key, sorted(request.query_params.getlist(key))) for key in request.query_params)
+            fingerprint = json.dumps([
+                endpoint,
+                request.user.profile.user_type,
+                request.user.pk if per_user else None,
+                get_data_version(request.user, version_field),
+                str(timezone.localdate()),
+                params,
+                sorted((key, str(value)) for key, value in kwargs.items())
+            ])
+            digest = hashlib.sha256(fingerprint.encode()).hexdigest()[:32]
+            etag = f'"{digest}"'
+
+            if etag_matches(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                cache_key = f'dashboard:{endpoint}:{digest}'
+                data = cache.get(cache_key)
+                if data is None:
+                    response = view_method(self, request, *args, **kwargs)
+                    if response.status_code != status.HTTP_200_OK:
+                        return response
+                    cache.set(cache_key, response.data, settings.DASHBOARD_CACHE_TIMEOUT)
+                else:
+                    response = Response(data)
+
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def content_etag(data):
+    """ETag del contenido de una respuesta (igual mientras los datos no cambien)"""
+    payload = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)
+    return f'"{hashlib.sha256(payload.encode()).hexdigest()[:32]}"'
+
+def etag_response(request, data):
+    """Response con ETag del contenido, o 304 si coincide con If-None-Match"""
+    etag = content_etag(data)
+    if etag_matches(request, etag):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(data)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
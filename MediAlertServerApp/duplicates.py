@@ -0,0 +1,122 @@
+import hashlib
+import re
+import unicodedata
+import zlib
+import numpy as np
+from .models import AdverseEffect, AdverseEffectSignature, LSHBucket
+
+class DuplicateDetector:
+    """
+    Detección de reportes casi duplicados con MinHash y LSH por bandas.
+    
+    Cada reporte se convierte en un conjunto de shingles (n-gramas de caracteres de
+    la descripción normalizada más rasgos de medicamento y fecha de inicio). La firma
+    MinHash se divide en bandas; los reportes que comparten el hash de alguna banda
+    son candidatos y solo contra ellos se estima la similitud de Jaccard, sin
+    comparar con todo el histórico.
+    """
+    NUM_PERMUTATIONS = 64
+    BANDS = 16
+    SHINGLE_SIZE = 4
+    # Copias de cada rasgo para que medicamento y fecha pesen frente al texto
+    FEATURE_WEIGHT = 5
+    THRESHOLD = 0.6
+
+    PRIME = (1 << 31) - 1
+    SEED = 20240101
+
+    def __init__(self, threshold=THRESHOLD):
+        self.threshold = threshold
+        self.rows = self.NUM_PERMUTATIONS // self.BANDS
+        rng = np.random.default_rng(self.SEED)
+        self.a = rng.integers(1, self.PRIME, size=(self.NUM_PERMUTATIONS, 1), dtype=np.uint64)
+        self.b = rng.integers(0, self.PRIME, size=(self.NUM_PERMUTATIONS, 1), dtype=np.uint64)
+
+    @staticmethod
+    def normalize(text):
+        """Minúsculas, sin tildes ni signos y con espacios simples"""
+        text = unicodedata.normalize('NFKD', text or '')
+        text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+        return re.sub(r'[^a-z0-9]+', ' ', text).strip()
+
+    def shingles(self, description, medication_id, start_date):
+        """Conjunto de shingles del reporte"""
+        text = self.normalize(description)
+        size = self.SHINGLE_SIZE
+        tokens = {text[index:index + size] for index in range(max(len(text) - size + 1, 1))}
+        for copy in range(self.FEATURE_WEIGHT):
+            tokens.add(f'\x00med:{medication_id}:{copy}')
+            tokens.add(f'\x00start:{start_date}:{copy}')
+        return tokens
+
+    def signature(self, tokens):
+        """Firma MinHash (uint32) de un conjunto de shingles"""
+        hashes = np.fromiter((zlib.crc32(token.encode()) for token in tokens), dtype=np.uint64, count=len(tokens))
+        hashes %= np.uint64(self.PRIME)
+        return ((self.a * hashes + self.b) % np.uint64(self.PRIME)).min(axis=1).astype(np.uint32)
+
+    def buckets(self, signature):
+        """Un hash de 64 bits por banda (incluye el número de banda)"""
+        result = []
+        for band in range(self.BANDS):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            digest = hashlib.blake2b(chunk, digest_size=8, salt=band.to_bytes(2, 'little')).digest()
+            result.append(int.from_bytes(digest, 'little', signed=True))
+        return result
+
+    def signature_for(self, effect):
+        return self.signature(self.shingles(effect.description, effect.medication_id, effect.start_date))
+
+    def find_duplicate(self, signature, buckets, institution_id, exclude_id=None):
+        """
+        Buscar entre los reportes indexados de la institución el más parecido por encima del umbral
+
+        Returns:
+            tuple: (id del reporte, similitud estimada) o (None, None)
+        """
+        candidates = set(LSHBucket.objects.filter(
+            bucket__in=buckets, adverse_effect__institution_id=institution_id
+        ).values_list('adverse_effect_id', flat=True))
+        candidates.discard(exclude_id)
+        if not candidates:
+            return None, None
+
+        signatures = AdverseEffectSignature.objects.filter(adverse_effect_id__in=candidates).values_list(
+            'adverse_effect_id', 'signature'
+        )
+        return self._best_match(signature, [
+            (effect_id, np.frombuffer(bytes(stored), dtype=np.uint32)) for effect_id, stored in signatures
+        ])
+
+    def _best_match(self, signature, candidates):
+        best_id, best_score = None, None
+        for effect_id, other in candidates:
+            score = float(np.mean(signature == other))
+            # En empate gana el reporte más antiguo (id menor)
+            if score >= self.threshold and (best_score is None or (score, -effect_id) > (best_score, -best_id)):
+                best_id, best_score = effect_id, score
+        return best_id, best_score
+
+    def index(self, effect, flag=True):
+        """
+        Indexar un reporte y, si flag, marcarlo como duplicado del reporte más parecido
+
+        Returns:
+            tuple: (id del reporte original, similitud) o (None, None)
+        """
+        signature = self.signature_for(effect)
+        buckets = self.buckets(signature)
+
+        duplicate_of, score = (None, None)
+        if flag:
+            duplicate_of, score = self.find_duplicate(signature, buckets, effect.institution_id, exclude_id=effect.pk)
+            if duplicate_of:
+                AdverseEffect.objects.filter(pk=effect.pk).update(duplicate_of_id=duplicate_of, duplicate_score=score)
+                effect.duplicate_of_id, effect.duplicate_score = duplicate_of, score
+
+        AdverseEffectSignature.objects.update_or_create(
+            adverse_effect_id=effect.pk, defaults={'signature': signature.tobytes()}
+        )
+        LSHBucket.objects.filter(adverse_effect_id=effect.pk).delete()
+        LSHBucket.objects.bulk_create([LSHBucket(bucket=bucket, adverse_effect_id=effect.pk) for bucket in buckets])
+        return duplicate_of, score
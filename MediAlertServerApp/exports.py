@@ -0,0 +1,154 @@
+import csv
+import zlib
+from datetime import datetime, timedelta
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils.duration import duration_string
+from .models import AdverseEffect
+
+class Echo:
+    """Pseudo-fichero para csv.writer: devuelve la línea en lugar de guardarla"""
+    def write(self, value):
+        return value
+
+def gzip_stream(chunks, level=6):
+    """Comprimir en gzip un flujo de bloques de texto sin acumularlo"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def join_chunks(lines, chunk_size):
+    """Agrupar líneas de texto en bloques de hasta chunk_size líneas"""
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+def wants_gzip(request):
+    """Salida comprimida si se pide con ?compress=gzip"""
+    return request.query_params.get('compress', '').lower() == 'gzip'
+
+def streaming_response(chunks, filename, content_type, compress=False):
+    """
+    Respuesta en streaming con descarga como adjunto
+
+    Args:
+        chunks (iterable): Bloques de texto
+        filename (str): Nombre del fichero sin comprimir
+        content_type (str): Tipo MIME del contenido sin comprimir
+        compress (bool): Comprimir en gzip (se añade .gz al nombre)
+
+    Returns:
+        StreamingHttpResponse
+    """
+    if compress:
+        response = StreamingHttpResponse(gzip_stream(chunks), content_type='application/gzip')
+        filename = f'{filename}.gz'
+    else:
+        response = StreamingHttpResponse((chunk.encode('utf-8') for chunk in chunks), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+class AdverseEffectCSVExport:
+    """
+    Exportación CSV de reportes en streaming.
+
+    Lee una proyección values_list (medicamento incluido en la misma consulta) con
+    iterator(chunk_size) y emite el CSV por bloques de filas, de modo que la memoria
+    no depende del tamaño de la exportación y el primer byte sale de inmediato.
+    """
+    HEADER = ['Fecha', 'Medicamento', 'Severidad', 'Tipo', 'Descripción', 'Estado']
+    FIELDS = ('reported_at', 'medication__medicamento_maestro__nombre', 'severity', 'type', 'description', 'status')
+
+    def __init__(self, queryset, chunk_size=2000):
+        self.queryset = queryset
+        self.chunk_size = chunk_size
+
+    def rows(self):
+        yield self.HEADER
+        for reported_at, medication, severity, effect_type, description, effect_status in \
+                self.queryset.values_list(*self.FIELDS).iterator(chunk_size=self.chunk_size):
+            yield [reported_at.strftime('%Y-%m-%d'), medication, severity, effect_type, description, effect_status]
+
+    def chunks(self):
+        """Bloques de texto CSV de hasta chunk_size filas"""
+        writer = csv.writer(Echo())
+        return join_chunks((writer.writerow(row) for row in self.rows()), self.chunk_size)
+
+    def response(self, filename, compress=False):
+        return streaming_response(self.chunks(), filename, 'text/csv', compress=compress)
+
+class ExportJSONEncoder(DjangoJSONEncoder):
+    """Fechas con hora y duraciones con el mismo formato que los serializers de DRF"""
+    def default(self, o):
+        if isinstance(o, datetime):
+            value = o.isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        if isinstance(o, timedelta):
+            return duration_string(o)
+        return super().default(o)
+
+class AdverseEffectJSONExport:
+    """
+    Exportación JSON de reportes en streaming, como array JSON o NDJSON.
+
+    Cada fila sale de una proyección values() con solo los campos pedidos y se
+    serializa por separado, así que nunca se tiene en memoria la lista completa.
+    Las claves coinciden con las de AdverseEffectSerializer (relaciones como id).
+    """
+    MODES = ('json', 'ndjson')
+    CONTENT_TYPES = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
+
+    # Campo de salida -> ruta ORM
+    FIELDS = dict(
+        [(field.name, field.attname) for field in AdverseEffect._meta.concrete_fields] +
+        [('medicamento_nombre', 'medication__medicamento_maestro__nombre')]
+    )
+
+    def __init__(self, queryset, fields=None, mode='json', chunk_size=2000):
+        fields = list(fields or self.FIELDS)
+        unknown = [field for field in fields if field not in self.FIELDS]
+        if unknown:
+            raise ValueError(f'Campos no válidos: {", ".join(unknown)}')
+        if mode not in self.MODES:
+            raise ValueError(f'Modo no válido: {mode}')
+
+        self.queryset = queryset
+        self.fields = fields
+        self.mode = mode
+        self.chunk_size = chunk_size
+
+    def objects(self):
+        """Filas como diccionarios con los nombres de salida"""
+        paths = [self.FIELDS[field] for field in self.fields]
+        for values in self.queryset.values_list(*paths).iterator(chunk_size=self.chunk_size):
+            yield dict(zip(self.fields, values))
+
+    def lines(self):
+        encoder = ExportJSONEncoder(ensure_ascii=False)
+        if self.mode == 'ndjson':
+            for row in self.objects():
+                yield encoder.encode(row) + '\n'
+            return
+
+        separator = '[\n'
+        for row in self.objects():
+            yield separator + encoder.encode(row)
+            separator = ',\n'
+        yield '[]\n' if separator == '[\n' else '\n]\n'
+
+    def chunks(self):
+        return join_chunks(self.lines(), self.chunk_size)
+
+    def response(self, filename, compress=False):
+        extension = 'ndjson' if self.mode == 'ndjson' else 'json'
+        return streaming_response(
+            self.chunks(), f'{filename}.{extension}', self.CONTENT_TYPES[self.mode], compress=compress
+        )
@@ -0,0 +1,189 @@
+from django.db.models import F
+from rest_framework import ISO_8601, serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+FIELDS_PARAM = 'fields'
+EXCLUDE_PARAM = 'exclude'
+
+def requested_fields(request, available):
+    """
+    Campos pedidos con ?fields=a,b y/o ?exclude=c. Un nombre desconocido o una
+    selección vacía (?fields= sin nombres, o excluir todos los pedidos) es un 400
+
+    Returns:
+        list: Nombres de available que se deben devolver, en su orden original
+    """
+    def names(param):
+        value = request.query_params.get(param)
+        if value is None:
+            return None
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise ParseError(f'Campos no válidos en {param}: {", ".join(unknown)}')
+        return set(names)
+
+    fields, exclude = names(FIELDS_PARAM), names(EXCLUDE_PARAM)
+    selected = [
+        name for name in available
+        if (fields is None or name in fields) and (exclude is None or name not in exclude)
+    ]
+    if not selected:
+        raise ParseError(f'La selección de campos ({FIELDS_PARAM} / {EXCLUDE_PARAM}) está vacía')
+    return selected
+
+class SparseFieldsetMixin:
+    """
+    Serializer con campos a elegir por el cliente (?fields= / ?exclude=) en las
+    peticiones GET. Solo se aplica al serializer raíz, que es el que recibe el
+    request en el contexto.
+
+    values_lookups relaciona los campos calculados (SerializerMethodField) con la
+    consulta ORM equivalente, para que la lista pueda leerse con values()
+    (ValuesRepresentation).
+    """
+    values_lookups = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        if FIELDS_PARAM not in request.query_params and EXCLUDE_PARAM not in request.query_params:
+            return
+        readable = [name for name, field in self.fields.items() if not field.write_only]
+        selected = set(requested_fields(request, readable))
+        for name in readable:
+            if name not in selected:
+                self.fields.pop(name)
+
+class ValuesRepresentation:
+    """
+    Serialización de listas de solo lectura a partir de filas de values().
+
+    Lee únicamente las columnas de los campos del serializer (ya recortados por
+    ?fields= / ?exclude=) y construye cada diccionario directamente, sin instancias
+    del modelo ni el recorrido por campo de Serializer.to_representation; solo los
+    tipos que DRF formatea (fechas, duraciones, decimales) pasan por su campo. La
+    salida es la misma que la del serializer.
+    """
+    # Campos cuyo valor de values() ya es su representación
+    PASSTHROUGH = (
+        serializers.CharField,
+        serializers.ChoiceField,
+        serializers.IntegerField,
+        serializers.BooleanField,
+        serializers.FloatField,
+        serializers.PrimaryKeyRelatedField,
+        serializers.JSONField,
+        serializers.ReadOnlyField,
+        serializers.SerializerMethodField,
+    )
+
+    def __init__(self, fields, plain, annotations):
+        self.fields = fields
+        self.plain = plain
+        self.annotations = annotations
+
+    @classmethod
+    def for_serializer(cls, serializer):
+        """
+        Plan de lectura para un serializer, o None si algún campo no tiene consulta
+        equivalente (se usará el serializer completo)
+        """
+        if type(serializer).to_representation is not serializers.ModelSerializer.to_representation:
+            return None
+
+        model = serializer.Meta.model
+        concrete = {field.name for field in model._meta.concrete_fields}
+        lookups = getattr(serializer, 'values_lookups', {})
+
+        fields, plain, annotations = [], [], {}
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, (serializers.BaseSerializer, serializers.ManyRelatedField)):
+                return None
+            if name in lookups:
+                lookup = lookups[name]
+            elif isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+                return None
+            else:
+                lookup = field.source.replace('.', '__')
+
+            if lookup in concrete:
+                key = lookup
+                plain.append(lookup)
+            else:
+                key = f'_{name}'
+                annotations[key] = F(lookup)
+
+            if isinstance(field, cls.PASSTHROUGH):
+                to_representation = None
+            elif isinstance(field, serializers.DateTimeField):
+                to_representation = cls._datetime_representation(field)
+            else:
+                to_representation = field.to_representation
+            fields.append((name, key, to_representation))
+        return cls(fields, plain, annotations)
+
+    @staticmethod
+    def _datetime_representation(field):
+        """
+        DateTimeField.to_representation con la zona horaria resuelta una sola vez
+        (DRF la vuelve a buscar en cada valor); mismo resultado en formato ISO 8601
+        """
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+            return field.to_representation
+
+        def to_representation(value):
+            if value.tzinfo is None:
+                return field.to_representation(value)
+            value = value.astimezone(field_timezone).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return to_representation
+
+    def values(self, queryset, extra=()):
+        """Queryset de values() con las columnas del plan y las de extra (p. ej. la ordenación)"""
+        plain = list(dict.fromkeys([*self.plain, *extra]))
+        return queryset.values(*plain, **self.annotations)
+
+    def represent(self, row):
+        data = {}
+        for name, key, to_representation in self.fields:
+            value = row[key]
+            data[name] = to_representation(value) if to_representation is not None and value is not None else value
+        return data
+
+class ValuesListMixin:
+    """
+    ViewSet cuyas listas se sirven con ValuesRepresentation cuando el serializer
+    lo permite (y con el serializer completo si no). list() lo usa siempre; las
+    acciones de lista pueden llamar a list_response().
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.list_response(self.filter_queryset(self.get_queryset()))
+
+    def list_response(self, queryset, paginate=True):
+        serializer = self.get_serializer()
+        plan = ValuesRepresentation.for_serializer(serializer)
+        paginator = self.paginator if paginate else None
+
+        if plan is None:
+            page = paginator.paginate_queryset(queryset, self.request, view=self) if paginator else None
+            data = self.get_serializer(page if page is not None else queryset, many=True).data
+        else:
+            # Las columnas de la ordenación del cursor se leen aunque no se devuelvan
+            ordering = getattr(self, 'cursor_ordering', getattr(paginator, 'ordering', ()))
+            queryset = plan.values(queryset, extra=[field.lstrip('-') for field in ordering] if paginator else ())
+            page = paginator.paginate_queryset(queryset, self.request, view=self) if paginator else None
+            data = [plan.represent(row) for row in (page if page is not None else queryset)]
+
+        if page is not None:
+            return paginator.get_paginated_response(data)
+        return Response(data)
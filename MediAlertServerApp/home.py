@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Medicamento, RegistroToma, AlertNotification, AdverseEffect
+from .services import RecordatorioService
+
+class HomeScreen:
+    """
+    Datos de la pantalla de inicio de la app en una sola respuesta: usuario y
+    permisos, medicamentos, tomas de hoy, registros recientes, notificaciones no
+    leídas y últimos reportes de efectos adversos.
+
+    Cada bloque se lee con un número fijo de consultas y proyección values() (sin
+    serializers ni objetos por fila) y las listas se limitan a HOME_LIST_LIMIT
+    filas, así que ni las consultas ni el tamaño de la respuesta crecen con el
+    historial del paciente.
+    """
+
+    def __init__(self, user, days=None):
+        self.user = user
+        self.days = days or settings.HOME_HISTORY_DAYS
+        self.limit = settings.HOME_LIST_LIMIT
+
+    def data(self):
+        return {
+            'user': self.user_data(),
+            'medicamentos': self.medicamentos(),
+            'today': self.today(),
+            'registros': self.registros(),
+            'notifications': self.notifications(),
+            'adverse_effects': self.adverse_effects(),
+        }
+
+    def user_data(self):
+        """Lo mismo que users/me/, con los permisos en una sola consulta"""
+        user = self.user
+        profile = user.profile
+        if user.is_superuser:
+            permissions = Permission.objects.all()
+        else:
+            permissions = Permission.objects.filter(Q(user=user) | Q(group__user=user)).distinct()
+        permissions = sorted(
+            f'{app_label}.{codename}'
+            for app_label, codename in permissions.values_list('content_type__app_label', 'codename')
+        )
+        return {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'user_type': profile.user_type,
+            'institution': profile.institution_id,
+            'data_protection_accepted': profile.data_protection_accepted,
+            'permissions': permissions,
+        }
+
+    def medicamentos(self):
+        return list(Medicamento.objects.filter(usuario=self.user).order_by('id').values(
+            'id',
+            'dosis_personalizada',
+            'frecuencia_personalizada',
+            'medicamento_maestro',
+            'updated_at',
+            nombre=F('medicamento_maestro__nombre'),
+        ))
+
+    def today(self):
+        """Tomas de hoy, como recordatorios/today/ pero sin los datos completos del recordatorio"""
+        start = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+        return [
+            {
+                'recordatorio': recordatorio.id,
+                'medicamento': recordatorio.medicamento_id,
+                'medicamento_nombre': recordatorio.medicamento.medicamento_maestro.nombre,
+                'dosis': recordatorio.dosis,
+                'fecha_programada': fecha_programada,
+                'registro': registro_id,
+                'estado': estado,
+            }
+            for recordatorio, fecha_programada, registro_id, estado in RecordatorioService.schedule(
+                self.user, start, start + timedelta(days=1)
+            )
+        ]
+
+    def registros(self):
+        """Registros de toma de los últimos days días (como registros-toma/by_date_range/)"""
+        now = timezone.now()
+        return list(RegistroToma.objects.filter(
+            recordatorio__usuario=self.user,
+            fecha_programada__gte=now - timedelta(days=self.days),
+            fecha_programada__lte=now
+        ).order_by('-fecha_programada', '-id').values(
+            'id',
+            'fecha_programada',
+            'fecha_toma',
+            'estado',
+            'recordatorio',
+            medicamento_nombre=F('recordatorio__medicamento__medicamento_maestro__nombre'),
+        )[:self.limit])
+
+    def notifications(self):
+        return list(AlertNotification.objects.filter(
+            recipient=self.user, read_at__isnull=True
+        ).order_by('-created_at').values(
+            'id',
+            'title',
+            'message',
+            'priority',
+            'created_at',
+            'adverse_effect',
+        )[:self.limit])
+
+    def adverse_effects(self):
+        """Últimos reportes del paciente (los mismos que adverse-effects/ para un paciente)"""
+        return list(AdverseEffect.objects.filter(
+            patient=self.user, institution_id=self.user.profile.institution_id
+        ).order_by('-reported_at', '-id').values(
+            'id',
+            'severity',
+            'type',
+            'status',
+            'reported_at',
+            medicamento_nombre=F('medication__medicamento_maestro__nombre'),
+        )[:self.limit])
@@ -0,0 +1,186 @@
+import io
+import re
+import unicodedata
+from datetime import datetime
+from xml.sax.saxutils import XMLGenerator
+from django.utils import timezone
+
+# Códigos de vía de administración de E2B(R2) (campo drugadministrationroute)
+ROUTE_CODES = {
+    'oral': '048',
+    'intravenosa': '042',
+    'intravenous': '042',
+    'intramuscular': '030',
+    'subcutanea': '058',
+    'subcutaneous': '058',
+    'topica': '061',
+    'topical': '061',
+    'transdermica': '062',
+    'transdermal': '062',
+    'inhalatoria': '055',
+    'inhalation': '055',
+    'rectal': '054',
+    'oftalmica': '047',
+    'ophthalmic': '047',
+    'nasal': '045',
+    'sublingual': '060',
+    'vaginal': '067',
+}
+UNKNOWN_ROUTE = '065'
+
+# Caracteres de control que XML 1.0 no admite (se conservan tabulador y saltos de línea)
+INVALID_XML_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def route_code(route):
+    """Código E2B de una vía de administración en texto libre (065 = desconocida)"""
+    normalized = unicodedata.normalize('NFKD', route or '')
+    normalized = ''.join(char for char in normalized if not unicodedata.combining(char)).strip().lower()
+    return ROUTE_CODES.get(normalized, UNKNOWN_ROUTE)
+
+class ICSRWriter:
+    """
+    Exportación de reportes aprobados como ICSR en XML de estilo E2B(R2).
+
+    Recorre una proyección values_list con iterator(chunk_size) y escribe cada caso
+    con XMLGenerator sobre un búfer que se vacía tras cada bloque de casos, de modo
+    que la memoria no depende del número de casos.
+    """
+    SERIOUS_SEVERITIES = ('GRAVE', 'MUY_GRAVE')
+
+    FIELDS = (
+        'id',
+        'reported_at',
+        'resolved_at',
+        'start_date',
+        'end_date',
+        'severity',
+        'description',
+        'administration_route',
+        'dosage',
+        'frequency',
+        'patient__first_name',
+        'patient__last_name',
+        'medication__medicamento_maestro__nombre',
+        'medication__medicamento_maestro__principio_activo',
+        'institution__name',
+    )
+
+    def __init__(self, queryset, sender='MEDIALERT', receiver='REGULATOR', message_number=None, chunk_size=500):
+        self.queryset = queryset
+        self.sender = sender
+        self.receiver = receiver
+        self.message_number = message_number
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def _date(value):
+        """Fecha en formato E2B 102 (CCYYMMDD)"""
+        if isinstance(value, datetime):
+            value = timezone.localtime(value)
+        return value.strftime('%Y%m%d')
+
+    @staticmethod
+    def _initials(first_name, last_name):
+        initials = ''.join(name[0] for name in (first_name, last_name) if name)
+        return initials.upper() or 'UNK'
+
+    def _element(self, xml, name, value=None):
+        xml.startElement(name, {})
+        if value is not None:
+            xml.characters(str(value))
+        xml.endElement(name)
+
+    def _date_element(self, xml, name, value):
+        if value is not None:
+            self._element(xml, f'{name}format', '102')
+            self._element(xml, name, self._date(value))
+
+    def _header(self, xml):
+        now = self.transmitted_at
+        xml.startElement('ichicsrmessageheader', {})
+        self._element(xml, 'messagetype', 'ichicsr')
+        self._element(xml, 'messageformatversion', '2.1')
+        self._element(xml, 'messagenumb', self.message_number or now.strftime('%Y%m%d%H%M%S'))
+        self._element(xml, 'messagesenderidentifier', self.sender)
+        self._element(xml, 'messagereceiveridentifier', self.receiver)
+        self._element(xml, 'messagedateformat', '204')
+        self._element(xml, 'messagedate', timezone.localtime(now).strftime('%Y%m%d%H%M%S'))
+        xml.endElement('ichicsrmessageheader')
+
+    def _case(self, xml, row):
+        # El texto libre de los reportes puede traer caracteres de control pegados
+        case = {
+            field: INVALID_XML_CHARS.sub('', value) if isinstance(value, str) else value
+            for field, value in zip(self.FIELDS, row)
+        }
+        serious = case['severity'] in self.SERIOUS_SEVERITIES
+
+        xml.startElement('safetyreport', {})
+        self._element(xml, 'safetyreportversion', '1')
+        self._element(xml, 'safetyreportid', f"{self.sender}-{case['id']}")
+        self._date_element(xml, 'transmissiondate', self.transmitted_at)
+        # 1 = notificación espontánea
+        self._element(xml, 'reporttype', '1')
+        self._element(xml, 'serious', '1' if serious else '2')
+        if serious:
+            self._element(xml, 'seriousnessother', '1')
+        self._date_element(xml, 'receivedate', case['reported_at'])
+        self._date_element(xml, 'receiptdate', case['resolved_at'])
+
+        xml.startElement('primarysource', {})
+        self._element(xml, 'reporterorganization', case['institution__name'])
+        # 3 = otro profesional sanitario (caso validado por un revisor)
+        self._element(xml, 'qualification', '3')
+        xml.endElement('primarysource')
+
+        xml.startElement('patient', {})
+        self._element(xml, 'patientinitial', self._initials(case['patient__first_name'], case['patient__last_name']))
+
+        xml.startElement('reaction', {})
+        self._element(xml, 'primarysourcereaction', case['description'])
+        self._date_element(xml, 'reactionstartdate', case['start_date'])
+        self._date_element(xml, 'reactionenddate', case['end_date'])
+        xml.endElement('reaction')
+
+        xml.startElement('drug', {})
+        # 1 = medicamento sospechoso
+        self._element(xml, 'drugcharacterization', '1')
+        self._element(xml, 'medicinalproduct', case['medication__medicamento_maestro__nombre'])
+        self._element(xml, 'drugdosagetext', f"{case['dosage']} {case['frequency']}".strip())
+        self._element(xml, 'drugadministrationroute', route_code(case['administration_route']))
+        if case['medication__medicamento_maestro__principio_activo']:
+            xml.startElement('activesubstance', {})
+            self._element(xml, 'activesubstancename', case['medication__medicamento_maestro__principio_activo'])
+            xml.endElement('activesubstance')
+        xml.endElement('drug')
+
+        xml.endElement('patient')
+        xml.endElement('safetyreport')
+
+    def chunks(self):
+        """Bloques de XML de hasta chunk_size casos"""
+        self.transmitted_at = timezone.now()
+        buffer = io.StringIO()
+        xml = XMLGenerator(buffer, encoding='utf-8', short_empty_elements=True)
+
+        def drain():
+            text = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            return text
+
+        xml.startDocument()
+        xml.startElement('ichicsr', {'lang': 'es'})
+        self._header(xml)
+
+        pending = 0
+        for row in self.queryset.values_list(*self.FIELDS).iterator(chunk_size=self.chunk_size):
+            self._case(xml, row)
+            pending += 1
+            if pending >= self.chunk_size:
+                yield drain()
+                pending = 0
+
+        xml.endElement('ichicsr')
+        xml.endDocument()
+        yield drain()
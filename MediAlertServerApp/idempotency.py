@@ -0,0 +1,106 @@
+import hashlib
+import json
+import zlib
+from functools import wraps
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from .models import IdempotencyRecord
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 64
+
+def pack(data):
+    """Datos de una respuesta como JSON comprimido"""
+    return zlib.compress(json.dumps(data, cls=JSONEncoder, separators=(',', ':')).encode())
+
+def unpack(payload):
+    return json.loads(zlib.decompress(payload)) if payload else None
+
+def request_fingerprint(request):
+    """Huella de método, ruta y cuerpo: una clave no puede reutilizarse con otra petición"""
+    payload = json.dumps([request.method, request.path, request.data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def claim(user, scope, key, fingerprint):
+    """
+    Reservar una clave antes de ejecutar la vista
+
+    Returns:
+        tuple: (IdempotencyRecord, True si se acaba de reservar)
+    """
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                record = IdempotencyRecord.objects.create(
+                    user=user, scope=scope, key=key, request_hash=fingerprint
+                )
+            return record, True
+        except IntegrityError:
+            record = IdempotencyRecord.objects.filter(user=user, scope=scope, key=key).first()
+            if record is None or not record.is_expired():
+                return record, False
+            # Clave caducada: se libera y se vuelve a reservar
+            record.delete()
+    return record, False
+
+def idempotent(scope):
+    """
+    Hacer idempotente un endpoint de escritura con la cabecera Idempotency-Key.
+
+    La primera petición con una clave reserva la clave, ejecuta la vista y guarda el
+    código y los datos de la respuesta (comprimidos). Los reintentos con la misma
+    clave reciben esa respuesta sin volver a ejecutar la vista; mientras la primera
+    sigue en curso responden 409 y, si la clave se usó con otra petición, 422. Los
+    errores 5xx y las excepciones liberan la clave para poder reintentar. Las claves
+    caducan a las IDEMPOTENCY_KEY_TTL_HOURS horas (prune_idempotency_keys las borra),
+    y las de una petición que no terminó a los IDEMPOTENCY_IN_FLIGHT_SECONDS segundos.
+    Sin cabecera la vista se ejecuta como siempre.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view_method(self, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response(
+                    {'error': f'{HEADER} admite como máximo {MAX_KEY_LENGTH} caracteres'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            fingerprint = request_fingerprint(request)
+            record, created = claim(request.user, scope, key, fingerprint)
+            if not created:
+                if record is None or record.status_code is None:
+                    return Response(
+                        {'error': 'La petición con esta clave aún se está procesando'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                if record.request_hash != fingerprint:
+                    return Response(
+                        {'error': 'La clave de idempotencia ya se usó con otra petición'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                    )
+                response = Response(unpack(record.data), status=record.status_code)
+                response[REPLAYED_HEADER] = 'true'
+                return response
+
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+
+            # Por pk y con update(): si la reserva caducó y otra petición la liberó no hay fila
+            if response.status_code >= 500:
+                IdempotencyRecord.objects.filter(pk=record.pk, status_code__isnull=True).delete()
+            else:
+                IdempotencyRecord.objects.filter(pk=record.pk, status_code__isnull=True).update(
+                    status_code=response.status_code, data=pack(response.data)
+                )
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from MediAlertServerApp.services import ReviewerAssignmentService
+
+class Command(BaseCommand):
+    help = 'Asigna revisor a los reportes que quedaron sin asignar'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--institution', type=int, help='Procesar solo esta institución')
+        parser.add_argument('--dry-run', action='store_true', help='Mostrar el reparto sin guardarlo')
+
+    def handle(self, *args, **options):
+        result = ReviewerAssignmentService.assign_backlog(
+            institution_id=options['institution'],
+            dry_run=options['dry_run']
+        )
+        assigned = result['assigned']
+
+        usernames = dict(User.objects.filter(id__in=list(assigned)).values_list('id', 'username'))
+        for user_id, count in sorted(assigned.items(), key=lambda item: (-item[1], item[0])):
+            self.stdout.write(f'{usernames.get(user_id, user_id)}: {count} reportes')
+
+        prefix = '[dry-run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Reportes asignados: {sum(assigned.values())}, "
+            f"sin profesional disponible: {result['unassigned']}"
+        ))
@@ -0,0 +1,32 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from MediAlertServerApp.adherence import AdherenceAnalytics
+from MediAlertServerApp.benchmarks import create_synthetic_adherence, measure, rolled_back
+from MediAlertServerApp.models import RegistroToma
+
+class Command(BaseCommand):
+    help = 'Mide el análisis de adherencia de una institución con datos sintéticos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, nargs='+', default=[1000, 10000],
+                            help='Pacientes de la institución sintética')
+        parser.add_argument('--days', type=int, default=30, help='Días de historial por paciente')
+        parser.add_argument('--doses', type=int, default=2, help='Tomas diarias por paciente')
+        parser.add_argument('--repeat', type=int, default=3, help='Repeticiones por medición')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'pacientes':>10} {'registros':>10} {'motor (s)':>10} {'consultas':>9}")
+        for patients in options['patients']:
+            with rolled_back():
+                institution = create_synthetic_adherence(patients, options['days'], options['doses'])
+                now = timezone.now()
+                queryset = RegistroToma.objects.filter(
+                    recordatorio__usuario__profile__institution=institution,
+                    fecha_programada__gte=now - timedelta(days=options['days'] + 1),
+                    fecha_programada__lte=now
+                )
+                rows = queryset.count()
+                engine_time, engine_queries = measure(lambda: AdherenceAnalytics(queryset).run(), options['repeat'])
+
+            self.stdout.write(f'{patients:>10} {rows:>10} {engine_time:>10.3f} {engine_queries:>9}')
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Max, Min, Q
+from django.db.models.functions import TruncMonth, TruncWeek
+from MediAlertServerApp.analytics import AdverseEffectAnalytics
+from MediAlertServerApp.benchmarks import create_synthetic_reports, measure, rolled_back
+from MediAlertServerApp.models import AdverseEffect
+
+def legacy_analysis(queryset):
+    """Consultas por separado de la implementación anterior (analysis_report + correlation_analysis)"""
+    severe = Q(severity__in=['GRAVE', 'MUY_GRAVE'])
+    total = queryset.count()
+    return [
+        list(queryset.values('severity').annotate(
+            count=Count('id'),
+            percentage=Count('id') * 100.0 / total,
+            avg_resolution_time=Avg('resolution_time')
+        ).order_by('-count')),
+        list(queryset.values('medication__medicamento_maestro__nombre').annotate(
+            total_reports=Count('id'),
+            severe_cases=Count('id', filter=severe),
+            most_common_type=Max('type'),
+            first_reported=Min('reported_at'),
+            last_reported=Max('reported_at')
+        ).order_by('-total_reports')),
+        list(queryset.annotate(month=TruncMonth('reported_at')).values('month').annotate(count=Count('id')).order_by('month')),
+        list(queryset.annotate(week=TruncWeek('reported_at')).values('week').annotate(count=Count('id')).order_by('week')),
+        list(queryset.values('type').annotate(
+            count=Count('id'),
+            severe_cases=Count('id', filter=severe),
+            medications_affected=Count('medication', distinct=True)
+        ).order_by('-count')),
+        list(queryset.values('severity', 'type').annotate(count=Count('id')).order_by('severity', 'type')),
+        list(queryset.values('type', 'medication__medicamento_maestro__nombre').annotate(count=Count('id')).order_by('-count')),
+        list(queryset.values('severity', 'administration_route').annotate(count=Count('id')).order_by('severity', '-count')),
+    ]
+
+class Command(BaseCommand):
+    help = 'Compara el motor de análisis en una pasada con las consultas agregadas por separado'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reports', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='Tamaños de datos sintéticos (0 = usar los reportes existentes)')
+        parser.add_argument('--repeat', type=int, default=3, help='Repeticiones por medición')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'reportes':>10} {'anterior (s)':>13} {'consultas':>9} {'motor (s)':>10} {'consultas':>9}")
+        for size in options['reports']:
+            with rolled_back():
+                if size:
+                    institution = create_synthetic_reports(size)
+                    queryset = AdverseEffect.objects.filter(institution=institution)
+                else:
+                    queryset = AdverseEffect.objects.all()
+                    size = queryset.count()
+
+                legacy_time, legacy_queries = measure(lambda: legacy_analysis(queryset), options['repeat'])
+                engine_time, engine_queries = measure(lambda: AdverseEffectAnalytics(queryset).run(), options['repeat'])
+
+            self.stdout.write(
+                f'{size:>10} {legacy_time:>13.3f} {legacy_queries:>9} {engine_time:>10.3f} {engine_queries:>9}'
+            )
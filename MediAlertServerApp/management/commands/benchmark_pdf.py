@@ -0,0 +1,57 @@
+import os
+import random
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from reportlab.platypus import Table
+from MediAlertServerApp.report_generator import ReportGenerator, DETAIL_HEADER, DETAIL_TABLE_STYLE
+
+def synthetic_report_data(rows, seed=0):
+    """Datos de reporte sintéticos (sin base de datos: se mide solo el renderizado)"""
+    rng = random.Random(seed)
+    severities = ['LEVE', 'MODERADA', 'GRAVE', 'MUY_GRAVE']
+    return {
+        'total_reports': rows,
+        'severe_cases': rows // 2,
+        'pending_cases': rows // 4,
+        'effects': [
+            [f'Medicamento {rng.randrange(50)}', rng.choice(severities), rng.choice('AB'), f'2024-{rng.randint(1, 12):02d}-01']
+            for _ in range(rows)
+        ]
+    }
+
+class LegacyReportGenerator(ReportGenerator):
+    """Implementación anterior: todo el detalle en una única tabla"""
+    def _detail_tables(self, rows):
+        table = Table([DETAIL_HEADER] + list(rows))
+        table.setStyle(DETAIL_TABLE_STYLE)
+        yield table
+
+class Command(BaseCommand):
+    help = 'Mide la generación del reporte PDF con tabla única, por páginas y en paralelo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000], help='Filas de detalle')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='Procesos del modo paralelo')
+        parser.add_argument('--legacy-max', type=int, default=10000,
+                            help='Filas máximas para medir la tabla única (crece de forma superlineal)')
+
+    def render(self, generator, data, workers=1):
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as output:
+            start = time.perf_counter()
+            generator.generate_adverse_effects_report(dict(data), output=output.name, workers=workers)
+            return time.perf_counter() - start, os.path.getsize(output.name)
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        self.stdout.write(f"{'filas':>8} {'tabla única (s)':>16} {'por páginas (s)':>16} {f'paralelo x{workers} (s)':>18} {'tamaño (KB)':>12}")
+        for rows in options['rows']:
+            data = synthetic_report_data(rows)
+
+            legacy = '-'
+            if rows <= options['legacy_max']:
+                legacy = f'{self.render(LegacyReportGenerator(), data)[0]:.2f}'
+            chunked, size = self.render(ReportGenerator(), data)
+            parallel, _ = self.render(ReportGenerator(), data, workers=workers)
+
+            self.stdout.write(f'{rows:>8} {legacy:>16} {chunked:>16.2f} {parallel:>18.2f} {size // 1024:>12}')
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from MediAlertServerApp.benchmarks import create_synthetic_lists, measure, rolled_back
+from MediAlertServerApp.fieldsets import ValuesRepresentation
+from MediAlertServerApp.serializers import MedicamentoMaestroSerializer, RegistroTomaSerializer, AdverseEffectSerializer
+
+# endpoint -> (serializer, campos de la variante ?fields=)
+ENDPOINTS = {
+    'medicamentos-maestros': (MedicamentoMaestroSerializer, 'id,nombre,dosis'),
+    'registros-toma': (RegistroTomaSerializer, 'id,fecha_programada,estado,medicamento_nombre'),
+    'adverse-effects': (AdverseEffectSerializer, 'id,severity,status,reported_at,medicamento_nombre'),
+}
+
+def context(query=''):
+    return {'request': Request(APIRequestFactory().get(f'/?{query}'))}
+
+def serialize(serializer_class, queryset):
+    """Vía anterior: instancias del modelo y ModelSerializer completo"""
+    return serializer_class(list(queryset), many=True, context=context()).data
+
+def represent(serializer_class, queryset, query=''):
+    """Vía rápida: filas de values() con los campos (recortados) del serializer"""
+    plan = ValuesRepresentation.for_serializer(serializer_class(context=context(query)))
+    return [plan.represent(row) for row in plan.values(queryset)]
+
+class Command(BaseCommand):
+    help = 'Compara el coste por fila del ModelSerializer con la vía values() y con ?fields='
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000], help='Filas por lista')
+        parser.add_argument('--repeat', type=int, default=3, help='Repeticiones por medición')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'endpoint':>22} {'filas':>7} {'serializer (µs/fila)':>21} {'values() (µs/fila)':>19} {'?fields= (µs/fila)':>19}"
+        )
+        for rows in options['rows']:
+            with rolled_back():
+                for endpoint, queryset in create_synthetic_lists(rows).items():
+                    serializer_class, fields = ENDPOINTS[endpoint]
+                    count = len(queryset)
+                    full, _ = measure(lambda: serialize(serializer_class, queryset), options['repeat'])
+                    fast, _ = measure(lambda: represent(serializer_class, queryset), options['repeat'])
+                    sparse, _ = measure(lambda: represent(serializer_class, queryset, f'fields={fields}'), options['repeat'])
+                    self.stdout.write(
+                        f'{endpoint:>22} {count:>7} {full / count * 1e6:>21.1f} {fast / count * 1e6:>19.1f} '
+                        f'{sparse / count * 1e6:>19.1f}'
+                    )
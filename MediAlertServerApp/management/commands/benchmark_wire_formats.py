@@ -0,0 +1,63 @@
+import gzip
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from MediAlertServerApp.benchmarks import create_synthetic_lists, rolled_back
+from MediAlertServerApp.middleware import brotli
+from MediAlertServerApp.renderers import MessagePackRenderer
+from MediAlertServerApp.serializers import MedicamentoMaestroSerializer, RegistroTomaSerializer, AdverseEffectSerializer
+
+SERIALIZERS = {
+    'medicamentos-maestros': MedicamentoMaestroSerializer,
+    'registros-toma': RegistroTomaSerializer,
+    'adverse-effects': AdverseEffectSerializer,
+}
+
+RENDERERS = {
+    'json': JSONRenderer(),
+    'msgpack': MessagePackRenderer(),
+}
+
+def compressors():
+    """Codificación -> función de compresión, con los niveles de CompressionMiddleware"""
+    available = {
+        'identity': lambda content: content,
+        'gzip': lambda content: gzip.compress(content, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0),
+    }
+    if brotli is not None:
+        available['br'] = lambda content: brotli.compress(content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    return available
+
+class Command(BaseCommand):
+    help = 'Compara tamaño y tiempo de codificación de las listas principales en JSON/MessagePack y con compresión'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000], help='Filas por lista')
+        parser.add_argument('--repeat', type=int, default=5, help='Repeticiones por medición')
+
+    def encode(self, renderer, compress, data, repeat):
+        """Mejor tiempo de render + compresión y tamaño resultante"""
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            content = compress(renderer.render(data))
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return len(content), best
+
+    def handle(self, *args, **options):
+        if brotli is None:
+            self.stdout.write('brotli no está instalado: solo se mide gzip')
+        self.stdout.write(f"{'endpoint':>22} {'filas':>6} {'formato':>8} {'compresión':>10} {'bytes':>10} {'ms':>8}")
+        for rows in options['rows']:
+            with rolled_back():
+                for endpoint, queryset in create_synthetic_lists(rows).items():
+                    data = SERIALIZERS[endpoint](list(queryset), many=True).data
+                    for format_name, renderer in RENDERERS.items():
+                        for encoding, compress in compressors().items():
+                            size, elapsed = self.encode(renderer, compress, data, options['repeat'])
+                            self.stdout.write(
+                                f'{endpoint:>22} {len(data):>6} {format_name:>8} {encoding:>10} {size:>10} '
+                                f'{elapsed * 1000:>8.2f}'
+                            )
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from MediAlertServerApp.models import AdverseEffect, AdverseEffectSignature, LSHBucket
+from MediAlertServerApp.duplicates import DuplicateDetector
+
+class Command(BaseCommand):
+    help = 'Indexa los reportes de efectos adversos y marca los posibles duplicados'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Vaciar el índice y las marcas antes de recorrer')
+        parser.add_argument('--threshold', type=float, default=DuplicateDetector.THRESHOLD, help='Similitud mínima')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Reportes por bloque')
+
+    def handle(self, *args, **options):
+        detector = DuplicateDetector(threshold=options['threshold'])
+        batch_size = options['batch_size']
+
+        with transaction.atomic():
+            if options['rebuild']:
+                LSHBucket.objects.all().delete()
+                AdverseEffectSignature.objects.all().delete()
+                AdverseEffect.objects.filter(duplicate_of__isnull=False).update(duplicate_of=None, duplicate_score=None)
+
+            # Solo se comparan reportes anteriores: el índice crece en orden de id
+            pending = AdverseEffect.objects.filter(signature__isnull=True).order_by('id').values_list(
+                'id', 'institution_id', 'description', 'medication_id', 'start_date'
+            )
+            indexed = flagged = last_id = 0
+            while True:
+                # Bloques por id para no leer y escribir a la vez sobre el mismo cursor
+                batch = list(pending.filter(id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+                for effect_id, institution_id, description, medication_id, start_date in batch:
+                    signature = detector.signature(detector.shingles(description, medication_id, start_date))
+                    buckets = detector.buckets(signature)
+
+                    duplicate_of, score = detector.find_duplicate(signature, buckets, institution_id, exclude_id=effect_id)
+                    if duplicate_of:
+                        AdverseEffect.objects.filter(pk=effect_id).update(duplicate_of_id=duplicate_of, duplicate_score=score)
+                        flagged += 1
+
+                    AdverseEffectSignature.objects.create(adverse_effect_id=effect_id, signature=signature.tobytes())
+                    LSHBucket.objects.bulk_create([LSHBucket(bucket=bucket, adverse_effect_id=effect_id) for bucket in buckets])
+                    indexed += 1
+                last_id = batch[-1][0]
+
+        self.stdout.write(self.style.SUCCESS(f'Reportes indexados: {indexed}, posibles duplicados: {flagged}'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from MediAlertServerApp.icsr import ICSRWriter
+from MediAlertServerApp.models import RegulatorySubmission
+
+class Command(BaseCommand):
+    help = 'Genera el XML ICSR de los casos aprobados desde el último envío (o de un lote existente)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Fichero XML de salida')
+        parser.add_argument('--institution', type=int, help='Institución (por defecto todas)')
+        parser.add_argument('--submission', type=int, help='Regenerar un lote ya creado')
+        parser.add_argument('--all', action='store_true', help='Todos los aprobados, sin crear lote ni mover la marca')
+
+    def handle(self, *args, **options):
+        if options['submission']:
+            try:
+                submission = RegulatorySubmission.objects.get(pk=options['submission'])
+            except RegulatorySubmission.DoesNotExist:
+                raise CommandError(f"No existe el lote {options['submission']}")
+            queryset, message_number = submission.effects(), f'MEDIALERT-{submission.pk}'
+        elif options['all']:
+            queryset = RegulatorySubmission.in_resolution_order(RegulatorySubmission.approved_effects(options['institution']))
+            message_number = None
+        else:
+            submission = RegulatorySubmission.create_next(options['institution'])
+            if submission is None:
+                self.stdout.write(self.style.SUCCESS('Sin casos aprobados nuevos desde el último envío'))
+                return
+            queryset, message_number = submission.effects(), f'MEDIALERT-{submission.pk}'
+
+        cases = 0
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            for chunk in ICSRWriter(queryset, message_number=message_number).chunks():
+                output.write(chunk)
+                cases += chunk.count('</safetyreport>')
+
+        self.stdout.write(self.style.SUCCESS(f"Casos exportados: {cases} en {options['output']}"))
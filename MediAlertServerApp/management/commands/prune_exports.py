@@ -0,0 +1,27 @@
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from MediAlertServerApp.models import ExportJob
+
+class Command(BaseCommand):
+    help = 'Elimina los trabajos de exportación antiguos y sus ficheros'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.EXPORT_RETENTION_DAYS, help='Días que se conservan')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        jobs = ExportJob.objects.filter(created_at__lt=cutoff)
+
+        removed_files = 0
+        for file_path in jobs.exclude(file_path='').values_list('file_path', flat=True).iterator():
+            try:
+                os.remove(file_path)
+                removed_files += 1
+            except FileNotFoundError:
+                pass
+
+        deleted, _ = jobs.delete()
+        self.stdout.write(self.style.SUCCESS(f'Trabajos eliminados: {deleted}, ficheros: {removed_files}'))
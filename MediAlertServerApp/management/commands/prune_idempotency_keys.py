@@ -0,0 +1,16 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from MediAlertServerApp.models import IdempotencyRecord
+
+class Command(BaseCommand):
+    help = 'Elimina las claves de idempotencia caducadas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=settings.IDEMPOTENCY_KEY_TTL_HOURS, help='Horas que se conservan')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        deleted, _ = IdempotencyRecord.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Claves eliminadas: {deleted}'))
@@ -0,0 +1,116 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from MediAlertServerApp.models import AdverseEffect, AdverseEffectDailyRollup, DrugEventCount, Institution, \
+    RegistroToma, AdherenceDailyRollup
+
+class Command(BaseCommand):
+    help = 'Reconstruye los agregados diarios del dashboard y de adherencia a partir de reportes y registros de toma'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Filas por inserción')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        resolved = Q(status__in=AdverseEffect.RESOLVED_STATUSES, resolution_time__isnull=False)
+
+        groups = AdverseEffect.objects.annotate(
+            day=TruncDate('reported_at')
+        ).values(
+            'institution_id', 'day', 'severity', 'type', 'medication__medicamento_maestro_id', 'status'
+        ).annotate(
+            report_count=Count('id'),
+            resolved_count=Count('id', filter=resolved),
+            resolution_time_total=Sum('resolution_time', filter=resolved)
+        ).order_by()
+
+        created = 0
+        with transaction.atomic():
+            AdverseEffectDailyRollup.objects.all().delete()
+
+            batch = []
+            for group in groups.iterator(chunk_size=batch_size):
+                batch.append(AdverseEffectDailyRollup(
+                    institution_id=group['institution_id'],
+                    day=group['day'],
+                    severity=group['severity'],
+                    type=group['type'],
+                    medicamento_maestro_id=group['medication__medicamento_maestro_id'],
+                    status=group['status'],
+                    report_count=group['report_count'],
+                    resolved_count=group['resolved_count'],
+                    resolution_time_total=group['resolution_time_total'] or timedelta(0)
+                ))
+                if len(batch) >= batch_size:
+                    AdverseEffectDailyRollup.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+
+            AdverseEffectDailyRollup.objects.bulk_create(batch)
+            created += len(batch)
+
+            # Contadores medicamento x evento para la detección de señales
+            DrugEventCount.objects.all().delete()
+            drug_events = AdverseEffect.objects.exclude(
+                status__in=DrugEventCount.EXCLUDED_STATUSES
+            ).values(
+                'institution_id', 'medication__medicamento_maestro_id', 'severity', 'type'
+            ).annotate(report_count=Count('id')).order_by()
+            DrugEventCount.objects.bulk_create([
+                DrugEventCount(
+                    institution_id=row['institution_id'],
+                    medicamento_maestro_id=row['medication__medicamento_maestro_id'],
+                    severity=row['severity'],
+                    type=row['type'],
+                    report_count=row['report_count']
+                ) for row in drug_events
+            ], batch_size=batch_size)
+
+            # Invalidar las respuestas cacheadas del dashboard
+            Institution.bump_data_version(Institution.objects.values_list('id', flat=True))
+
+            adherence_created = self.rebuild_adherence(batch_size)
+            # Invalidar las respuestas cacheadas de adherencia
+            Institution.objects.update(adherence_version=F('adherence_version') + 1)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Agregados reconstruidos: {created} filas, adherencia: {adherence_created} filas'
+        ))
+
+    def rebuild_adherence(self, batch_size):
+        """Agregados de adherencia con una única agregación condicional por usuario, recordatorio y día"""
+        AdherenceDailyRollup.objects.all().delete()
+
+        groups = RegistroToma.objects.annotate(
+            day=TruncDate('fecha_programada')
+        ).values(
+            'recordatorio__usuario_id', 'recordatorio_id', 'day'
+        ).annotate(
+            total=Count('id'),
+            **{
+                counter: Count('id', filter=Q(estado=estado))
+                for estado, counter in AdherenceDailyRollup.COUNTERS.items()
+            }
+        ).order_by()
+
+        rollups = (
+            AdherenceDailyRollup(
+                usuario_id=group['recordatorio__usuario_id'],
+                recordatorio_id=group['recordatorio_id'],
+                day=group['day'],
+                total=group['total'],
+                **{counter: group[counter] for counter in AdherenceDailyRollup.COUNTERS.values()}
+            ) for group in groups.iterator(chunk_size=batch_size)
+        )
+        created = 0
+        batch = []
+        for rollup in rollups:
+            batch.append(rollup)
+            if len(batch) >= batch_size:
+                AdherenceDailyRollup.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        AdherenceDailyRollup.objects.bulk_create(batch)
+        return created + len(batch)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from MediAlertServerApp.models import AdverseEffect, UserProfile
+
+class Command(BaseCommand):
+    help = 'Recalcula los contadores de reportes abiertos de cada revisor'
+
+    def handle(self, *args, **options):
+        workloads = AdverseEffect.objects.filter(
+            status__in=AdverseEffect.OPEN_STATUSES,
+            reviewer__isnull=False
+        ).values('reviewer').annotate(count=Count('id'))
+
+        with transaction.atomic():
+            UserProfile.objects.exclude(open_reviews=0).update(open_reviews=0)
+            for workload in workloads:
+                UserProfile.objects.filter(user_id=workload['reviewer']).update(open_reviews=workload['count'])
+
+        self.stdout.write(self.style.SUCCESS(f'Carga recalculada para {len(workloads)} revisores'))
@@ -0,0 +1,69 @@
+import gzip
+import re
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se usa gzip
+    brotli = None
+
+# qvalue de RFC 9110: 0 a 1 con hasta tres decimales; los elementos mal formados se ignoran
+ACCEPT_ENCODING_RE = re.compile(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*(0(?:\.\d{0,3})?|1(?:\.0{0,3})?))?\s*')
+
+def accepted_encodings(header):
+    """Codificaciones de Accept-Encoding con q > 0"""
+    encodings = set()
+    for item in header.split(','):
+        match = ACCEPT_ENCODING_RE.fullmatch(item)
+        if match and float(match.group(2) or 1) > 0:
+            encodings.add(match.group(1).lower())
+    return encodings
+
+class CompressionMiddleware:
+    """
+    Compresión de las respuestas de la API con brotli (si está instalado) o gzip,
+    según Accept-Encoding.
+
+    Solo se comprimen respuestas completas (no en streaming: las exportaciones ya
+    se comprimen con ?compress=gzip) de al menos COMPRESSION_MIN_SIZE bytes y con
+    tipos de contenido comprimibles; el resto sale igual. Como en GZipMiddleware de
+    Django, el ETag pasa a ser débil: identifica el contenido, no los bytes.
+    """
+    COMPRESSIBLE_TYPES = ('application/json', 'application/msgpack', 'text/')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self._compressible(response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encodings = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        if brotli is not None and 'br' in encodings:
+            encoding, content = 'br', brotli.compress(response.content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+        elif 'gzip' in encodings:
+            encoding, content = 'gzip', gzip.compress(response.content, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+        else:
+            return response
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = f'W/{etag}'
+        return response
+
+    def _compressible(self, response):
+        return (
+            not response.streaming and
+            not response.has_header('Content-Encoding') and
+            response.status_code == 200 and
+            len(response.content) >= settings.COMPRESSION_MIN_SIZE and
+            response.get('Content-Type', '').startswith(self.COMPRESSIBLE_TYPES)
+        )
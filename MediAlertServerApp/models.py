@@ -1,8 +1,14 @@
-from django.db import models
+import calendar
+import threading
+from datetime import datetime, timedelta
+from django.db import models, transaction, IntegrityError
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, pre_delete, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from .utils import assign_reviewer_to_report
 
 class Institution(models.Model):
@@ -10,10 +16,30 @@ class Institution(models.Model):
     address = models.TextField(blank=True, null=True)
     contact_email = models.EmailField(blank=True, null=True)
     phone_number = models.CharField(max_length=20, blank=True, null=True)
+    # Se incrementa con cada escritura de reportes de la institución (invalida cachés)
+    data_version = models.PositiveBigIntegerField(default=0)
+    # Se incrementa con cada escritura de registros de toma de sus miembros
+    adherence_version = models.PositiveBigIntegerField(default=0)
 
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def bump_data_version(institution_ids):
+        """Incrementar la versión de datos de las instituciones indicadas"""
+        institution_ids = [pk for pk in set(institution_ids) if pk is not None]
+        if institution_ids:
+            Institution.objects.filter(pk__in=institution_ids).update(data_version=F('data_version') + 1)
+
+    @staticmethod
+    def bump_adherence_version(user_ids):
+        """Incrementar la versión de adherencia de las instituciones de los usuarios indicados"""
+        user_ids = [pk for pk in set(user_ids) if pk is not None]
+        if user_ids:
+            Institution.objects.filter(members__user_id__in=user_ids).update(
+                adherence_version=F('adherence_version') + 1
+            )
+
 class UserProfile(models.Model):
     USER_TYPES = [
         ('PATIENT', 'Paciente'),
@@ -30,10 +56,28 @@ class UserProfile(models.Model):
     specialty = models.CharField(max_length=100, blank=True, null=True)
     institution = models.ForeignKey(Institution, on_delete=models.SET_NULL, null=True, blank=True, related_name='members')
     phone = models.CharField(max_length=20, blank=True, null=True)
+
+    # Número de reportes abiertos asignados (solo profesionales), mantenido con F()
+    open_reviews = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['institution', 'user_type', 'open_reviews', 'user'], name='profile_workload_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.get_user_type_display()}"
 
+    @staticmethod
+    def adjust_open_reviews(user_id, delta):
+        """Sumar (o restar) delta a la carga abierta de un revisor de forma atómica"""
+        if user_id is None or delta == 0:
+            return
+        queryset = UserProfile.objects.filter(user_id=user_id)
+        if delta < 0:
+            queryset = queryset.filter(open_reviews__gte=-delta)
+        queryset.update(open_reviews=F('open_reviews') + delta)
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """Crear perfil automáticamente cuando se crea un usuario"""
@@ -78,10 +122,17 @@ class Medicamento(models.Model):
     dosis_personalizada = models.CharField(max_length=50, blank=True)
     frecuencia_personalizada = models.CharField(max_length=50, blank=True)
     usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.medicamento_maestro.nombre} - {self.usuario.username}"
 
+    class Meta:
+        indexes = [
+            # Cambios de un usuario desde el último token de sincronización
+            models.Index(fields=['usuario', 'updated_at', 'id'], name='medicamento_sync_idx'),
+        ]
+
 class Recordatorio(models.Model):
     FREQUENCY_CHOICES = [
         ('DAILY', 'Diario'),
@@ -111,9 +162,45 @@ class Recordatorio(models.Model):
     
     def __str__(self):
         return f"{self.medicamento.medicamento_maestro.nombre} - {self.hora}"
+
+    def dias(self):
+        """Días de la semana (1 = lunes) de un recordatorio semanal o personalizado"""
+        return {int(day) for day in (self.dias_semana or '').split(',') if day.strip().isdigit()}
+
+    def aplica_en(self, fecha):
+        """
+        Si el recordatorio tiene toma el día fecha: activo, dentro de su vigencia y
+        diario; semanal con fecha en dias_semana; mensual el mismo día del mes que
+        fecha_inicio (el último día en los meses más cortos); o personalizado en
+        dias_semana, o todos los días si no tiene. Es la regla con la que se
+        generan los registros de toma (generate_upcoming_registros) y con la que
+        today y upcoming completan los días aún no generados.
+        """
+        if not self.activo or fecha < self.fecha_inicio or (self.fecha_fin and fecha > self.fecha_fin):
+            return False
+        if self.frecuencia == 'DAILY':
+            return True
+        if self.frecuencia == 'WEEKLY':
+            return fecha.isoweekday() in self.dias()
+        if self.frecuencia == 'MONTHLY':
+            return fecha.day == min(self.fecha_inicio.day, calendar.monthrange(fecha.year, fecha.month)[1])
+        dias = self.dias()
+        return not dias or fecha.isoweekday() in dias
+
+    def programada_en(self, fecha):
+        """Hora programada de la toma del día fecha"""
+        return timezone.make_aware(datetime.combine(fecha, self.hora))
     
     class Meta:
         ordering = ['hora']
+        indexes = [
+            # Recordatorios activos de un usuario (today, upcoming, generate_registros).
+            # Índice parcial: el filtro activo=True se compila como "WHERE activo" y
+            # no puede usarse como igualdad sobre una columna de un índice compuesto
+            models.Index(fields=['usuario', 'hora'], condition=models.Q(activo=True), name='recordatorio_activo_idx'),
+            # Cambios de un usuario desde el último token de sincronización
+            models.Index(fields=['usuario', 'updated_at', 'id'], name='recordatorio_sync_idx'),
+        ]
 
 class RegistroToma(models.Model):
     STATUS_CHOICES = [
@@ -129,12 +216,248 @@ class RegistroToma(models.Model):
     notas = models.TextField(blank=True, null=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Campos que determinan el agregado de adherencia del registro
+    TRACKED_FIELDS = ('recordatorio_id', 'fecha_programada', 'estado')
     
     def __str__(self):
         return f"{self.recordatorio} - {self.fecha_programada.strftime('%Y-%m-%d %H:%M')}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Guardar el estado cargado para mover el registro entre agregados en save()
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def _previous_values(self):
+        """
+        Valores guardados de TRACKED_FIELDS, o None si el registro es nuevo. Los que no
+        se cargaron (.only() / .defer()) se leen de la base de datos antes de guardar:
+        darlos por iguales a los asignados dejaría el registro en el agregado equivocado.
+        """
+        if self._state.adding:
+            return None
+        previous = dict(getattr(self, '_loaded_values', {}))
+        missing = [field for field in self.TRACKED_FIELDS if field not in previous]
+        if missing:
+            # No se usa refresh_from_db: pisaría los valores ya asignados en la instancia
+            previous.update(RegistroToma.objects.filter(pk=self.pk).values(*missing).first() or {})
+        return previous if all(field in previous for field in self.TRACKED_FIELDS) else None
+
+    def save(self, *args, **kwargs):
+        previous = self._previous_values()
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            usuario_id = self.recordatorio.usuario_id
+
+            deltas = {}
+            if previous is not None:
+                previous_usuario_id = usuario_id
+                if previous['recordatorio_id'] != self.recordatorio_id:
+                    previous_usuario_id = Recordatorio.objects.filter(
+                        pk=previous['recordatorio_id']
+                    ).values_list('usuario_id', flat=True).first()
+                AdherenceDailyRollup.add_delta(deltas, previous_usuario_id, previous, -1)
+            AdherenceDailyRollup.add_delta(deltas, usuario_id, self.adherence_values(), 1)
+            AdherenceDailyRollup.apply_deltas(deltas)
+            Institution.bump_adherence_version([usuario_id])
+
+        self._loaded_values = self.adherence_values()
+
+    def adherence_values(self):
+        return {field: getattr(self, field) for field in self.TRACKED_FIELDS}
     
     class Meta:
         ordering = ['-fecha_programada']
+        indexes = [
+            # Historial de un recordatorio por fecha (listados, by_date_range, statistics)
+            models.Index(fields=['recordatorio', 'fecha_programada'], name='toma_recordatorio_fecha_idx'),
+            # Tomas pendientes o vencidas por estado (send_reminders)
+            models.Index(fields=['estado', 'fecha_programada'], name='toma_estado_fecha_idx'),
+            # Cambios de los recordatorios de un usuario desde el último token de sincronización
+            models.Index(fields=['recordatorio', 'updated_at'], name='toma_sync_idx'),
+        ]
+
+class AdherenceDailyRollup(models.Model):
+    """
+    Registros de toma por usuario, recordatorio y día programado, con el desglose
+    por estado. Se mantiene en la misma transacción que las escrituras de RegistroToma
+    (también en el lote de acciones) y responde las estadísticas de adherencia de
+    cualquier ventana con una sola consulta por el índice (usuario, day).
+    """
+    KEY_FIELDS = ('usuario_id', 'recordatorio_id', 'day')
+    # Estado del registro -> contador
+    COUNTERS = {'TOMADO': 'tomados', 'OMITIDO': 'omitidos', 'POSPUESTO': 'pospuestos'}
+
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    recordatorio = models.ForeignKey(Recordatorio, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+
+    total = models.IntegerField(default=0)
+    tomados = models.IntegerField(default=0)
+    omitidos = models.IntegerField(default=0)
+    pospuestos = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'day', 'recordatorio'], name='adherence_rollup_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario_id} {self.day}: {self.tomados}/{self.total}"
+
+    @classmethod
+    def add_delta(cls, deltas, usuario_id, values, sign):
+        """
+        Acumular en deltas la contribución (con signo) de un registro
+
+        Args:
+            deltas (dict): Clave del agregado -> contadores
+            usuario_id (int): Dueño del recordatorio
+            values (dict): recordatorio_id, fecha_programada y estado del registro
+            sign (int): 1 para sumar, -1 para restar
+        """
+        if usuario_id is None or values['fecha_programada'] is None:
+            return
+        key = (usuario_id, values['recordatorio_id'], timezone.localdate(values['fecha_programada']))
+        delta = deltas.setdefault(key, dict.fromkeys(('total', *cls.COUNTERS.values()), 0))
+        delta['total'] += sign
+        counter = cls.COUNTERS.get(values['estado'])
+        if counter:
+            delta[counter] += sign
+
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """Aplicar los deltas acumulados con UPDATEs atómicos, creando las filas de registros nuevos"""
+        for key, counts in deltas.items():
+            counts = {field: value for field, value in counts.items() if value}
+            if counts:
+                apply_counter_delta(
+                    cls, dict(zip(cls.KEY_FIELDS, key)), counts, allow_create=counts.get('total', 0) > 0
+                )
+
+class SyncTombstone(models.Model):
+    """
+    Registro de borrados para la sincronización incremental de la app móvil.
+
+    Se crea al eliminar un medicamento, recordatorio o registro de toma (también en
+    cascada) para que el cliente pueda borrar su copia local.
+    """
+    MODEL_CHOICES = [
+        ('medicamentos', 'Medicamento'),
+        ('recordatorios', 'Recordatorio'),
+        ('registros_toma', 'Registro de toma')
+    ]
+
+    # Sin restricción de clave foránea: al borrar un usuario sus filas se eliminan en
+    # cascada antes que él y las lápidas no deben impedirlo
+    usuario = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['usuario', 'deleted_at', 'id'], name='tombstone_sync_idx'),
+        ]
+
+    @classmethod
+    def record(cls, model, object_id, usuario_id):
+        if usuario_id is not None:
+            cls.objects.create(model=model, object_id=object_id, usuario_id=usuario_id)
+
+# Valores de los padres de un borrado en cascada en curso, por (modelo, pk)
+_deleting_parents = threading.local()
+
+def remember_deleting_parent(model, pk, value):
+    """
+    Guardar un valor del padre en su pre_delete. Django envía todos los pre_delete
+    de la cascada antes de borrar nada y borra los hijos antes que el padre, así
+    que los post_delete de los hijos lo encuentran sin una consulta por fila.
+    """
+    if not hasattr(_deleting_parents, 'values'):
+        _deleting_parents.values = {}
+    _deleting_parents.values[(model, pk)] = value
+
+def forget_deleting_parent(model, pk):
+    """Olvidar el valor en el post_delete del padre (ya se han borrado sus hijos)"""
+    getattr(_deleting_parents, 'values', {}).pop((model, pk), None)
+
+def deleting_parent_value(model, pk, default):
+    """Valor guardado del padre, o default() si el padre no se está borrando"""
+    values = getattr(_deleting_parents, 'values', {})
+    if (model, pk) in values:
+        return values[(model, pk)]
+    return default()
+
+@receiver(pre_delete, sender=Medicamento)
+def remember_deleted_medicamento(sender, instance, **kwargs):
+    remember_deleting_parent(Medicamento, instance.pk, instance.medicamento_maestro_id)
+
+@receiver(post_delete, sender=Medicamento)
+def record_medicamento_deletion(sender, instance, **kwargs):
+    forget_deleting_parent(Medicamento, instance.pk)
+    SyncTombstone.record('medicamentos', instance.pk, instance.usuario_id)
+
+@receiver(pre_delete, sender=Recordatorio)
+def remember_deleted_recordatorio(sender, instance, **kwargs):
+    remember_deleting_parent(Recordatorio, instance.pk, instance.usuario_id)
+
+@receiver(post_delete, sender=Recordatorio)
+def record_recordatorio_deletion(sender, instance, **kwargs):
+    forget_deleting_parent(Recordatorio, instance.pk)
+    SyncTombstone.record('recordatorios', instance.pk, instance.usuario_id)
+
+@receiver(post_delete, sender=RegistroToma)
+def record_registro_deletion(sender, instance, **kwargs):
+    """Lápida para la sincronización y descuento del agregado de adherencia"""
+    if 'recordatorio' in instance._state.fields_cache:
+        usuario_id = instance.recordatorio.usuario_id
+    else:
+        usuario_id = deleting_parent_value(Recordatorio, instance.recordatorio_id, lambda: Recordatorio.objects.filter(
+            pk=instance.recordatorio_id
+        ).values_list('usuario_id', flat=True).first())
+    SyncTombstone.record('registros_toma', instance.pk, usuario_id)
+
+    deltas = {}
+    AdherenceDailyRollup.add_delta(deltas, usuario_id, instance.adherence_values(), -1)
+    AdherenceDailyRollup.apply_deltas(deltas)
+    Institution.bump_adherence_version([usuario_id])
+
+class IdempotencyRecord(models.Model):
+    """
+    Resultado de una operación identificada por una clave de idempotencia del cliente.
+
+    Si el cliente repite la operación con la misma clave (reintentos, colas offline)
+    se devuelve el resultado guardado en lugar de aplicarla otra vez. scope separa
+    los espacios de claves (cada endpoint, las acciones del lote de tomas) y data
+    guarda el resultado como JSON comprimido (ver idempotency.pack).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=64)
+    # Huella de la petición original (vacía en las acciones del lote)
+    request_hash = models.CharField(max_length=64, blank=True)
+    # Nulo mientras la petición original se está ejecutando
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    data = models.BinaryField(default=b'')
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='idempotency_user_key_unique'),
+        ]
+
+    def is_expired(self):
+        """Caducada, o reservada por una petición que no terminó en IDEMPOTENCY_IN_FLIGHT_SECONDS"""
+        if self.status_code is None:
+            return self.created_at < timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_IN_FLIGHT_SECONDS)
+        return self.created_at < timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
 
 class AdverseEffect(models.Model):
     SEVERITY_CHOICES = [
@@ -159,6 +482,14 @@ class AdverseEffect(models.Model):
         ('APPROVED', 'Approved')
     ]
 
+    # Estados en los que el reporte cuenta como carga de trabajo del revisor
+    OPEN_STATUSES = ('ASSIGNED', 'IN_REVISION', 'PENDING_INFORMATION')
+    # Estados que cierran el caso (cuentan para el tiempo de resolución)
+    RESOLVED_STATUSES = ('APPROVED', 'REJECTED')
+    # Campos cuyo valor anterior se necesita para mantener contadores y agregados
+    TRACKED_FIELDS = ('reviewer_id', 'status', 'institution_id', 'reported_at', 'severity',
+                      'type', 'medication_id', 'resolution_time')
+
     patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='adverse_effects')
     medication = models.ForeignKey('Medicamento', on_delete=models.CASCADE)
     
@@ -179,6 +510,11 @@ class AdverseEffect(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='CREATED')
 
+    # Tiempos del flujo de revisión, mantenidos en cada cambio de estado
+    first_review_at = models.DateTimeField(null=True, blank=True)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+    resolution_time = models.DurationField(null=True, blank=True)
+
     reviewer = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='assigned_reviews')
 
     additional_info = models.TextField(null=True, blank=True)
@@ -190,23 +526,319 @@ class AdverseEffect(models.Model):
     chat_messages = models.JSONField(default=list)
     chat_active = models.BooleanField(default=False)
 
+    # Posible duplicado detectado por MinHash/LSH y similitud estimada
+    duplicate_of = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='duplicates')
+    duplicate_score = models.FloatField(null=True, blank=True)
+
     class Meta:
         ordering = ['-reported_at']
+        indexes = [
+            models.Index(fields=['severity', 'resolution_time'], name='effect_resolution_idx'),
+            # Paginación por cursor sobre (reported_at, id)
+            models.Index(fields=['reported_at', 'id'], name='effect_reported_idx'),
+            # Listados y filtros de supervisor por institución, estado y fecha
+            models.Index(fields=['institution', 'status', 'reported_at'], name='effect_inst_status_idx'),
+            models.Index(fields=['institution', 'reported_at', 'id'], name='effect_inst_reported_idx'),
+            # Reportes abiertos de un revisor
+            models.Index(fields=['reviewer', 'status'], name='effect_reviewer_status_idx'),
+            # Lotes regulatorios: aprobados pendientes de envío
+            models.Index(fields=['status', 'institution'], name='effect_approved_idx'),
+        ]
         permissions = [
             ("view_all_reports", "Can view all adverse effect reports"),
             ("manage_reports", "Can manage adverse effect reports"),
             ("receive_alerts", "Can receive adverse effect alerts")
         ]
 
-    def save(self, *args, **kwargs):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Guardar el estado cargado para detectar cambios en save()
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, actor=None, **kwargs):
+        previous = self._previous_values()
+
         if not self.pk and self.status == 'CREATED':
-            reviewer = assign_reviewer_to_report()
+            reviewer = assign_reviewer_to_report(self.institution_id)
             if reviewer:
                 self.reviewer = reviewer
                 self.status = 'ASSIGNED'
-        
+
+        status_changed = self._state.adding or previous.get('status') != self.status
+        if status_changed:
+            self._update_review_times()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {
+                    'first_review_at', 'resolved_at', 'resolution_time'
+                }
+
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._update_reviewer_workload(previous.get('reviewer_id'), previous.get('status'))
+            self._update_rollups(None if adding else previous)
+            Institution.bump_data_version([self.institution_id, previous.get('institution_id')])
+            if status_changed:
+                AdverseEffectTransition.objects.create(
+                    adverse_effect=self,
+                    from_status=previous.get('status'),
+                    to_status=self.status,
+                    actor=actor,
+                    created_at=self.updated_at
+                )
+
+        self._loaded_values = {field: getattr(self, field) for field in self.TRACKED_FIELDS}
+
+    def _previous_values(self):
+        """
+        Valores guardados de TRACKED_FIELDS. Los que no se cargaron (.only() / .defer())
+        se leen de la base de datos antes de guardar: tratar el reporte como nuevo
+        lo contaría dos veces en los agregados.
+        """
+        previous = dict(getattr(self, '_loaded_values', {}))
+        missing = [field for field in self.TRACKED_FIELDS if field not in previous]
+        if missing and not self._state.adding:
+            # No se usa refresh_from_db: pisaría los valores ya asignados en la instancia
+            previous.update(AdverseEffect.objects.filter(pk=self.pk).values(*missing).first() or {})
+        return previous
+
+    def _update_review_times(self):
+        """Actualizar primera revisión y resolución según el nuevo estado"""
+        now = timezone.now()
+        if self.status == 'IN_REVISION' and self.first_review_at is None:
+            self.first_review_at = now
+
+        if self.status in self.RESOLVED_STATUSES:
+            self.resolved_at = now
+            self.resolution_time = now - (self.reported_at or now)
+        else:
+            # El caso se ha reabierto (reversión o reclamación)
+            self.resolved_at = None
+            self.resolution_time = None
+
+    def _update_reviewer_workload(self, previous_reviewer_id, previous_status):
+        """Mover la carga abierta entre revisores según el cambio de revisor/estado"""
+        old_reviewer = previous_reviewer_id if previous_status in self.OPEN_STATUSES else None
+        new_reviewer = self.reviewer_id if self.status in self.OPEN_STATUSES else None
+
+        if old_reviewer == new_reviewer:
+            return
+        UserProfile.adjust_open_reviews(old_reviewer, -1)
+        UserProfile.adjust_open_reviews(new_reviewer, 1)
+
+    def _update_rollups(self, previous):
+        """Mover el reporte entre filas del agregado diario si cambia su clave"""
+        current = {field: getattr(self, field) for field in self.TRACKED_FIELDS}
+        if previous is not None and any(field not in previous for field in self.TRACKED_FIELDS):
+            previous = None
+
+        medication_ids = {current['medication_id']}
+        if previous is not None:
+            if all(previous[field] == current[field] for field in self.TRACKED_FIELDS):
+                return
+            medication_ids.add(previous['medication_id'])
+
+        if 'medication' in self._state.fields_cache and len(medication_ids) == 1:
+            maestros = {self.medication_id: self.medication.medicamento_maestro_id}
+        else:
+            maestros = dict(Medicamento.objects.filter(pk__in=medication_ids).values_list('id', 'medicamento_maestro_id'))
+
+        deltas = {}
+        if previous is not None:
+            AdverseEffectDailyRollup.add_delta(deltas, previous, maestros.get(previous['medication_id']), -1)
+        AdverseEffectDailyRollup.add_delta(deltas, current, maestros.get(current['medication_id']), 1)
+        AdverseEffectDailyRollup.apply_deltas(deltas)
+
+class AdverseEffectTransition(models.Model):
+    """Registro de solo inserción de los cambios de estado de un reporte"""
+    adverse_effect = models.ForeignKey(AdverseEffect, on_delete=models.CASCADE, related_name='transitions')
+    from_status = models.CharField(max_length=20, choices=AdverseEffect.STATUS_CHOICES, null=True, blank=True)
+    to_status = models.CharField(max_length=20, choices=AdverseEffect.STATUS_CHOICES)
+    actor = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['adverse_effect', 'created_at'], name='transition_effect_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.adverse_effect_id}: {self.from_status} -> {self.to_status}"
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError('Las transiciones no se pueden modificar')
         super().save(*args, **kwargs)
 
+class AdverseEffectDailyRollup(models.Model):
+    """
+    Número de reportes por institución, día de reporte, severidad, tipo, medicamento
+    y estado. Se mantiene en la misma transacción que las escrituras de AdverseEffect
+    y alimenta las estadísticas del dashboard.
+    """
+    KEY_FIELDS = ('institution_id', 'day', 'severity', 'type', 'medicamento_maestro_id', 'status')
+
+    institution = models.ForeignKey(Institution, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    severity = models.CharField(max_length=10, choices=AdverseEffect.SEVERITY_CHOICES)
+    type = models.CharField(max_length=1, choices=AdverseEffect.TYPE_CHOICES)
+    medicamento_maestro = models.ForeignKey(MedicamentoMaestro, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=20, choices=AdverseEffect.STATUS_CHOICES)
+
+    report_count = models.IntegerField(default=0)
+    # Reportes resueltos y suma de sus tiempos de resolución (para calcular medias)
+    resolved_count = models.IntegerField(default=0)
+    resolution_time_total = models.DurationField(default=timedelta(0))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['institution', 'day', 'severity', 'type', 'medicamento_maestro', 'status'],
+                name='effect_rollup_key'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='effect_rollup_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.severity}/{self.type}/{self.status}: {self.report_count}"
+
+    @staticmethod
+    def add_delta(deltas, values, medicamento_maestro_id, sign):
+        """
+        Acumular en deltas la contribución (con signo) de un reporte
+        
+        Args:
+            deltas (dict): Clave del agregado -> [reportes, resueltos, tiempo de resolución]
+            values (dict): Valores del reporte (institution_id, reported_at, severity, type, status, resolution_time)
+            medicamento_maestro_id (int): Medicamento maestro del reporte
+            sign (int): 1 para sumar, -1 para restar
+        """
+        if medicamento_maestro_id is None or values['reported_at'] is None:
+            return
+        key = (
+            values['institution_id'],
+            timezone.localdate(values['reported_at']),
+            values['severity'],
+            values['type'],
+            medicamento_maestro_id,
+            values['status'],
+        )
+        resolution_time = values.get('resolution_time')
+        resolved = values['status'] in AdverseEffect.RESOLVED_STATUSES and resolution_time is not None
+
+        delta = deltas.setdefault(key, [0, 0, timedelta(0)])
+        delta[0] += sign
+        if resolved:
+            delta[1] += sign
+            delta[2] += resolution_time * sign
+
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """Aplicar los deltas acumulados con UPDATEs atómicos, creando las filas que falten"""
+        for key, (count, resolved_count, resolution_time) in deltas.items():
+            if count == 0 and resolved_count == 0 and not resolution_time:
+                continue
+            apply_counter_delta(cls, dict(zip(cls.KEY_FIELDS, key)), {
+                'report_count': count,
+                'resolved_count': resolved_count,
+                'resolution_time_total': resolution_time,
+            }, allow_create=count >= 0)
+
+        DrugEventCount.apply_rollup_deltas(deltas)
+
+class DrugEventCount(models.Model):
+    """
+    Reportes por institución, medicamento maestro, severidad y tipo (tabla 2x2 de
+    farmacovigilancia). Excluye los reportes rechazados y se mantiene a partir de
+    los mismos deltas que el agregado diario.
+    """
+    KEY_FIELDS = ('institution_id', 'medicamento_maestro_id', 'severity', 'type')
+    EXCLUDED_STATUSES = ('REJECTED',)
+
+    institution = models.ForeignKey(Institution, on_delete=models.CASCADE, related_name='+')
+    medicamento_maestro = models.ForeignKey(MedicamentoMaestro, on_delete=models.CASCADE, related_name='+')
+    severity = models.CharField(max_length=10, choices=AdverseEffect.SEVERITY_CHOICES)
+    type = models.CharField(max_length=1, choices=AdverseEffect.TYPE_CHOICES)
+    report_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['institution', 'medicamento_maestro', 'severity', 'type'],
+                name='drug_event_key'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.medicamento_maestro_id} {self.severity}/{self.type}: {self.report_count}"
+
+    @classmethod
+    def apply_rollup_deltas(cls, rollup_deltas):
+        """Trasladar los deltas del agregado diario (sin día ni estado) a estos contadores"""
+        deltas = {}
+        for (institution_id, day, severity, effect_type, maestro_id, effect_status), delta in rollup_deltas.items():
+            if effect_status in cls.EXCLUDED_STATUSES:
+                continue
+            key = (institution_id, maestro_id, severity, effect_type)
+            deltas[key] = deltas.get(key, 0) + delta[0]
+
+        for key, count in deltas.items():
+            if count:
+                apply_counter_delta(cls, dict(zip(cls.KEY_FIELDS, key)), {'report_count': count}, allow_create=count > 0)
+
+def apply_counter_delta(model, filters, deltas, allow_create=True):
+    """
+    Sumar deltas a los contadores de la fila de model identificada por filters
+    
+    Usa UPDATE con F() y crea la fila si no existe y allow_create lo permite. Las
+    restas no deben crear filas (p. ej. durante borrados en cascada de la
+    institución o el medicamento).
+    """
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**filters).update(**changes) or not allow_create:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**filters, **deltas)
+    except IntegrityError:
+        model.objects.filter(**filters).update(**changes)
+
+@receiver(post_delete, sender=AdverseEffect)
+def release_reviewer_workload(sender, instance, **kwargs):
+    """Liberar la carga del revisor al eliminar un reporte abierto"""
+    if instance.status in AdverseEffect.OPEN_STATUSES:
+        UserProfile.adjust_open_reviews(instance.reviewer_id, -1)
+
+@receiver(post_delete, sender=AdverseEffect)
+def remove_from_rollups(sender, instance, **kwargs):
+    """Descontar el reporte eliminado del agregado diario"""
+    if 'medication' in instance._state.fields_cache:
+        maestro_id = instance.medication.medicamento_maestro_id
+    else:
+        maestro_id = deleting_parent_value(Medicamento, instance.medication_id, lambda: Medicamento.objects.filter(
+            pk=instance.medication_id
+        ).values_list('medicamento_maestro_id', flat=True).first())
+    deltas = {}
+    values = {field: getattr(instance, field) for field in AdverseEffect.TRACKED_FIELDS}
+    AdverseEffectDailyRollup.add_delta(deltas, values, maestro_id, -1)
+    AdverseEffectDailyRollup.apply_deltas(deltas)
+    Institution.bump_data_version([instance.institution_id])
+
+class AdverseEffectSignature(models.Model):
+    """Firma MinHash de un reporte (para la detección de duplicados)"""
+    adverse_effect = models.OneToOneField(AdverseEffect, on_delete=models.CASCADE, primary_key=True, related_name='signature')
+    signature = models.BinaryField()
+
+class LSHBucket(models.Model):
+    """Cubo LSH de una banda de la firma: reportes en el mismo cubo son candidatos a duplicado"""
+    bucket = models.BigIntegerField(db_index=True)
+    adverse_effect = models.ForeignKey(AdverseEffect, on_delete=models.CASCADE, related_name='lsh_buckets')
+
 class AlertNotification(models.Model):
     PRIORITY_CHOICES = [
         ('LOW', 'Baja'),
@@ -225,3 +857,138 @@ class AlertNotification(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Notificaciones no leídas de un usuario, ya en orden de creación
+            models.Index(fields=['recipient', 'read_at', 'created_at'], name='notification_unread_idx'),
+        ]
+
+class ExportJob(models.Model):
+    """Exportación o reporte generado en segundo plano, con el fichero resultante en disco"""
+    KIND_CHOICES = [
+        ('CSV', 'CSV'),
+        ('JSON', 'JSON'),
+        ('NDJSON', 'NDJSON'),
+        ('PDF', 'PDF')
+    ]
+
+    STATUS_CHOICES = [
+        ('PENDING', 'Pendiente'),
+        ('RUNNING', 'En ejecución'),
+        ('DONE', 'Completado'),
+        ('FAILED', 'Fallido')
+    ]
+
+    # Trabajos cuyo resultado (actual o futuro) puede reutilizarse
+    REUSABLE_STATUSES = ('PENDING', 'RUNNING', 'DONE')
+    # Trabajos aún sin terminar
+    ACTIVE_STATUSES = ('PENDING', 'RUNNING')
+
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='export_jobs')
+    # Ámbito de los datos: institución del solicitante (nulo = todas, administradores)
+    institution = models.ForeignKey(Institution, on_delete=models.CASCADE, null=True, blank=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    params = models.JSONField(default=dict)
+    # Huella de tipo, ámbito, parámetros y versión de datos: misma huella, mismo fichero
+    fingerprint = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    file_path = models.CharField(max_length=255, blank=True)
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+class RegulatorySubmission(models.Model):
+    """
+    Lote de casos aprobados enviado al regulador como ICSR.
+
+    Cada caso se reclama para un único lote (RegulatorySubmissionCase, con el
+    reporte único), así que los lotes no se solapan aunque se creen a la vez o
+    mezclen lotes de institución y de administrador, y un caso que se confirma
+    tarde entra en el siguiente lote aunque su resolución sea anterior. Las marcas
+    (fecha de resolución, id) son las del último caso del lote anterior del mismo
+    ámbito y las del último caso de este, como referencia.
+    """
+    SUBMITTED_STATUS = 'APPROVED'
+
+    # Nulo = todas las instituciones (administradores)
+    institution = models.ForeignKey(Institution, on_delete=models.CASCADE, null=True, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Último caso del lote anterior y de este, sobre (resolved_at, id)
+    after_resolved_at = models.DateTimeField(null=True, blank=True)
+    after_effect_id = models.PositiveBigIntegerField(null=True, blank=True)
+    until_resolved_at = models.DateTimeField(null=True, blank=True)
+    until_effect_id = models.PositiveBigIntegerField(null=True, blank=True)
+    case_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+
+    @staticmethod
+    def approved_effects(institution_id=None):
+        queryset = AdverseEffect.objects.filter(status=RegulatorySubmission.SUBMITTED_STATUS)
+        if institution_id:
+            queryset = queryset.filter(institution_id=institution_id)
+        return queryset
+
+    @staticmethod
+    def in_resolution_order(queryset):
+        """
+        Casos en orden de resolución. Los aprobados antes de guardar resolved_at no
+        tienen fecha de resolución: se usa la de su última modificación
+        """
+        return queryset.annotate(
+            resolution_order=Coalesce('resolved_at', 'updated_at')
+        ).order_by('resolution_order', 'id')
+
+    @classmethod
+    def create_next(cls, institution_id=None, user=None):
+        """
+        Crear el siguiente lote con los aprobados que aún no se han enviado
+
+        Returns:
+            RegulatorySubmission | None: El lote, o None si no hay casos nuevos
+        """
+        with transaction.atomic():
+            # Bloquear los candidatos: un lote simultáneo espera a que este termine
+            pending = cls.approved_effects(institution_id).filter(
+                ~models.Exists(RegulatorySubmissionCase.objects.filter(adverse_effect=models.OuterRef('pk')))
+            )
+            effect_ids = list(pending.select_for_update().order_by('id').values_list('id', flat=True))
+            if not effect_ids:
+                return None
+
+            previous = cls.objects.filter(institution_id=institution_id, case_count__gt=0).order_by('-id').first()
+            submission = cls.objects.create(
+                institution_id=institution_id,
+                created_by=user,
+                after_resolved_at=previous.until_resolved_at if previous else None,
+                after_effect_id=previous.until_effect_id if previous else None
+            )
+            # La restricción única del caso descarta los que otro lote ya ha reclamado
+            RegulatorySubmissionCase.objects.bulk_create([
+                RegulatorySubmissionCase(submission=submission, adverse_effect_id=effect_id) for effect_id in effect_ids
+            ], ignore_conflicts=True)
+
+            last = submission.effects().reverse().values('resolution_order', 'id').first()
+            if last is None:
+                submission.delete()
+                return None
+            submission.until_resolved_at = last['resolution_order']
+            submission.until_effect_id = last['id']
+            submission.case_count = submission.cases.count()
+            submission.save(update_fields=['until_resolved_at', 'until_effect_id', 'case_count'])
+            return submission
+
+    def effects(self):
+        """Casos del lote en orden de resolución"""
+        return self.in_resolution_order(AdverseEffect.objects.filter(regulatory_case__submission=self))
+
+class RegulatorySubmissionCase(models.Model):
+    """Caso enviado en un lote regulatorio: cada reporte se envía una sola vez"""
+    submission = models.ForeignKey(RegulatorySubmission, on_delete=models.CASCADE, related_name='cases')
+    adverse_effect = models.OneToOneField(AdverseEffect, on_delete=models.CASCADE, related_name='regulatory_case')
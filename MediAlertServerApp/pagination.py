@@ -0,0 +1,155 @@
+import base64
+import hashlib
+import json
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+class KeysetPagination(BasePagination):
+    """
+    Paginación por cursor (keyset) sobre una ordenación única y estable.
+
+    En lugar de OFFSET cada página filtra por los valores de la última fila vista
+    (por ejemplo reported_at, id), de modo que la consulta usa el índice y cuesta lo
+    mismo en la página 1 que en la 1000, y no se ejecuta COUNT(*). El cursor es
+    opaco (JSON en base64) e incluye una huella de los filtros con los que se creó:
+    usarlo con otros filtros devuelve 400.
+
+    La vista puede fijar cursor_ordering; el último campo debe ser único (id).
+    El total aproximado se pide con ?with_total=true y se cuenta hasta count_cap.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    total_query_param = 'with_total'
+    ordering = ('-reported_at', '-id')
+    count_cap = 1000
+
+    # Parámetros que no cambian el conjunto filtrado
+    NON_FILTER_PARAMS = ('cursor', 'page_size', 'with_total', 'fields', 'exclude')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = tuple(getattr(view, 'cursor_ordering', self.ordering))
+        self.page_size = self.get_page_size(request)
+        self.fingerprint = self.get_fingerprint(request)
+        self.base_url = request.build_absolute_uri()
+
+        self.count = None
+        if request.query_params.get(self.total_query_param, '').lower() in ('1', 'true'):
+            # Contar como mucho count_cap + 1 filas para no recorrer todo el conjunto
+            self.count = queryset.order_by()[:self.count_cap + 1].count()
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor['r'])
+        ordering = self._reverse(self.ordering) if reverse else self.ordering
+
+        page_queryset = queryset.order_by(*ordering)
+        if cursor:
+            page_queryset = page_queryset.filter(self._after(ordering, self._parse(queryset.model, cursor['v'])))
+
+        rows = list(page_queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        # Hay página siguiente si quedan filas en el sentido de avance, o si se llegó
+        # hacia atrás desde ella; lo mismo para la anterior
+        self.next_values = self._values(rows[-1]) if rows and (has_more if not reverse else True) else None
+        self.previous_values = self._values(rows[0]) if rows and (cursor is not None if not reverse else has_more) else None
+        return rows
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.encode_cursor(self.next_values, reverse=False),
+            'previous': self.encode_cursor(self.previous_values, reverse=True),
+            'results': data
+        }
+        if self.count is not None:
+            response['count'] = min(self.count, self.count_cap)
+            response['count_is_exact'] = self.count <= self.count_cap
+        return Response(response)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            raise ParseError('page_size debe ser un entero')
+        return max(1, min(size, self.max_page_size))
+
+    def get_fingerprint(self, request):
+        """Huella del endpoint y de los filtros aplicados"""
+        params = sorted(
+            (key, value) for key, values in request.query_params.lists()
+            if key not in self.NON_FILTER_PARAMS for value in values
+        )
+        payload = json.dumps([request.path, self.ordering, params], default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+    def encode_cursor(self, values, reverse):
+        if values is None:
+            return None
+        payload = json.dumps({'v': values, 'r': reverse, 'f': self.fingerprint}, default=str, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        url = remove_query_param(self.base_url, self.total_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            values, reverse, fingerprint = cursor['v'], cursor['r'], cursor['f']
+        except (ValueError, TypeError, KeyError):
+            raise ParseError('Cursor inválido')
+        if fingerprint != self.fingerprint or len(values) != len(self.ordering):
+            raise ParseError('El cursor no corresponde a estos filtros')
+        return {'v': values, 'r': bool(reverse)}
+
+    @staticmethod
+    def _reverse(ordering):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+    @staticmethod
+    def _after(ordering, values):
+        """Condición "fila posterior a values" según la ordenación (comparación lexicográfica)"""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _parse(self, model, values):
+        """Convertir los valores del cursor al tipo del campo"""
+        parsed = []
+        for field, value in zip(self.ordering, values):
+            internal_type = model._meta.get_field(field.lstrip('-')).get_internal_type()
+            try:
+                if internal_type == 'DateTimeField':
+                    value = parse_datetime(value)
+                elif internal_type == 'DateField':
+                    value = parse_date(value)
+                elif internal_type in ('AutoField', 'BigAutoField', 'IntegerField', 'BigIntegerField'):
+                    value = int(value)
+            except (ValueError, TypeError):
+                value = None
+            if value is None:
+                raise ParseError('Cursor inválido')
+            parsed.append(value)
+        return parsed
+
+    def _values(self, row):
+        """Valores de la ordenación de una fila (instancia o diccionario de values())"""
+        names = [field.lstrip('-') for field in self.ordering]
+        if isinstance(row, dict):
+            return [row[name] for name in names]
+        return [getattr(row, name) for name in names]
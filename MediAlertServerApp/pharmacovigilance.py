@@ -0,0 +1,153 @@
+import numpy as np
+from django.db.models import Sum
+from .models import AdverseEffect, DrugEventCount
+
+class SignalDetector:
+    """
+    Detección de señales de farmacovigilancia por desproporcionalidad.
+    
+    Para cada par (medicamento, evento) se construye la tabla 2x2
+        a = reportes del medicamento con el evento
+        b = reportes del medicamento con otros eventos
+        c = reportes de otros medicamentos con el evento
+        d = reportes de otros medicamentos con otros eventos
+    y se calculan PRR, ROR, sus intervalos de confianza y chi-cuadrado
+    vectorizados sobre todos los medicamentos a la vez.
+    """
+    EVENT_DIMENSIONS = {
+        'severity': [code for code, _ in AdverseEffect.SEVERITY_CHOICES],
+        'type': [code for code, _ in AdverseEffect.TYPE_CHOICES],
+    }
+    DRUG_GROUPINGS = {
+        'medicamento': ('medicamento_maestro_id', 'medicamento_maestro__nombre'),
+        'principio_activo': ('medicamento_maestro__principio_activo', 'medicamento_maestro__principio_activo'),
+    }
+
+    # Criterio de Evans: PRR >= 2, chi-cuadrado >= 4 y al menos 3 casos
+    MIN_PRR = 2.0
+    MIN_CHI_SQUARED = 4.0
+    MIN_CASES = 3
+
+    def __init__(self, counts=None, z=1.96):
+        self.counts = counts if counts is not None else DrugEventCount.objects.all()
+        self.z = z
+
+    def load(self, by='medicamento', event='severity'):
+        """
+        Leer los contadores agrupados y devolver la matriz medicamento x evento
+
+        Returns:
+            tuple: (nombres de los medicamentos, matriz de conteos)
+        """
+        drug_key, drug_name = self.DRUG_GROUPINGS[by]
+        events = self.EVENT_DIMENSIONS[event]
+        event_index = {code: index for index, code in enumerate(events)}
+
+        fields = list(dict.fromkeys([drug_key, drug_name, event]))
+        rows = self.counts.exclude(report_count=0).values(*fields).annotate(
+            total=Sum('report_count')
+        ).order_by()
+
+        drugs = {}
+        names = []
+        drug_indexes, event_indexes, totals = [], [], []
+        for row in rows:
+            key = row[drug_key]
+            if key in (None, ''):
+                continue
+            if key not in drugs:
+                drugs[key] = len(names)
+                names.append(row[drug_name])
+            drug_indexes.append(drugs[key])
+            event_indexes.append(event_index[row[event]])
+            totals.append(row['total'])
+
+        matrix = np.zeros((len(names), len(events)), dtype=np.float64)
+        np.add.at(matrix, (np.asarray(drug_indexes, dtype=np.int64), np.asarray(event_indexes, dtype=np.int64)), totals)
+        return names, matrix
+
+    def compute(self, matrix):
+        """Calcular las medidas de desproporcionalidad para todas las celdas de la matriz"""
+        a = matrix
+        drug_totals = matrix.sum(axis=1, keepdims=True)
+        event_totals = matrix.sum(axis=0, keepdims=True)
+        total = matrix.sum()
+
+        b = drug_totals - a
+        c = event_totals - a
+        d = total - drug_totals - event_totals + a
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            prr = (a / (a + b)) / (c / (c + d))
+            ror = (a * d) / (b * c)
+
+            se_ln_prr = np.sqrt(1 / a - 1 / (a + b) + 1 / c - 1 / (c + d))
+            se_ln_ror = np.sqrt(1 / a + 1 / b + 1 / c + 1 / d)
+
+            # Chi-cuadrado con corrección de Yates, recortada a 0 cuando |ad - bc| < n/2
+            chi_squared = total * np.maximum(np.abs(a * d - b * c) - total / 2, 0) ** 2 / (
+                (a + b) * (c + d) * (a + c) * (b + d)
+            )
+
+            measures = {
+                'a': a, 'b': b, 'c': c, 'd': d,
+                'prr': prr,
+                'prr_lower': np.exp(np.log(prr) - self.z * se_ln_prr),
+                'prr_upper': np.exp(np.log(prr) + self.z * se_ln_prr),
+                'ror': ror,
+                'ror_lower': np.exp(np.log(ror) - self.z * se_ln_ror),
+                'ror_upper': np.exp(np.log(ror) + self.z * se_ln_ror),
+                'chi_squared': chi_squared,
+            }
+
+        measures['signal'] = (
+            (a >= self.MIN_CASES) & (prr >= self.MIN_PRR) & (chi_squared >= self.MIN_CHI_SQUARED)
+        )
+        return measures
+
+    def rank(self, by='medicamento', event='severity', min_cases=MIN_CASES, limit=50):
+        """
+        Señales ordenadas por el límite inferior del IC del ROR
+
+        Args:
+            by (str): 'medicamento' o 'principio_activo'
+            event (str): 'severity' o 'type'
+            min_cases (int): Mínimo de reportes del par medicamento-evento
+            limit (int): Número máximo de resultados
+
+        Returns:
+            list: Un diccionario por par medicamento-evento
+        """
+        names, matrix = self.load(by, event)
+        if not names:
+            return []
+
+        measures = self.compute(matrix)
+        events = self.EVENT_DIMENSIONS[event]
+
+        candidates = np.argwhere(measures['a'] >= min_cases)
+        ror_lower = np.nan_to_num(measures['ror_lower'], nan=-np.inf, posinf=np.inf)
+        order = np.lexsort((-measures['a'][candidates[:, 0], candidates[:, 1]],
+                            -ror_lower[candidates[:, 0], candidates[:, 1]]))
+
+        def number(value):
+            value = float(value)
+            return round(value, 4) if np.isfinite(value) else None
+
+        results = []
+        for drug, event_index in candidates[order][:limit]:
+            results.append({
+                'drug': names[drug],
+                'event': events[event_index],
+                'cases': int(measures['a'][drug, event_index]),
+                'drug_other_events': int(measures['b'][drug, event_index]),
+                'other_drugs_event': int(measures['c'][drug, event_index]),
+                'other_drugs_other_events': int(measures['d'][drug, event_index]),
+                'prr': number(measures['prr'][drug, event_index]),
+                'prr_ci': [number(measures['prr_lower'][drug, event_index]), number(measures['prr_upper'][drug, event_index])],
+                'ror': number(measures['ror'][drug, event_index]),
+                'ror_ci': [number(measures['ror_lower'][drug, event_index]), number(measures['ror_upper'][drug, event_index])],
+                'chi_squared': number(measures['chi_squared'][drug, event_index]),
+                'signal': bool(measures['signal'][drug, event_index]),
+            })
+        return results
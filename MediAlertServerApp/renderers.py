@@ -0,0 +1,22 @@
+import msgpack
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Respuestas en MessagePack (Accept: application/msgpack o ?format=msgpack).
+
+    Binario y más compacto que JSON para la app móvil. Los tipos que JSON no
+    admite (fechas, decimales, UUID...) se convierten igual que en JSONRenderer.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    _default = JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=self._default, use_bin_type=True)
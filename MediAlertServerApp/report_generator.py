@@ -1,29 +1,107 @@
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, LongTable, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from django.http import HttpResponse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from django.db.models import Count, Q
 from io import BytesIO
 from datetime import datetime
 
+# Estilos de tabla: se construyen una sola vez y se comparten entre todas las tablas
+STATS_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 14),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 1), (-1, -1), 12),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+DETAIL_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 12),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+    ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 1), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+DETAIL_HEADER = ['Medicamento', 'Severidad', 'Tipo', 'Fecha']
+# Anchos fijos: reportlab no tiene que medir cada celda para calcular las columnas
+DETAIL_COLUMN_WIDTHS = [200, 90, 50, 90]
+
+def _render_detail_part(rows, rows_per_table):
+    """Renderizar en un proceso aparte un tramo de la tabla de detalle (PDF en bytes)"""
+    buffer = BytesIO()
+    generator = ReportGenerator(rows_per_table=rows_per_table)
+    doc = generator._document(buffer)
+    doc.build(list(generator._detail_tables(rows)))
+    return buffer.getvalue()
+
 class ReportGenerator:
-    def __init__(self):
+    # Filas por tabla de detalle: aproximadamente una página
+    ROWS_PER_TABLE = 40
+    # Filas por tramo cuando el detalle se renderiza en varios procesos
+    ROWS_PER_PART = 5000
+
+    def __init__(self, rows_per_table=ROWS_PER_TABLE):
         self.buffer = BytesIO()
         self.styles = getSampleStyleSheet()
-        
-    def generate_adverse_effects_report(self, data, filters=None):
-        doc = SimpleDocTemplate(
-            self.buffer,
+        self.rows_per_table = rows_per_table
+
+    @staticmethod
+    def build_report_data(queryset, chunk_size=2000):
+        """
+        Datos del reporte PDF a partir de un queryset de efectos adversos.
+
+        Los totales salen de una única consulta agregada y las filas de detalle de una
+        proyección values_list recorrida por bloques (sin una consulta por medicamento).
+        """
+        # Importación local: los procesos de renderizado importan este módulo sin cargar Django
+        from .models import AdverseEffect
+
+        totals = queryset.order_by().aggregate(
+            total_reports=Count('id'),
+            severe_cases=Count('id', filter=Q(severity__in=['GRAVE', 'MUY_GRAVE'])),
+            # Pendientes: cualquier caso que aún no está aprobado ni rechazado
+            pending_cases=Count('id', filter=~Q(status__in=AdverseEffect.RESOLVED_STATUSES))
+        )
+        rows = queryset.values_list(
+            'medication__medicamento_maestro__nombre', 'severity', 'type', 'reported_at'
+        ).iterator(chunk_size=chunk_size)
+        return {
+            **totals,
+            'effects': (
+                [medication, severity, effect_type, reported_at.strftime('%Y-%m-%d')]
+                for medication, severity, effect_type, reported_at in rows
+            )
+        }
+
+    def _document(self, output):
+        return SimpleDocTemplate(
+            output,
             pagesize=letter,
             rightMargin=72,
             leftMargin=72,
             topMargin=72,
             bottomMargin=72
         )
-        
-        # Lista de elementos del PDF
+
+    def _summary(self, data, filters):
+        """Título, filtros y estadísticas generales"""
         elements = []
-        
+
         # Título
         title_style = ParagraphStyle(
             'CustomTitle',
@@ -32,13 +110,13 @@ class ReportGenerator:
             spaceAfter=30
         )
         elements.append(Paragraph("Reporte de Efectos Adversos", title_style))
-        
+
         # Información del reporte
         elements.append(Paragraph(f"Fecha de generación: {datetime.now().strftime('%Y-%m-%d %H:%M')}", self.styles["Normal"]))
         if filters:
             elements.append(Paragraph(f"Filtros aplicados: {filters}", self.styles["Normal"]))
         elements.append(Spacer(1, 20))
-        
+
         # Estadísticas generales
         elements.append(Paragraph("Estadísticas Generales", self.styles["Heading2"]))
         stats_data = [
@@ -47,50 +125,78 @@ class ReportGenerator:
             ["Casos pendientes", str(data['pending_cases'])]
         ]
         stats_table = Table(stats_data)
-        stats_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 14),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 12),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
+        stats_table.setStyle(STATS_TABLE_STYLE)
         elements.append(stats_table)
         elements.append(Spacer(1, 20))
-        
+
         # Detalles de los efectos adversos
         elements.append(Paragraph("Detalles de Efectos Adversos", self.styles["Heading2"]))
-        detail_data = [['Medicamento', 'Severidad', 'Tipo', 'Fecha']]
-        for effect in data['effects']:
-            detail_data.append([
-                effect['medication'],
-                effect['severity'],
-                effect['type'],
-                effect['reported_at']
-            ])
-        detail_table = Table(detail_data)
-        detail_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        elements.append(detail_table)
-        
-        # Construir el PDF
-        doc.build(elements)
+        return elements
+
+    def _detail_tables(self, rows):
+        """
+        Tablas de detalle de rows_per_table filas cada una.
+
+        Una tabla por página evita que reportlab calcule y parta una única tabla
+        gigante (coste superlineal); las filas se consumen a medida que se generan.
+        """
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.rows_per_table:
+                yield self._detail_table(chunk)
+                chunk = []
+        if chunk:
+            yield self._detail_table(chunk)
+
+    def _detail_table(self, rows):
+        table = LongTable([DETAIL_HEADER] + rows, colWidths=DETAIL_COLUMN_WIDTHS, repeatRows=1)
+        table.setStyle(DETAIL_TABLE_STYLE)
+        return table
+
+    def generate_adverse_effects_report(self, data, filters=None, output=None, workers=1):
+        """
+        Generar el reporte PDF de efectos adversos
+
+        Args:
+            data (dict): Totales y filas de detalle (ver build_report_data)
+            filters (dict, optional): Filtros a mostrar en la cabecera
+            output (str | file, optional): Ruta o fichero donde escribir el PDF
+            workers (int): Procesos para renderizar el detalle (1 = en este proceso)
+
+        Returns:
+            bytes | None: El PDF si no se indica output
+        """
+        target = output if output is not None else self.buffer
+
+        if workers > 1:
+            self._generate_parallel(data, filters, target, workers)
+        else:
+            doc = self._document(target)
+            doc.build(self._summary(data, filters) + list(self._detail_tables(data['effects'])))
+
+        if output is not None:
+            return None
         pdf = self.buffer.getvalue()
         self.buffer.close()
         return pdf
+
+    def _generate_parallel(self, data, filters, target, workers):
+        """Renderizar el detalle por tramos en un pool de procesos y unir los PDF"""
+        from pypdf import PdfWriter
+
+        rows = list(data['effects'])
+        # Tramos múltiplo de rows_per_table para que las páginas queden igual de llenas
+        part_size = max(self.rows_per_table, self.ROWS_PER_PART // self.rows_per_table * self.rows_per_table)
+        parts = [rows[start:start + part_size] for start in range(0, len(rows), part_size)]
+
+        summary = BytesIO()
+        self._document(summary).build(self._summary(data, filters))
+
+        writer = PdfWriter()
+        writer.append(BytesIO(summary.getvalue()))
+        # spawn: los trabajos pueden lanzarse desde hilos del servidor, donde fork no es seguro
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            for part in executor.map(_render_detail_part, parts, [self.rows_per_table] * len(parts)):
+                writer.append(BytesIO(part))
+        writer.write(target)
@@ -1,7 +1,11 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.urls import reverse
 from .models import UserProfile, MedicamentoMaestro, Medicamento, Recordatorio, \
-    RegistroToma, AdverseEffect, AlertNotification, DispositivoUsuario, Institution
+    RegistroToma, AdverseEffect, AlertNotification, DispositivoUsuario, Institution, ExportJob, \
+    RegulatorySubmission
+from .exports import AdverseEffectJSONExport
+from .fieldsets import SparseFieldsetMixin
 
 class InstitutionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -51,13 +55,13 @@ class CombinedProfileSerializer(serializers.ModelSerializer):
 
     def get_profile(self, obj):
         try:
-            profile = UserProfile.objects.get(user=obj)
+            profile = obj.profile
             return {
                 'user_type': profile.user_type,
                 'data_protection_accepted': profile.data_protection_accepted,
                 'professional_id': profile.professional_id,
                 'specialty': profile.specialty,
-                'institution': profile.institution.id if profile.institution else None,
+                'institution': profile.institution_id,
                 'phone': profile.phone,
             }
         except UserProfile.DoesNotExist:
@@ -106,12 +110,12 @@ class RegisterSerializer(serializers.ModelSerializer):
         
         return user
 
-class MedicamentoMaestroSerializer(serializers.ModelSerializer):
+class MedicamentoMaestroSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = MedicamentoMaestro
         fields = ['id', 'nombre', 'dosis', 'forma_farmaceutica', 'principio_activo', 'concentracion', 'via_administracion', 'frecuencia']
 
-class MedicamentoSerializer(serializers.ModelSerializer):
+class MedicamentoSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     medicamento_maestro_id = serializers.PrimaryKeyRelatedField(
         source='medicamento_maestro',
         queryset=MedicamentoMaestro.objects.all(),
@@ -121,11 +125,12 @@ class MedicamentoSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Medicamento
-        fields = ['id', 'medicamento_maestro_id', 'dosis_personalizada', 'frecuencia_personalizada', 'usuario']
-        read_only_fields = ['usuario']
+        fields = ['id', 'medicamento_maestro_id', 'dosis_personalizada', 'frecuencia_personalizada', 'usuario', 'updated_at']
+        read_only_fields = ['usuario', 'updated_at']
 
-class RecordatorioSerializer(serializers.ModelSerializer):
+class RecordatorioSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     medicamento_nombre = serializers.SerializerMethodField()
+    values_lookups = {'medicamento_nombre': 'medicamento__medicamento_maestro__nombre'}
     
     class Meta:
         model = Recordatorio
@@ -141,19 +146,20 @@ class RecordatorioSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("La fecha de fin debe ser posterior a la fecha de inicio")
         return data
 
-class RegistroTomaSerializer(serializers.ModelSerializer):
+class RegistroTomaSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     medicamento_nombre = serializers.SerializerMethodField()
+    values_lookups = {'medicamento_nombre': 'recordatorio__medicamento__medicamento_maestro__nombre'}
     
     class Meta:
         model = RegistroToma
         fields = '__all__'
-        read_only_fields = ('created_at',)
+        read_only_fields = ('created_at', 'updated_at')
     
     def get_medicamento_nombre(self, obj):
-        return obj.recordatorio.medicamento.medicamento_maestro.nombre if obj.recordatorio and obj.medicamento.medicamento_maestro.nombre else None
+        return obj.recordatorio.medicamento.medicamento_maestro.nombre if obj.recordatorio else None
     
-class AdverseEffectSerializer(serializers.ModelSerializer):
-    medicamento_nombre = serializers.CharField(source='medication.nombre', read_only=True)
+class AdverseEffectSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    medicamento_nombre = serializers.CharField(source='medication.medicamento_maestro.nombre', read_only=True)
     additional_info = serializers.CharField(required=False, allow_null=True)
     reclamation_reason = serializers.CharField(required=False, allow_null=True)
     revertion_reason = serializers.CharField(required=False, allow_null=True)
@@ -165,7 +171,8 @@ class AdverseEffectSerializer(serializers.ModelSerializer):
     class Meta:
         model = AdverseEffect
         fields = '__all__'
-        read_only_fields = ('reported_at', 'updated_at', 'status', 'medicamento_nombre')
+        read_only_fields = ('reported_at', 'updated_at', 'status', 'medicamento_nombre', 'first_review_at',
+                            'resolved_at', 'resolution_time', 'duplicate_of', 'duplicate_score')
 
     def validate(self, data):
         if 'end_date' in data and data['end_date'] < data['start_date']:
@@ -173,8 +180,68 @@ class AdverseEffectSerializer(serializers.ModelSerializer):
         return data
 
 
-class AlertNotificationSerializer(serializers.ModelSerializer):
+class AlertNotificationSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = AlertNotification
         fields = '__all__'
         read_only_fields = ('created_at', 'read_at')
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = ['id', 'kind', 'params', 'status', 'size', 'error', 'created_at', 'started_at', 'finished_at',
+                  'download_url']
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        if obj.status != 'DONE':
+            return None
+        url = reverse('export-job-download', args=[obj.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+class ExportJobRequestSerializer(serializers.Serializer):
+    FILTERS = ('from', 'to', 'severity', 'type')
+
+    kind = serializers.ChoiceField(choices=ExportJob.KIND_CHOICES)
+    filters = serializers.DictField(child=serializers.CharField(allow_blank=True), required=False, default=dict)
+    fields = serializers.ListField(child=serializers.CharField(), required=False, default=list)
+    compress = serializers.BooleanField(required=False, default=False)
+
+    def validate_filters(self, value):
+        unknown = [key for key in value if key not in self.FILTERS]
+        if unknown:
+            raise serializers.ValidationError(f'Filtros no válidos: {", ".join(unknown)}')
+        # Sin filtros vacíos para que peticiones equivalentes compartan huella
+        return {key: value[key] for key in sorted(value) if value[key]}
+
+    def validate(self, data):
+        if data['fields']:
+            if data['kind'] not in ('JSON', 'NDJSON'):
+                raise serializers.ValidationError('La selección de campos solo aplica a JSON y NDJSON')
+            unknown = [field for field in data['fields'] if field not in AdverseEffectJSONExport.FIELDS]
+            if unknown:
+                raise serializers.ValidationError(f'Campos no válidos: {", ".join(unknown)}')
+        return data
+
+class DoseActionSerializer(serializers.Serializer):
+    key = serializers.CharField(max_length=64)
+    registro = serializers.IntegerField(min_value=1)
+    action = serializers.ChoiceField(choices=['tomar', 'posponer'])
+    # Momento de la acción en el dispositivo
+    at = serializers.DateTimeField(required=False)
+    minutos = serializers.IntegerField(required=False, min_value=1, max_value=24 * 60)
+
+class DoseActionBatchSerializer(serializers.Serializer):
+    MAX_ACTIONS = 500
+
+    actions = DoseActionSerializer(many=True, allow_empty=False, max_length=MAX_ACTIONS)
+
+class RegulatorySubmissionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RegulatorySubmission
+        fields = ['id', 'institution', 'created_by', 'created_at', 'after_resolved_at', 'after_effect_id',
+                  'until_resolved_at', 'until_effect_id', 'case_count']
+        read_only_fields = fields
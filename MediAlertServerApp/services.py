@@ -1,8 +1,21 @@
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, Case, When, Value, IntegerField, DateTimeField
 from django.utils import timezone
 from datetime import datetime, timedelta
-from .models import DispositivoUsuario, AlertNotification, Recordatorio, RegistroToma
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import heapq
+import threading
+from django.db import connection
+from .models import Institution, DispositivoUsuario, AlertNotification, Recordatorio, RegistroToma, AdverseEffect, \
+    AdverseEffectTransition, AdverseEffectDailyRollup, UserProfile, ExportJob, IdempotencyRecord, AdherenceDailyRollup
+from .caching import get_data_version
+from .idempotency import pack, unpack
+from .exports import AdverseEffectCSVExport, AdverseEffectJSONExport, gzip_stream
+from .report_generator import ReportGenerator
+from .utils import filter_adverse_effects
 import firebase_admin
 from firebase_admin import credentials, messaging
 from django.conf import settings
@@ -16,13 +29,16 @@ if os.path.exists(cred_path):
     firebase_admin.initialize_app(cred)
 
 class RecordatorioService:
+    # Estado de las tomas aún por llegar en schedule (los registros se crean como OMITIDO)
+    PENDING = 'PENDIENTE'
+
     @staticmethod
     def generate_upcoming_registros(days=7):
         """
         Genera registros de toma para los próximos días
         basados en los recordatorios activos
         """
-        today = timezone.now().date()
+        today = timezone.localdate()
         end_date = today + timedelta(days=days)
         
         # Obtener todos los recordatorios activos
@@ -32,6 +48,13 @@ class RecordatorioService:
             # Sin fecha de fin o con fecha de fin posterior o igual a hoy
             Q(fecha_fin__isnull=True) | Q(fecha_fin__gte=today)
         )
+
+        # Tomas ya generadas en el periodo, en una sola consulta
+        existing = set(RegistroToma.objects.filter(
+            recordatorio__activo=True,
+            fecha_programada__gte=timezone.make_aware(datetime.combine(today, datetime.min.time())),
+            fecha_programada__lt=timezone.make_aware(datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+        ).values_list('recordatorio_id', 'fecha_programada'))
         
         registros_creados = 0
         
@@ -40,21 +63,11 @@ class RecordatorioService:
             
             while current_date <= end_date:
                 # Verificar si el recordatorio aplica para este día
-                if recordatorio.frecuencia == 'DAILY' or (
-                    recordatorio.frecuencia == 'WEEKLY' and 
-                    str(current_date.weekday() + 1) in (recordatorio.dias_semana or '').split(',')
-                ):
-                    # Crear datetime combinando fecha y hora
-                    fecha_programada = datetime.combine(current_date, recordatorio.hora)
-                    fecha_programada = timezone.make_aware(fecha_programada)
+                if recordatorio.aplica_en(current_date):
+                    fecha_programada = recordatorio.programada_en(current_date)
                     
                     # Verificar si ya existe un registro para esta fecha y recordatorio
-                    registro_exists = RegistroToma.objects.filter(
-                        recordatorio=recordatorio,
-                        fecha_programada=fecha_programada
-                    ).exists()
-                    
-                    if not registro_exists:
+                    if (recordatorio.id, fecha_programada) not in existing:
                         RegistroToma.objects.create(
                             recordatorio=recordatorio,
                             fecha_programada=fecha_programada
@@ -65,6 +78,289 @@ class RecordatorioService:
         
         return registros_creados
 
+    @staticmethod
+    def schedule(user, start, end):
+        """
+        Tomas programadas de los recordatorios activos de un usuario entre start
+        (incluido) y end (excluido)
+
+        Las tomas salen de los registros ya generados, leídos con una consulta por
+        el índice (recordatorio, fecha_programada); solo los días que
+        generate_upcoming_registros aún no ha generado se completan con la regla de
+        Recordatorio.aplica_en. Los registros pospuestos se omiten: los sustituye
+        el registro creado al posponer.
+
+        El estado es el mismo se haya generado o no el registro: TOMADO, PENDIENTE
+        si la toma aún no ha llegado y OMITIDO si ya pasó sin tomarse.
+
+        Returns:
+            list: Tuplas (recordatorio, fecha_programada, id del registro o None,
+            estado) ordenadas por fecha
+        """
+        now = timezone.now()
+        pending = RecordatorioService.PENDING
+        first_day, last_day = timezone.localdate(start), timezone.localdate(end)
+        recordatorios = {
+            recordatorio.id: recordatorio
+            for recordatorio in Recordatorio.objects.filter(usuario=user, activo=True).filter(
+                Q(fecha_fin__isnull=True) | Q(fecha_fin__gte=first_day)
+            ).select_related('medicamento__medicamento_maestro')
+        }
+        registros = RegistroToma.objects.filter(
+            recordatorio__usuario=user,
+            recordatorio__activo=True,
+            fecha_programada__gte=start,
+            fecha_programada__lt=end
+        ).values_list('id', 'recordatorio_id', 'fecha_programada', 'estado')
+
+        doses = []
+        generated = set()
+        for registro_id, recordatorio_id, fecha_programada, estado in registros:
+            generated.add((recordatorio_id, fecha_programada))
+            if estado != 'POSPUESTO' and recordatorio_id in recordatorios:
+                if estado == 'OMITIDO' and fecha_programada > now:
+                    estado = pending
+                doses.append((recordatorios[recordatorio_id], fecha_programada, registro_id, estado))
+
+        # Días sin registros generados: se calculan con la regla del recordatorio
+        for recordatorio in recordatorios.values():
+            current_date = first_day
+            while current_date <= last_day:
+                if recordatorio.aplica_en(current_date):
+                    fecha_programada = recordatorio.programada_en(current_date)
+                    if start <= fecha_programada < end and (recordatorio.id, fecha_programada) not in generated:
+                        estado = pending if fecha_programada > now else 'OMITIDO'
+                        doses.append((recordatorio, fecha_programada, None, estado))
+                current_date += timedelta(days=1)
+
+        doses.sort(key=lambda dose: (dose[1], dose[0].id))
+        return doses
+
+class DoseActionService:
+    """
+    Aplicación en lote de las acciones de toma (tomar / posponer) que la app encola
+    sin conexión.
+
+    Cada acción lleva una clave de idempotencia: las ya aplicadas devuelven el
+    resultado guardado. El resto se resuelve en memoria en el orden de la marca de
+    tiempo del cliente, con las mismas reglas que los endpoints tomar y posponer, y
+    se escribe con un UPDATE por estado y un único bulk_create para las tomas
+    pospuestas, todo en una transacción junto con los agregados de adherencia.
+    """
+    DEFAULT_POSTPONE_MINUTES = 15
+    # Espacio de claves de idempotencia de las acciones del lote
+    SCOPE = 'dose-action'
+
+    @staticmethod
+    def apply_batch(user, actions):
+        """
+        Aplicar una lista de acciones
+
+        Args:
+            user (User): Paciente dueño de los registros
+            actions (list): Diccionarios con key, registro, action, at y minutos
+
+        Returns:
+            list: Resultado de cada acción, en el orden recibido
+        """
+        now = timezone.now()
+
+        with transaction.atomic():
+            stored = {
+                key: unpack(data) for key, data in IdempotencyRecord.objects.filter(
+                    user=user, scope=DoseActionService.SCOPE, key__in={action['key'] for action in actions}
+                ).values_list('key', 'data')
+            }
+
+            # Acciones nuevas (la primera de cada clave)
+            pending = {}
+            for action in actions:
+                if action['key'] not in stored:
+                    pending.setdefault(action['key'], action)
+
+            registros = RegistroToma.objects.select_for_update(of=('self',)).filter(
+                pk__in={action['registro'] for action in pending.values()},
+                recordatorio__usuario=user
+            ).only('id', 'estado', 'fecha_programada', 'recordatorio_id')
+            registros = {registro.pk: registro for registro in registros}
+            loaded = {pk: registro.adherence_values() for pk, registro in registros.items()}
+
+            results = {}
+            taken = {}
+            postponed = set()
+            new_registros = []
+            for key, action in sorted(pending.items(), key=lambda item: item[1].get('at') or now):
+                registro = registros.get(action['registro'])
+                if registro is None:
+                    results[key] = {'status': 'not found'}
+                elif registro.estado == 'TOMADO':
+                    results[key] = {'status': 'already taken'}
+                elif action['action'] == 'tomar':
+                    # Hora de toma del cliente, nunca en el futuro
+                    registro.estado = 'TOMADO'
+                    taken[registro.pk] = min(action.get('at') or now, now)
+                    results[key] = {'status': 'success'}
+                else:
+                    registro.estado = 'POSPUESTO'
+                    postponed.add(registro.pk)
+                    minutos = action.get('minutos') or DoseActionService.DEFAULT_POSTPONE_MINUTES
+                    nuevo_registro = RegistroToma(
+                        recordatorio_id=registro.recordatorio_id,
+                        fecha_programada=registro.fecha_programada + timedelta(minutes=minutos)
+                    )
+                    new_registros.append((key, nuevo_registro))
+                    results[key] = {'status': 'postponed', 'new_time': nuevo_registro.fecha_programada.isoformat()}
+
+            # update() no aplica auto_now: updated_at se fija a mano para la sincronización
+            if taken:
+                RegistroToma.objects.filter(pk__in=taken).update(
+                    estado='TOMADO',
+                    fecha_toma=Case(
+                        *[When(pk=pk, then=Value(fecha_toma)) for pk, fecha_toma in taken.items()],
+                        output_field=DateTimeField()
+                    ),
+                    updated_at=now
+                )
+            postponed -= taken.keys()
+            if postponed:
+                RegistroToma.objects.filter(pk__in=postponed).update(estado='POSPUESTO', updated_at=now)
+
+            RegistroToma.objects.bulk_create([registro for _, registro in new_registros])
+            for key, registro in new_registros:
+                results[key]['new_registro_id'] = registro.pk
+
+            # Agregados de adherencia: cambios de estado y tomas pospuestas nuevas
+            deltas = {}
+            for pk in taken.keys() | postponed:
+                AdherenceDailyRollup.add_delta(deltas, user.pk, loaded[pk], -1)
+                AdherenceDailyRollup.add_delta(deltas, user.pk, registros[pk].adherence_values(), 1)
+            for _, registro in new_registros:
+                AdherenceDailyRollup.add_delta(deltas, user.pk, registro.adherence_values(), 1)
+            AdherenceDailyRollup.apply_deltas(deltas)
+            if registros:
+                Institution.bump_adherence_version([user.pk])
+
+            IdempotencyRecord.objects.bulk_create([
+                IdempotencyRecord(
+                    user=user, scope=DoseActionService.SCOPE, key=key, status_code=200, data=pack(result), created_at=now
+                )
+                for key, result in results.items()
+            ])
+
+        results.update(stored)
+        return [
+            {'key': action['key'], **results[action['key']], 'replayed': action['key'] in stored}
+            for action in actions
+        ]
+
+class ReviewerAssignmentService:
+    # Orden de atención: primero los casos más graves
+    SEVERITY_PRIORITY = ['MUY_GRAVE', 'GRAVE', 'MODERADA', 'LEVE']
+    UPDATE_BATCH_SIZE = 500
+
+    @staticmethod
+    def assign_backlog(institution_id=None, dry_run=False):
+        """
+        Reparte los reportes sin revisor entre los profesionales de su institución
+        
+        Los reportes se recorren por severidad y antigüedad y cada uno se asigna al
+        profesional con menos carga abierta (montículo en memoria). Las asignaciones
+        se aplican con UPDATEs por lotes en una sola transacción.
+        
+        Args:
+            institution_id (int, optional): Limitar a una institución
+            dry_run (bool): Calcular el reparto sin guardarlo
+        
+        Returns:
+            dict: Reportes asignados por revisor y reportes sin profesional disponible
+        """
+        severity_rank = Case(
+            *[When(severity=severity, then=Value(rank))
+              for rank, severity in enumerate(ReviewerAssignmentService.SEVERITY_PRIORITY)],
+            default=Value(len(ReviewerAssignmentService.SEVERITY_PRIORITY)),
+            output_field=IntegerField()
+        )
+
+        reports = AdverseEffect.objects.filter(status='CREATED', reviewer__isnull=True)
+        if institution_id:
+            reports = reports.filter(institution_id=institution_id)
+        reports = reports.annotate(severity_rank=severity_rank).order_by(
+            'institution_id', 'severity_rank', 'reported_at', 'id'
+        ).values_list('id', 'institution_id')
+
+        backlog = defaultdict(list)
+        for report_id, report_institution in reports.iterator(chunk_size=2000):
+            backlog[report_institution].append(report_id)
+
+        # Montículo (carga abierta, id de usuario) por institución
+        workloads = defaultdict(list)
+        professionals = UserProfile.objects.filter(
+            user_type='PROFESSIONAL',
+            institution_id__in=list(backlog)
+        ).values_list('institution_id', 'user_id', 'open_reviews')
+        for professional_institution, user_id, open_reviews in professionals:
+            workloads[professional_institution].append((open_reviews, user_id))
+
+        assignments = defaultdict(list)
+        unassigned = 0
+        for report_institution, report_ids in backlog.items():
+            heap = workloads.get(report_institution)
+            if not heap:
+                unassigned += len(report_ids)
+                continue
+
+            heapq.heapify(heap)
+            for report_id in report_ids:
+                open_reviews, user_id = heap[0]
+                assignments[user_id].append(report_id)
+                heapq.heapreplace(heap, (open_reviews + 1, user_id))
+
+        assigned = {user_id: len(report_ids) for user_id, report_ids in assignments.items()}
+
+        if not dry_run:
+            batch_size = ReviewerAssignmentService.UPDATE_BATCH_SIZE
+            now = timezone.now()
+            with transaction.atomic():
+                for user_id, report_ids in assignments.items():
+                    updated = 0
+                    for start in range(0, len(report_ids), batch_size):
+                        # Volver a filtrar por estado por si alguno se asignó mientras tanto
+                        rows = list(AdverseEffect.objects.filter(
+                            pk__in=report_ids[start:start + batch_size],
+                            status='CREATED',
+                            reviewer__isnull=True
+                        ).values(
+                            'id', 'institution_id', 'reported_at', 'severity', 'type',
+                            'status', 'resolution_time', 'medication__medicamento_maestro_id'
+                        ))
+                        batch = [row['id'] for row in rows]
+                        AdverseEffect.objects.filter(pk__in=batch).update(
+                            reviewer_id=user_id, status='ASSIGNED', updated_at=now
+                        )
+                        AdverseEffectTransition.objects.bulk_create([
+                            AdverseEffectTransition(
+                                adverse_effect_id=report_id,
+                                from_status='CREATED',
+                                to_status='ASSIGNED',
+                                created_at=now
+                            ) for report_id in batch
+                        ])
+
+                        # Mover los reportes de CREATED a ASSIGNED en el agregado diario
+                        deltas = {}
+                        for row in rows:
+                            maestro_id = row['medication__medicamento_maestro_id']
+                            AdverseEffectDailyRollup.add_delta(deltas, row, maestro_id, -1)
+                            AdverseEffectDailyRollup.add_delta(deltas, dict(row, status='ASSIGNED'), maestro_id, 1)
+                        AdverseEffectDailyRollup.apply_deltas(deltas)
+
+                        updated += len(batch)
+                    UserProfile.adjust_open_reviews(user_id, updated)
+                    assigned[user_id] = updated
+                Institution.bump_data_version(backlog)
+
+        return {'assigned': assigned, 'unassigned': unassigned}
+
 class NotificationService:
     @staticmethod
     def create_alert(adverse_effect):
@@ -189,13 +485,12 @@ class ReminderNotificationService:
         now = timezone.now()
         target_time = now + timedelta(minutes=minutes_before)
         
-        # Obtener registros de toma programados para el momento objetivo
+        # Obtener registros de toma programados para el minuto objetivo (rango
+        # sobre la columna para usar el índice (estado, fecha_programada))
+        minute_start = target_time.replace(second=0, microsecond=0)
         registros = RegistroToma.objects.filter(
-            fecha_programada__year=target_time.year,
-            fecha_programada__month=target_time.month,
-            fecha_programada__day=target_time.day,
-            fecha_programada__hour=target_time.hour,
-            fecha_programada__minute=target_time.minute,
+            fecha_programada__gte=minute_start,
+            fecha_programada__lt=minute_start + timedelta(minutes=1),
             estado='OMITIDO'  # Solo los que aún no se han tomado
         )
         
@@ -237,3 +532,132 @@ class ReminderNotificationService:
             stats['failed'] += result.get('failure_count', 0)
         
         return stats
+
+class ExportJobService:
+    """
+    Exportaciones y reportes en segundo plano.
+
+    Los trabajos se ejecutan en un pool de hilos del propio proceso y dejan el
+    fichero en EXPORTS_ROOT. Un trabajo se identifica por su huella (tipo, ámbito,
+    parámetros y versión de datos): pedir de nuevo lo mismo devuelve el trabajo
+    existente hasta que cambian los datos de la institución. Un trabajo pendiente o
+    en ejecución desde hace más de EXPORT_JOB_TIMEOUT_MINUTES (el pool vive en el
+    proceso y se pierde al reiniciarlo) se marca FAILED y se encola otro.
+    """
+    EXTENSIONS = {'CSV': 'csv', 'JSON': 'json', 'NDJSON': 'ndjson', 'PDF': 'pdf'}
+    FILTERS = ('from', 'to', 'severity', 'type')
+
+    _executor = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def executor(cls):
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=settings.EXPORT_WORKERS, thread_name_prefix='export')
+            return cls._executor
+
+    @classmethod
+    def submit(cls, user, kind, params):
+        """
+        Encolar una exportación o reutilizar la equivalente
+        
+        Args:
+            user (User): Solicitante (determina el ámbito de los datos)
+            kind (str): CSV, JSON, NDJSON o PDF
+            params (dict): filters, fields y compress ya validados
+        
+        Returns:
+            tuple: (ExportJob, creado)
+        """
+        profile = user.profile
+        institution_id = None if profile.user_type == 'ADMIN' else profile.institution_id
+        fingerprint = hashlib.sha256(json.dumps(
+            [kind, institution_id, params, get_data_version(user)], sort_keys=True
+        ).encode()).hexdigest()
+
+        existing = ExportJob.objects.filter(
+            fingerprint=fingerprint, status__in=ExportJob.REUSABLE_STATUSES
+        ).order_by('-created_at').first()
+        if existing and existing.status != 'DONE' and cls._is_stale(existing):
+            ExportJob.objects.filter(pk=existing.pk, status__in=ExportJob.ACTIVE_STATUSES).update(
+                status='FAILED', error='Tiempo de ejecución agotado', finished_at=timezone.now()
+            )
+        elif existing and (existing.status != 'DONE' or os.path.exists(existing.file_path)):
+            return existing, False
+
+        job = ExportJob.objects.create(
+            requested_by=user,
+            institution_id=institution_id,
+            kind=kind,
+            params=params,
+            fingerprint=fingerprint
+        )
+        transaction.on_commit(lambda: cls.executor().submit(cls.run, job.pk))
+        return job, True
+
+    @staticmethod
+    def _is_stale(job):
+        """Si un trabajo pendiente o en ejecución lleva demasiado tiempo sin terminar"""
+        since = job.started_at or job.created_at
+        return since < timezone.now() - timedelta(minutes=settings.EXPORT_JOB_TIMEOUT_MINUTES)
+
+    @classmethod
+    def run(cls, job_id):
+        """Generar el fichero de un trabajo pendiente (se ejecuta en el pool)"""
+        try:
+            started = ExportJob.objects.filter(pk=job_id, status='PENDING').update(
+                status='RUNNING', started_at=timezone.now()
+            )
+            if not started:
+                return
+            job = ExportJob.objects.get(pk=job_id)
+
+            try:
+                path, size = cls._write_artifact(job)
+            except Exception as e:
+                ExportJob.objects.filter(pk=job_id, status='RUNNING').update(
+                    status='FAILED', error=str(e), finished_at=timezone.now()
+                )
+                return
+
+            # Si entretanto se dio por perdido (FAILED) se queda así: ya hay otro trabajo
+            ExportJob.objects.filter(pk=job_id, status='RUNNING').update(
+                status='DONE', file_path=str(path), size=size, finished_at=timezone.now()
+            )
+        finally:
+            # El hilo no pasa por el ciclo de petición: cerrar su conexión
+            connection.close()
+
+    @classmethod
+    def _write_artifact(cls, job):
+        queryset = AdverseEffect.objects.select_related('medication__medicamento_maestro')
+        if job.institution_id:
+            queryset = queryset.filter(institution_id=job.institution_id)
+        queryset = filter_adverse_effects(queryset, job.params.get('filters', {}))
+
+        compress = job.params.get('compress', False) and job.kind != 'PDF'
+        # Con el id del trabajo: prune_exports no puede borrar el fichero de otro trabajo con la misma huella
+        path = settings.EXPORTS_ROOT / f"{job.fingerprint}-{job.pk}.{cls.EXTENSIONS[job.kind]}{'.gz' if compress else ''}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Escribir en un fichero temporal y renombrar: nunca se sirve un fichero a medias
+        partial = path.with_name(path.name + '.part')
+        if job.kind == 'PDF':
+            ReportGenerator().generate_adverse_effects_report(
+                ReportGenerator.build_report_data(queryset),
+                filters=job.params.get('filters'),
+                output=str(partial),
+                workers=settings.PDF_RENDER_WORKERS
+            )
+        else:
+            if job.kind == 'CSV':
+                export = AdverseEffectCSVExport(queryset)
+            else:
+                export = AdverseEffectJSONExport(queryset, fields=job.params.get('fields'), mode=job.kind.lower())
+            chunks = gzip_stream(export.chunks()) if compress else (chunk.encode('utf-8') for chunk in export.chunks())
+            with open(partial, 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        os.replace(partial, path)
+        return path, path.stat().st_size
@@ -0,0 +1,133 @@
+import base64
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+from .models import Medicamento, Recordatorio, RegistroToma, SyncTombstone
+from .pagination import KeysetPagination
+from .serializers import MedicamentoSerializer, RecordatorioSerializer, RegistroTomaSerializer
+
+class DeltaSync:
+    """
+    Sincronización incremental de los datos de un paciente para la app móvil.
+
+    El token es opaco (JSON en base64), va ligado al usuario y guarda, para cada modelo
+    y para las lápidas, la posición (updated_at, id) de la última fila entregada; cada petición devuelve
+    solo las filas modificadas o borradas después, por los índices *_sync_idx, así que
+    el coste depende del volumen de cambios y no del historial. Sin token se envía
+    una copia completa.
+
+    Solo se leen filas con marca anterior a ahora - SYNC_SETTLE_SECONDS: una
+    transacción más lenta que ese margen no puede confirmar una fila por detrás del
+    token ya entregado. Cada modelo avanza por páginas de SYNC_PAGE_SIZE filas;
+    has_more indica que hay que volver a pedir con el nuevo token.
+    """
+    TOMBSTONES = 'tombstones'
+    ORDERING = ('updated_at', 'id')
+
+    def __init__(self, user, token=None, page_size=None):
+        self.user = user
+        self.page_size = page_size or settings.SYNC_PAGE_SIZE
+        self.cutoff = timezone.now() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+        self.positions = self.decode_token(token) if token else None
+
+    def sources(self):
+        """Modelo -> (queryset del usuario, serializer)"""
+        return {
+            'medicamentos': (
+                Medicamento.objects.filter(usuario=self.user),
+                MedicamentoSerializer
+            ),
+            'recordatorios': (
+                Recordatorio.objects.filter(usuario=self.user).select_related('medicamento__medicamento_maestro'),
+                RecordatorioSerializer
+            ),
+            'registros_toma': (
+                RegistroToma.objects.filter(recordatorio__usuario=self.user).select_related(
+                    'recordatorio__medicamento__medicamento_maestro'
+                ),
+                RegistroTomaSerializer
+            ),
+        }
+
+    def encode_token(self, positions):
+        # default=str conserva los microsegundos (DjangoJSONEncoder los recorta)
+        payload = json.dumps({'user': self.user.pk, 'positions': positions}, default=str, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_token(self, token):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            # Un token de otro usuario no debe servir para saltarse ni repetir cambios
+            if payload['user'] != self.user.pk:
+                raise ValueError
+            positions = payload['positions']
+            expected = set(self.sources()) | {self.TOMBSTONES}
+            if set(positions) != expected:
+                raise ValueError
+            return {name: self._parse(position) for name, position in positions.items()}
+        except (ValueError, TypeError, AttributeError, KeyError):
+            raise ParseError('Token de sincronización inválido')
+
+    @staticmethod
+    def _parse(position):
+        if position is None:
+            return None
+        changed_at, object_id = position
+        changed_at = parse_datetime(changed_at)
+        if changed_at is None:
+            raise ValueError
+        return [changed_at, int(object_id)]
+
+    def _page(self, queryset, position, ordering=ORDERING):
+        """Siguiente página de filas posteriores a position, y si quedan más"""
+        queryset = queryset.filter(**{f'{ordering[0]}__lte': self.cutoff})
+        if position is not None:
+            # La cota inferior explícita acota el rango del índice (la OR del cursor no lo hace)
+            queryset = queryset.filter(**{f'{ordering[0]}__gte': position[0]})
+            queryset = queryset.filter(KeysetPagination._after(ordering, position))
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        return rows[:self.page_size], len(rows) > self.page_size
+
+    def changes(self):
+        """
+        Cambios desde el token
+
+        Returns:
+            dict: Nuevo token, has_more y, por modelo, filas actualizadas e ids borrados
+        """
+        positions = dict(self.positions or {})
+        changes = {}
+        has_more = False
+
+        for name, (queryset, serializer_class) in self.sources().items():
+            rows, more = self._page(queryset, positions.get(name))
+            has_more |= more
+            if rows:
+                positions[name] = [rows[-1].updated_at, rows[-1].id]
+            else:
+                positions.setdefault(name, None)
+            changes[name] = {'updated': serializer_class(rows, many=True).data, 'deleted': []}
+
+        if self.positions is None:
+            # Copia completa: los borrados anteriores ya no están en ella
+            positions[self.TOMBSTONES] = [self.cutoff, 0]
+        else:
+            tombstones, more = self._page(
+                SyncTombstone.objects.filter(usuario=self.user),
+                positions[self.TOMBSTONES],
+                ordering=('deleted_at', 'id')
+            )
+            has_more |= more
+            for tombstone in tombstones:
+                changes[tombstone.model]['deleted'].append(tombstone.object_id)
+            if tombstones:
+                positions[self.TOMBSTONES] = [tombstones[-1].deleted_at, tombstones[-1].id]
+
+        return {
+            'token': self.encode_token(positions),
+            'has_more': has_more,
+            'changes': changes
+        }
@@ -1,3 +1,1745 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import re
+import xml.etree.ElementTree as ET
+from datetime import date, datetime, time, timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock, skipUnless
+import msgpack
+from pypdf import PdfReader
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+from .models import AdverseEffect, AdverseEffectTransition, RegistroToma, AlertNotification, Recordatorio, Institution, MedicamentoMaestro, \
+    Medicamento, AdherenceDailyRollup, UserProfile, AdverseEffectDailyRollup, DrugEventCount, \
+    ExportJob, RegulatorySubmission, RegulatorySubmissionCase, SyncTombstone, IdempotencyRecord
+from .adherence import AdherenceAnalytics
+from .analytics import AdverseEffectAnalytics
+from .benchmarks import create_synthetic_reports
+from .caching import versioned_cache
+from .fieldsets import ValuesRepresentation
+from .management.commands.benchmark_analytics import legacy_analysis
+from .pharmacovigilance import SignalDetector
+from .report_generator import ReportGenerator, _render_detail_part
+from .duplicates import DuplicateDetector
+from .icsr import ICSRWriter
+from .idempotency import REPLAYED_HEADER, idempotent
+from .serializers import AdverseEffectSerializer, AlertNotificationSerializer, MedicamentoMaestroSerializer, \
+    MedicamentoSerializer, RecordatorioSerializer, RegistroTomaSerializer
+from .services import ExportJobService, RecordatorioService, ReviewerAssignmentService
 
-# Create your tests here.
+def create_member(username, role, institution):
+    """Usuario con perfil del rol indicado en la institución"""
+    user = User.objects.create_user(username=username, password='x')
+    user.profile.user_type = role
+    user.profile.institution = institution
+    user.profile.save()
+    return user
+
+def create_effect(patient, medicamento, institution, **fields):
+    """Reporte de efecto adverso con valores por defecto"""
+    values = dict(
+        description='Mareo', start_date=date.today(), severity='GRAVE', type='A',
+        administration_route='ORAL', dosage='1', frequency='1'
+    )
+    values.update(fields)
+    return AdverseEffect.objects.create(patient=patient, medication=medicamento, institution=institution, **values)
+
+@skipUnless(connection.vendor == 'sqlite', 'Los planes se comprueban con EXPLAIN QUERY PLAN de SQLite')
+class QueryPlanTests(TestCase):
+    """
+    Regresión de planes de consulta: cada consulta caliente debe resolverse con su
+    índice compuesto y ninguna debe recorrer la tabla completa.
+    """
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        table = queryset.model._meta.db_table
+
+        full_scans = [
+            line for line in plan.splitlines()
+            if re.search(rf'\bSCAN {re.escape(table)}\b(?! USING)', line)
+        ]
+        self.assertFalse(full_scans, f'Recorrido completo de {table}:\n{plan}')
+        self.assertRegex(plan, rf'USING (COVERING )?INDEX {index_name}\b', f'No se usa {index_name}:\n{plan}')
+
+    def test_effects_by_institution_status_and_date(self):
+        since = timezone.now() - timedelta(days=30)
+        self.assertUsesIndex(
+            AdverseEffect.objects.filter(institution_id=1, status='ASSIGNED', reported_at__gte=since),
+            'effect_inst_status_idx'
+        )
+
+    def test_effects_by_institution_cursor_page(self):
+        self.assertUsesIndex(
+            AdverseEffect.objects.filter(institution_id=1).order_by('-reported_at', '-id')[:21],
+            'effect_inst_reported_idx'
+        )
+
+    def test_open_effects_by_reviewer(self):
+        self.assertUsesIndex(
+            AdverseEffect.objects.filter(reviewer_id=1, status__in=AdverseEffect.OPEN_STATUSES),
+            'effect_reviewer_status_idx'
+        )
+
+    def test_approved_effects_pending_submission(self):
+        self.assertUsesIndex(
+            AdverseEffect.objects.filter(status='APPROVED').filter(
+                ~Exists(RegulatorySubmissionCase.objects.filter(adverse_effect=OuterRef('pk')))
+            ),
+            'effect_approved_idx'
+        )
+
+    def test_registros_by_recordatorio_and_date(self):
+        since = timezone.now() - timedelta(days=30)
+        self.assertUsesIndex(
+            RegistroToma.objects.filter(recordatorio_id=1, fecha_programada__gte=since),
+            'toma_recordatorio_fecha_idx'
+        )
+
+    def test_pending_registros_by_date(self):
+        now = timezone.now()
+        self.assertUsesIndex(
+            RegistroToma.objects.filter(
+                estado='OMITIDO', fecha_programada__gte=now, fecha_programada__lt=now + timedelta(minutes=1)
+            ),
+            'toma_estado_fecha_idx'
+        )
+
+    def test_registros_changed_since_sync_token(self):
+        since = timezone.now() - timedelta(days=1)
+        self.assertUsesIndex(
+            RegistroToma.objects.filter(
+                recordatorio__usuario_id=1, updated_at__gte=since, updated_at__lte=timezone.now()
+            ).order_by('updated_at', 'id'),
+            'toma_sync_idx'
+        )
+
+    def test_adherence_window(self):
+        since = timezone.localdate() - timedelta(days=3650)
+        self.assertUsesIndex(
+            AdherenceDailyRollup.objects.filter(usuario_id=1, day__gte=since),
+            # SQLite crea el índice de la restricción única adherence_rollup_key con su propio nombre
+            f'sqlite_autoindex_{AdherenceDailyRollup._meta.db_table}_1'
+        )
+
+    def test_scheduled_doses_in_window(self):
+        now = timezone.now()
+        self.assertUsesIndex(
+            RegistroToma.objects.filter(
+                recordatorio__usuario_id=1, recordatorio__activo=True,
+                fecha_programada__gte=now, fecha_programada__lt=now + timedelta(days=1)
+            ),
+            'toma_recordatorio_fecha_idx'
+        )
+
+    def test_unread_notifications(self):
+        self.assertUsesIndex(
+            AlertNotification.objects.filter(recipient_id=1, read_at__isnull=True).order_by('-created_at'),
+            'notification_unread_idx'
+        )
+
+    def test_active_recordatorios(self):
+        self.assertUsesIndex(
+            Recordatorio.objects.filter(usuario_id=1, activo=True),
+            'recordatorio_activo_idx'
+        )
+
+
+class QueryCountTests(TestCase):
+    """
+    Número exacto de consultas por endpoint: debe ser el mismo con 1, 5 o 30 filas
+    (los datos relacionados se cargan con select_related, no fila a fila).
+    """
+    SIZES = (1, 5, 30)
+
+    # endpoint -> (rol, consultas)
+    ENDPOINTS = {
+        '/medicamentos/': ('patient', 2),
+        '/recordatorios/': ('patient', 1),
+        '/recordatorios/today/': ('patient', 2),
+        '/recordatorios/upcoming/': ('patient', 2),
+        '/registros-toma/': ('patient', 1),
+        '/registros-toma/by_date_range/': ('patient', 1),
+        '/registros-toma/statistics/': ('patient', 1),
+        '/notifications/': ('patient', 1),
+        '/notifications/unread/': ('patient', 1),
+        '/sync/': ('patient', 3),
+        '/home/': ('patient', 8),
+        '/adherence/institution/': ('supervisor', 4),
+        '/adverse-effects/': ('supervisor', 2),
+        '/adverse-effects/filtered_reports/': ('supervisor', 2),
+        '/users/': ('supervisor', 2),
+        '/dashboard/supervisor_view/': ('supervisor', 2),
+        '/dashboard/pending_reviews/': ('supervisor', 4),
+        '/dashboard/export_csv/': ('supervisor', 2),
+        '/dashboard/export_json/': ('supervisor', 2),
+        '/dashboard/generate_pdf_report/': ('supervisor', 3),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.users = {}
+        for role in ('patient', 'supervisor', 'professional'):
+            user = User.objects.create_user(username=role, password='x')
+            user.profile.user_type = role.upper()
+            user.profile.institution = cls.institution
+            user.profile.save()
+            cls.users[role] = user
+        cls.maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        cls.created = 0
+
+    def populate(self, size):
+        """Completar hasta size filas de cada tipo"""
+        patient = self.users['patient']
+        reviewer = self.users['professional']
+        for index in range(self.created, size):
+            maestro = MedicamentoMaestro.objects.create(nombre=f'Medicamento {index}')
+            medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=patient)
+            recordatorio = Recordatorio.objects.create(
+                usuario=patient, medicamento=medicamento, dosis='1', hora=time(8, 0)
+            )
+            RegistroToma.objects.create(recordatorio=recordatorio, fecha_programada=timezone.now())
+            effect = AdverseEffect.objects.create(
+                patient=patient, medication=medicamento, institution=self.institution, description='Mareo',
+                start_date=date.today(), severity='GRAVE', type='A', administration_route='ORAL',
+                dosage='1', frequency='1'
+            )
+            AdverseEffect.objects.filter(pk=effect.pk).update(status='IN_REVISION', reviewer=reviewer)
+            AlertNotification.objects.create(
+                adverse_effect=effect, recipient=patient, title='Aviso', message='Nuevo reporte', priority='HIGH'
+            )
+            User.objects.create_user(username=f'user{index}')
+        self.created = size
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        client = APIClient()
+        for size in self.SIZES:
+            self.populate(size)
+            for endpoint, (role, queries) in self.ENDPOINTS.items():
+                with self.subTest(endpoint=endpoint, size=size):
+                    # Usuario recién leído: el perfil no está en caché
+                    client.force_authenticate(User.objects.get(pk=self.users[role].pk))
+                    with self.assertNumQueries(queries):
+                        response = client.get(endpoint)
+                        if hasattr(response, 'streaming_content'):
+                            b''.join(response.streaming_content)
+                    self.assertEqual(response.status_code, 200)
+
+
+class ReviewerWorkloadTests(TestCase):
+    """Carga abierta (open_reviews) de los revisores al asignar, cambiar de estado y borrar"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.first = create_member('first', 'PROFESSIONAL', cls.institution)
+        cls.second = create_member('second', 'PROFESSIONAL', cls.institution)
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        cls.medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient)
+
+    def open_reviews(self):
+        return dict(UserProfile.objects.filter(
+            user__in=[self.first, self.second]
+        ).values_list('user__username', 'open_reviews'))
+
+    def test_new_reports_go_to_least_loaded_reviewer(self):
+        effects = [create_effect(self.patient, self.medicamento, self.institution) for _ in range(3)]
+        self.assertEqual([effect.reviewer for effect in effects], [self.first, self.second, self.first])
+        self.assertEqual(self.open_reviews(), {'first': 2, 'second': 1})
+
+    def test_reassign_moves_workload(self):
+        effect = create_effect(self.patient, self.medicamento, self.institution)
+        effect = AdverseEffect.objects.get(pk=effect.pk)
+        effect.reviewer = self.second
+        effect.save()
+        self.assertEqual(self.open_reviews(), {'first': 0, 'second': 1})
+
+    def test_closing_and_reopening_status(self):
+        effect = AdverseEffect.objects.get(pk=create_effect(self.patient, self.medicamento, self.institution).pk)
+        effect.status = 'IN_REVISION'
+        effect.save()
+        self.assertEqual(self.open_reviews(), {'first': 1, 'second': 0})
+        effect.status = 'APPROVED'
+        effect.save()
+        self.assertEqual(self.open_reviews(), {'first': 0, 'second': 0})
+        effect.status = 'RECLAIMED'
+        effect.save()
+        self.assertEqual(self.open_reviews(), {'first': 0, 'second': 0})
+        effect.status = 'IN_REVISION'
+        effect.save()
+        self.assertEqual(self.open_reviews(), {'first': 1, 'second': 0})
+
+    def test_delete_releases_workload(self):
+        effect = create_effect(self.patient, self.medicamento, self.institution)
+        closed = AdverseEffect.objects.get(pk=create_effect(self.patient, self.medicamento, self.institution).pk)
+        closed.status = 'REJECTED'
+        closed.save()
+        effect.delete()
+        closed.delete()
+        self.assertEqual(self.open_reviews(), {'first': 0, 'second': 0})
+
+
+class ReviewTimesTests(TestCase):
+    """Los tiempos de revisión solo los calcula el servidor"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        cls.medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient)
+
+    def test_review_times_are_read_only(self):
+        forged = {
+            'first_review_at': '2020-01-01T00:00:00Z',
+            'resolved_at': '2020-01-02T00:00:00Z',
+            'resolution_time': '1 00:00:00',
+        }
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        response = client.post('/adverse-effects/', {
+            'medication': self.medicamento.pk, 'institution': self.institution.pk, 'patient': self.patient.pk,
+            'description': 'Mareo', 'start_date': str(date.today()), 'severity': 'LEVE', 'type': 'A',
+            'administration_route': 'ORAL', 'dosage': '1', 'frequency': '1', **forged
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        effect = AdverseEffect.objects.get(pk=response.data['id'])
+        self.assertIsNone(effect.first_review_at)
+        self.assertIsNone(effect.resolved_at)
+        self.assertIsNone(effect.resolution_time)
+
+        serializer = AdverseEffectSerializer(effect, data=forged, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        effect.refresh_from_db()
+        self.assertIsNone(effect.first_review_at)
+        self.assertIsNone(effect.resolved_at)
+        self.assertIsNone(effect.resolution_time)
+
+
+class RollupConsistencyTests(TestCase):
+    """Los agregados mantenidos en cada escritura coinciden con los de rebuild_rollups"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.reviewer = create_member('reviewer', 'PROFESSIONAL', cls.institution)
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        cls.maestros = [MedicamentoMaestro.objects.create(nombre=nombre) for nombre in ('Ibuprofeno', 'Omeprazol')]
+        cls.medicamentos = [
+            Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient) for maestro in cls.maestros
+        ]
+
+    def effect_rollups(self):
+        return (
+            set(AdverseEffectDailyRollup.objects.filter(report_count__gt=0).values_list(
+                'institution_id', 'day', 'severity', 'type', 'medicamento_maestro_id', 'status',
+                'report_count', 'resolved_count', 'resolution_time_total'
+            )),
+            set(DrugEventCount.objects.filter(report_count__gt=0).values_list(
+                'institution_id', 'medicamento_maestro_id', 'severity', 'type', 'report_count'
+            )),
+        )
+
+    def assertEffectRollupsRebuilt(self):
+        maintained = self.effect_rollups()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(maintained, self.effect_rollups())
+
+    def test_effect_rollups_after_writes(self):
+        first, second = self.medicamentos
+        effects = [create_effect(self.patient, first, self.institution, severity=severity)
+                   for severity in ('LEVE', 'GRAVE', 'GRAVE')]
+        create_effect(self.patient, second, self.institution)
+        self.assertEffectRollupsRebuilt()
+
+        effect = AdverseEffect.objects.get(pk=effects[0].pk)
+        effect.status = 'APPROVED'
+        effect.save()
+        effect.severity = 'GRAVE'
+        effect.medication = second
+        effect.save()
+        self.assertEffectRollupsRebuilt()
+
+        effects[2].delete()
+        self.assertEffectRollupsRebuilt()
+
+    def test_deferred_fields_are_not_counted_twice(self):
+        effect = create_effect(self.patient, self.medicamentos[0], self.institution)
+        effect = AdverseEffect.objects.only('id', 'description').get(pk=effect.pk)
+        effect.description = 'Mareo y cefalea'
+        effect.save()
+        effect = AdverseEffect.objects.defer('status', 'severity').get(pk=effect.pk)
+        effect.status = 'REJECTED'
+        effect.save()
+        self.assertEqual(AdverseEffectDailyRollup.objects.filter(report_count__gt=0).count(), 1)
+        self.assertEffectRollupsRebuilt()
+
+    def test_cascade_delete_resolves_maestro_once(self):
+        first, second = self.medicamentos
+        for _ in range(3):
+            create_effect(self.patient, first, self.institution)
+        create_effect(self.patient, second, self.institution)
+
+        with CaptureQueriesContext(connection) as queries:
+            first.delete()
+        maestro_lookups = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT "MediAlertServerApp_medicamento"."medicamento_maestro_id"')
+        ]
+        self.assertEqual(maestro_lookups, [])
+        self.assertEffectRollupsRebuilt()
+
+    def adherence_rollups(self):
+        return set(AdherenceDailyRollup.objects.filter(total__gt=0).values_list(
+            'usuario_id', 'recordatorio_id', 'day', 'total', 'tomados', 'omitidos', 'pospuestos'
+        ))
+
+    def assertAdherenceRollupsRebuilt(self):
+        maintained = self.adherence_rollups()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(maintained, self.adherence_rollups())
+
+    def test_adherence_rollups_after_writes(self):
+        recordatorios = [
+            Recordatorio.objects.create(usuario=self.patient, medicamento=medicamento, dosis='1', hora=time(9, 0))
+            for medicamento in self.medicamentos
+        ]
+        now = timezone.now()
+        registros = [
+            RegistroToma.objects.create(recordatorio=recordatorio, fecha_programada=now - timedelta(days=days))
+            for recordatorio in recordatorios for days in range(3)
+        ]
+        self.assertAdherenceRollupsRebuilt()
+
+        registro = RegistroToma.objects.get(pk=registros[0].pk)
+        registro.estado = 'TOMADO'
+        registro.save()
+        registro.fecha_programada -= timedelta(days=5)
+        registro.recordatorio = recordatorios[1]
+        registro.save()
+        self.assertAdherenceRollupsRebuilt()
+
+        registros[1].delete()
+        self.assertAdherenceRollupsRebuilt()
+
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        response = client.post('/registros-toma/batch/', {'actions': [
+            {'key': 'a', 'registro': registros[2].pk, 'action': 'tomar'},
+            {'key': 'b', 'registro': registros[3].pk, 'action': 'posponer', 'minutos': 60 * 24},
+            {'key': 'c', 'registro': registros[4].pk, 'action': 'posponer'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertAdherenceRollupsRebuilt()
+
+    def test_deferred_registro_fields_move_the_rollup(self):
+        recordatorio = Recordatorio.objects.create(
+            usuario=self.patient, medicamento=self.medicamentos[0], dosis='1', hora=time(9, 0)
+        )
+        registro = RegistroToma.objects.create(recordatorio=recordatorio, fecha_programada=timezone.now())
+
+        registro = RegistroToma.objects.only('id', 'recordatorio').get(pk=registro.pk)
+        registro.estado = 'TOMADO'
+        registro.save()
+        self.assertEqual(AdherenceDailyRollup.objects.get(total__gt=0).tomados, 1)
+
+        registro = RegistroToma.objects.defer('fecha_programada', 'estado').get(pk=registro.pk)
+        registro.fecha_programada = timezone.now() - timedelta(days=3)
+        registro.save()
+        self.assertEqual(AdherenceDailyRollup.objects.filter(total__gt=0).count(), 1)
+
+        version = Institution.objects.get(pk=self.institution.pk).adherence_version
+        self.assertAdherenceRollupsRebuilt()
+        # La reconstrucción invalida las respuestas de adherencia cacheadas
+        self.assertEqual(Institution.objects.get(pk=self.institution.pk).adherence_version, version + 1)
+
+    def test_cascade_delete_resolves_usuario_once(self):
+        recordatorio = Recordatorio.objects.create(
+            usuario=self.patient, medicamento=self.medicamentos[0], dosis='1', hora=time(9, 0)
+        )
+        now = timezone.now()
+        registros = [
+            RegistroToma.objects.create(recordatorio=recordatorio, fecha_programada=now - timedelta(days=days))
+            for days in range(3)
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            recordatorio.delete()
+        usuario_lookups = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT "MediAlertServerApp_recordatorio"."usuario_id"')
+        ]
+        self.assertEqual(usuario_lookups, [])
+        self.assertEqual(
+            set(SyncTombstone.objects.filter(model='registros_toma').values_list('object_id', 'usuario_id')),
+            {(registro.pk, self.patient.pk) for registro in registros}
+        )
+
+
+class VersionedCacheTests(TestCase):
+    """La clave de versioned_cache separa a los usuarios solo en endpoints per_user"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.first = create_member('first', 'PATIENT', cls.institution)
+        cls.second = create_member('second', 'PATIENT', cls.institution)
+
+    def call(self, per_user, user):
+        class View(APIView):
+            @versioned_cache('test_per_user' if per_user else 'test_shared', per_user=per_user)
+            def get(self, request):
+                return Response({'user': request.user.pk})
+
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user)
+        response = View.as_view()(request)
+        return response['ETag'], response.data
+
+    def test_per_user_endpoint_is_keyed_by_user(self):
+        first_etag, first_data = self.call(True, self.first)
+        second_etag, second_data = self.call(True, self.second)
+        self.assertNotEqual(first_etag, second_etag)
+        self.assertEqual(first_data, {'user': self.first.pk})
+        self.assertEqual(second_data, {'user': self.second.pk})
+
+    def test_institution_endpoint_is_shared(self):
+        first_etag, _ = self.call(False, self.first)
+        second_etag, second_data = self.call(False, self.second)
+        self.assertEqual(first_etag, second_etag)
+        self.assertEqual(second_data, {'user': self.first.pk})
+
+
+class KeysetPaginationTests(TestCase):
+    """Los cursores next/previous recorren la lista sin saltos ni repeticiones"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient)
+        cls.effects = [
+            create_effect(cls.patient, medicamento, cls.institution, severity='LEVE' if index % 2 else 'GRAVE')
+            for index in range(5)
+        ]
+        # Empates en reported_at: el desempate es el id
+        AdverseEffect.objects.filter(pk__in=[effect.pk for effect in cls.effects[1:4]]).update(
+            reported_at=cls.effects[2].reported_at
+        )
+        cls.expected = list(AdverseEffect.objects.order_by('-reported_at', '-id').values_list('id', flat=True))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row['id'] for row in response.data['results']]
+
+    def test_next_and_previous_round_trip(self):
+        pages = [self.client.get('/adverse-effects/', {'page_size': 2})]
+        while pages[-1].data['next']:
+            pages.append(self.client.get(pages[-1].data['next']))
+
+        self.assertEqual([self.ids(page) for page in pages], [self.expected[0:2], self.expected[2:4], self.expected[4:]])
+        self.assertIsNone(pages[0].data['previous'])
+
+        for index in range(len(pages) - 1, 0, -1):
+            previous = self.client.get(pages[index].data['previous'])
+            self.assertEqual(self.ids(previous), self.ids(pages[index - 1]))
+            self.assertIsNotNone(previous.data['next'])
+        self.assertIsNone(previous.data['previous'])
+
+    def test_cursor_with_other_filters_is_rejected(self):
+        page = self.client.get('/adverse-effects/filtered_reports/', {'severity': 'GRAVE', 'page_size': 1})
+        self.assertEqual(self.ids(page), [self.expected[0]])
+        cursor = re.search(r'cursor=([^&]+)', page.data['next']).group(1)
+
+        response = self.client.get('/adverse-effects/filtered_reports/', {'severity': 'LEVE', 'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/adverse-effects/', {'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/adverse-effects/filtered_reports/', {'severity': 'GRAVE', 'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+
+
+class ExportJobTests(TestCase):
+    """Reutilización de exportaciones idénticas y ficheros por trabajo"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.supervisor = create_member('supervisor', 'SUPERVISOR', cls.institution)
+        cls.request = {'kind': 'CSV', 'filters': {'severity': 'GRAVE'}, 'compress': False}
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.supervisor)
+
+    def submit(self):
+        response = self.client.post('/export-jobs/', self.request, format='json')
+        self.assertEqual(response.status_code, 202, response.data)
+        return ExportJob.objects.get(pk=response.data['id'])
+
+    def test_identical_request_reuses_job(self):
+        job = self.submit()
+        self.assertEqual(self.submit(), job)
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+    def test_stale_job_is_failed_and_requeued(self):
+        job = self.submit()
+        ExportJob.objects.filter(pk=job.pk).update(
+            created_at=timezone.now() - timedelta(minutes=settings.EXPORT_JOB_TIMEOUT_MINUTES + 1)
+        )
+        requeued = self.submit()
+        self.assertNotEqual(requeued, job)
+        self.assertEqual(requeued.status, 'PENDING')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'FAILED')
+
+    def test_artifact_path_is_per_job(self):
+        first = self.submit()
+        ExportJob.objects.filter(pk=first.pk).update(status='FAILED')
+        second = self.submit()
+        self.assertEqual(first.fingerprint, second.fingerprint)
+
+        with TemporaryDirectory() as root, override_settings(EXPORTS_ROOT=Path(root)):
+            first_path, _ = ExportJobService._write_artifact(first)
+            second_path, _ = ExportJobService._write_artifact(second)
+            self.assertNotEqual(first_path, second_path)
+            self.assertTrue(first_path.exists() and second_path.exists())
+
+
+class RegulatorySubmissionTests(TestCase):
+    """Cada caso aprobado se envía en un solo lote"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.other = Institution.objects.create(name='Clínica')
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        cls.medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient)
+
+    def approve(self, institution=None, resolved_at=None):
+        effect = create_effect(self.patient, self.medicamento, institution or self.institution)
+        AdverseEffect.objects.filter(pk=effect.pk).update(
+            status='APPROVED', resolved_at=resolved_at or timezone.now()
+        )
+        return effect.pk
+
+    def submitted(self, submission):
+        return list(submission.effects().values_list('id', flat=True))
+
+    def test_consecutive_submissions_never_overlap(self):
+        first_ids = [self.approve() for _ in range(3)]
+        first = RegulatorySubmission.create_next(self.institution.pk)
+        self.assertEqual(self.submitted(first), first_ids)
+        self.assertEqual(first.case_count, 3)
+        self.assertIsNone(RegulatorySubmission.create_next(self.institution.pk))
+
+        # Confirmado tarde con una resolución anterior a la marca del primer lote
+        late = self.approve(resolved_at=first.until_resolved_at - timedelta(hours=1))
+        second = RegulatorySubmission.create_next(self.institution.pk)
+        self.assertEqual(self.submitted(second), [late])
+        self.assertEqual((second.after_resolved_at, second.after_effect_id),
+                         (first.until_resolved_at, first.until_effect_id))
+
+    def test_cases_without_resolved_at_are_submitted(self):
+        effect_id = self.approve()
+        AdverseEffect.objects.filter(pk=effect_id).update(resolved_at=None)
+        submission = RegulatorySubmission.create_next(self.institution.pk)
+        self.assertEqual(self.submitted(submission), [effect_id])
+        self.assertIsNotNone(submission.until_resolved_at)
+
+    def test_institution_and_admin_submissions_do_not_overlap(self):
+        own = self.approve()
+        other = self.approve(institution=self.other)
+        self.assertEqual(self.submitted(RegulatorySubmission.create_next(self.institution.pk)), [own])
+        self.assertEqual(self.submitted(RegulatorySubmission.create_next()), [other])
+        self.assertIsNone(RegulatorySubmission.create_next())
+        self.assertEqual(RegulatorySubmissionCase.objects.count(), 2)
+
+
+class DoseActionBatchTests(TestCase):
+    """Acciones tomar/posponer encoladas sin conexión (registros-toma/batch/)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        cls.stranger = create_member('stranger', 'PATIENT', cls.institution)
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient)
+        cls.recordatorio = Recordatorio.objects.create(
+            usuario=cls.patient, medicamento=medicamento, dosis='1', hora=time(9, 0)
+        )
+        cls.scheduled = timezone.now().replace(microsecond=0) - timedelta(hours=2)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+        self.first, self.second, self.taken = [
+            RegistroToma.objects.create(recordatorio=self.recordatorio, fecha_programada=self.scheduled + timedelta(minutes=i))
+            for i in range(3)
+        ]
+        self.taken.estado = 'TOMADO'
+        self.taken.save()
+
+    def batch(self, actions):
+        response = self.client.post('/registros-toma/batch/', {'actions': actions}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return {result['key']: result for result in response.data['results']}
+
+    def test_batch_applies_take_and_postpone(self):
+        taken_at = self.scheduled + timedelta(minutes=5)
+        results = self.batch([
+            {'key': 'a', 'registro': self.first.pk, 'action': 'tomar', 'at': taken_at.isoformat()},
+            {'key': 'b', 'registro': self.second.pk, 'action': 'posponer', 'minutos': 30},
+            {'key': 'c', 'registro': self.taken.pk, 'action': 'posponer'},
+        ])
+        self.assertEqual([results[key]['status'] for key in 'abc'], ['success', 'postponed', 'already taken'])
+
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.estado, self.first.fecha_toma), ('TOMADO', taken_at))
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.estado, 'POSPUESTO')
+
+        created = RegistroToma.objects.get(pk=results['b']['new_registro_id'])
+        self.assertEqual(created.recordatorio, self.recordatorio)
+        self.assertEqual(created.fecha_programada, self.second.fecha_programada + timedelta(minutes=30))
+        self.assertEqual(created.estado, 'OMITIDO')
+        self.assertEqual(RegistroToma.objects.count(), 4)
+
+    def test_replayed_batch_is_not_applied_twice(self):
+        actions = [
+            {'key': 'a', 'registro': self.first.pk, 'action': 'posponer'},
+            {'key': 'b', 'registro': self.second.pk, 'action': 'tomar'},
+        ]
+        first = self.batch(actions)
+        replay = self.batch(actions)
+        self.assertEqual(RegistroToma.objects.count(), 4)
+        for key in 'ab':
+            self.assertFalse(first[key]['replayed'])
+            self.assertTrue(replay[key]['replayed'])
+            self.assertEqual({**replay[key], 'replayed': False}, first[key])
+
+    def test_other_users_doses_are_not_found(self):
+        self.client.force_authenticate(self.stranger)
+        results = self.batch([{'key': 'a', 'registro': self.first.pk, 'action': 'tomar'}])
+        self.assertEqual(results['a']['status'], 'not found')
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.estado, 'OMITIDO')
+
+
+class IdempotencyTests(TestCase):
+    """Reintentos con Idempotency-Key"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient)
+        cls.recordatorio = Recordatorio.objects.create(
+            usuario=cls.patient, medicamento=medicamento, dosis='1', hora=time(9, 0)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+        self.registro = RegistroToma.objects.create(recordatorio=self.recordatorio, fecha_programada=timezone.now())
+
+    def posponer(self, registro=None, key='key-1'):
+        return self.client.post(
+            f'/registros-toma/{(registro or self.registro).pk}/posponer/', {'minutos': 10},
+            format='json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replays_original_response(self):
+        first = self.posponer()
+        replay = self.posponer()
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn(REPLAYED_HEADER, first)
+        self.assertEqual(replay[REPLAYED_HEADER], 'true')
+        self.assertEqual((replay.status_code, replay.json()), (first.status_code, first.json()))
+        self.assertEqual(RegistroToma.objects.count(), 2)
+
+    def test_in_flight_key_conflicts_until_it_times_out(self):
+        record = IdempotencyRecord.objects.create(user=self.patient, scope='posponer', key='key-1')
+        self.assertEqual(self.posponer().status_code, 409)
+
+        IdempotencyRecord.objects.filter(pk=record.pk).update(
+            created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_IN_FLIGHT_SECONDS + 1)
+        )
+        self.assertEqual(self.posponer().status_code, 200)
+        self.assertEqual(RegistroToma.objects.count(), 2)
+
+    def test_key_reused_with_another_request(self):
+        other = RegistroToma.objects.create(recordatorio=self.recordatorio, fecha_programada=timezone.now())
+        self.assertEqual(self.posponer().status_code, 200)
+        self.assertEqual(self.posponer(registro=other).status_code, 422)
+
+    def test_server_error_releases_key(self):
+        calls = []
+
+        class View(APIView):
+            @idempotent('test-5xx')
+            def post(self, request):
+                calls.append(request.data)
+                return Response({}, status=503 if len(calls) == 1 else 201)
+
+        def post():
+            request = APIRequestFactory().post('/', {'a': 1}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+            force_authenticate(request, self.patient)
+            return View.as_view()(request)
+
+        self.assertEqual(post().status_code, 503)
+        self.assertFalse(IdempotencyRecord.objects.filter(scope='test-5xx').exists())
+        self.assertEqual(post().status_code, 201)
+        self.assertEqual(post().status_code, 201)
+        self.assertEqual(len(calls), 2)
+
+
+class AdherenceAnalyticsTests(TestCase):
+    """
+    Resultados exactos del motor de adherencia sobre tomas conocidas: diez días
+    seguidos a las 09:00 desde el lunes 6 de enero de 2025 con el patrón
+    T T O T T T O O O T (T = tomada, O = omitida) y una toma pospuesta
+    """
+    PATTERN = 'TTOTTTOOOT'
+    # Minutos de retraso de cada toma tomada, en orden
+    LATENESS = [-20, 0, 5, 20, 45, 200]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        cls.maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        cls.recordatorio = cls.create_recordatorio(cls.patient)
+        cls.start = timezone.make_aware(datetime(2025, 1, 6, 9, 0))
+
+        lateness = iter(cls.LATENESS)
+        for day, state in enumerate(cls.PATTERN):
+            scheduled = cls.start + timedelta(days=day)
+            if state == 'T':
+                RegistroToma.objects.create(
+                    recordatorio=cls.recordatorio, fecha_programada=scheduled, estado='TOMADO',
+                    fecha_toma=scheduled + timedelta(minutes=next(lateness))
+                )
+            else:
+                RegistroToma.objects.create(recordatorio=cls.recordatorio, fecha_programada=scheduled)
+        RegistroToma.objects.create(
+            recordatorio=cls.recordatorio, fecha_programada=cls.start + timedelta(days=3, hours=1), estado='POSPUESTO'
+        )
+
+    @classmethod
+    def create_recordatorio(cls, usuario):
+        medicamento = Medicamento.objects.create(medicamento_maestro=cls.maestro, usuario=usuario)
+        return Recordatorio.objects.create(usuario=usuario, medicamento=medicamento, dosis='1', hora=time(9, 0))
+
+    def run_analytics(self, queryset=None):
+        return AdherenceAnalytics(queryset if queryset is not None else RegistroToma.objects.all()).run()
+
+    def test_single_patient(self):
+        result = self.run_analytics()
+
+        self.assertEqual(result['summary'], {
+            'patients': 1, 'scheduled': 10, 'taken': 6, 'missed': 4, 'postponed': 1, 'adherence': 60.0
+        })
+
+        by_weekday = {row['weekday']: (row['scheduled'], row['missed'], row['adherence'])
+                      for row in result['heatmap']['by_weekday']}
+        self.assertEqual(by_weekday, {
+            'lunes': (2, 1, 50.0), 'martes': (2, 1, 50.0), 'miércoles': (2, 1, 50.0), 'jueves': (1, 0, 100.0),
+            'viernes': (1, 0, 100.0), 'sábado': (1, 0, 100.0), 'domingo': (1, 1, 0.0),
+        })
+        self.assertEqual(result['heatmap']['by_hour'][9], {'hour': 9, 'scheduled': 10, 'missed': 4, 'adherence': 60.0})
+        self.assertEqual(result['heatmap']['by_hour'][10], {'hour': 10, 'scheduled': 0, 'missed': 0, 'adherence': None})
+        monday = result['heatmap']['by_weekday_hour'][0]
+        self.assertEqual((monday['scheduled'][9], monday['missed'][9], monday['adherence'][9]), (2, 1, 50.0))
+        self.assertEqual(sum(monday['scheduled']), 2)
+
+        self.assertEqual(result['medication'], [{
+            'medicamento_maestro__nombre': 'Ibuprofeno', 'patients': 1, 'scheduled': 10, 'missed': 4, 'adherence': 60.0
+        }])
+
+        rolling = result['rolling']
+        self.assertEqual([row['date'] for row in rolling], [date(2025, 1, 6) + timedelta(days=day) for day in range(10)])
+        self.assertEqual([row['taken'] for row in rolling], [int(state == 'T') for state in self.PATTERN])
+        self.assertEqual([row['rolling_adherence'] for row in rolling],
+                         [100.0, 100.0, 66.67, 75.0, 80.0, 83.33, 71.43, 57.14, 42.86, 57.14])
+
+        self.assertEqual(result['streaks'], {
+            'longest_taken_streak': 3,
+            'current_taken_streak': 1,
+            'missed_runs': [
+                {'length': '1', 'count': 1}, {'length': '2', 'count': 0}, {'length': '3', 'count': 1},
+                {'length': '4-6', 'count': 0}, {'length': '7+', 'count': 0},
+            ]
+        })
+
+        lateness = result['lateness']
+        self.assertEqual(lateness['doses'], 6)
+        self.assertEqual([row['count'] for row in lateness['distribution']], [0, 1, 0, 2, 1, 1, 0, 1])
+        self.assertEqual(
+            (lateness['median_minutes'], lateness['p90_minutes'], lateness['on_time_percentage']), (12.5, 122.5, 33.33)
+        )
+
+    def test_several_patients(self):
+        other = create_member('other', 'PATIENT', self.institution)
+        recordatorio = self.create_recordatorio(other)
+        for day, estado in enumerate(['TOMADO', 'OMITIDO']):
+            RegistroToma.objects.create(
+                recordatorio=recordatorio, fecha_programada=self.start + timedelta(days=day), estado=estado
+            )
+
+        result = self.run_analytics()
+        self.assertEqual(result['summary']['patients'], 2)
+        self.assertEqual(result['medication'][0]['patients'], 2)
+        self.assertEqual(result['lateness']['doses'], 6)
+        streaks = result['streaks']
+        self.assertEqual(
+            (streaks['avg_longest_taken_streak'], streaks['max_longest_taken_streak'],
+             streaks['avg_current_taken_streak'], streaks['patients_with_current_streak']),
+            (2.0, 3, 0.5, 1)
+        )
+        self.assertEqual([row['count'] for row in streaks['missed_runs']], [2, 0, 1, 0, 0])
+
+    def test_no_rows(self):
+        result = self.run_analytics(RegistroToma.objects.none())
+        self.assertEqual(result['summary'], {
+            'patients': 0, 'scheduled': 0, 'taken': 0, 'missed': 0, 'postponed': 0, 'adherence': None
+        })
+        self.assertTrue(all(
+            row['scheduled'] == 0 and row['adherence'] is None for row in result['heatmap']['by_hour']
+        ))
+        self.assertEqual(result['medication'], [])
+        self.assertEqual(result['rolling'], [])
+        self.assertEqual(result['streaks'], {'longest_taken_streak': 0, 'current_taken_streak': 0, 'missed_runs': []})
+        self.assertEqual(result['lateness'], {
+            'doses': 0,
+            'distribution': [{'minutes': label, 'count': 0} for label in AdherenceAnalytics.LATENESS_LABELS]
+        })
+
+    def test_retrieve_validates_patient_and_requester(self):
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        self.assertEqual(client.get('/adherence/abc/').status_code, 404)
+        self.assertEqual(client.get('/adherence/999999/').status_code, 404)
+        response = client.get(f'/adherence/{self.patient.pk}/', {'days': 3650})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['summary']['scheduled'], 10)
+
+        orphan = User.objects.create_user(username='orphan', password='x')
+        UserProfile.objects.filter(user=orphan).delete()
+        professional = create_member('professional', 'PROFESSIONAL', self.institution)
+        client.force_authenticate(professional)
+        self.assertEqual(client.get(f'/adherence/{orphan.pk}/').status_code, 404)
+        self.assertEqual(client.get(f'/adherence/{self.patient.pk}/').status_code, 200)
+
+        client.force_authenticate(User.objects.get(pk=orphan.pk))
+        self.assertEqual(client.get(f'/adherence/{self.patient.pk}/').status_code, 403)
+
+
+class ScheduleTests(TestCase):
+    """Tomas de today/upcoming/home: registros generados y días completados con aplica_en"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        cls.medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient)
+
+    def create_recordatorio(self, frecuencia, dias_semana=None, fecha_inicio=None):
+        recordatorio = Recordatorio.objects.create(
+            usuario=self.patient, medicamento=self.medicamento, dosis='1', hora=time(9, 0),
+            frecuencia=frecuencia, dias_semana=dias_semana
+        )
+        if fecha_inicio:
+            Recordatorio.objects.filter(pk=recordatorio.pk).update(fecha_inicio=fecha_inicio)
+            recordatorio.refresh_from_db()
+        return recordatorio
+
+    def schedule(self, first_day, days):
+        start = timezone.make_aware(datetime.combine(first_day, time.min))
+        return [
+            (fecha_programada, registro_id, estado)
+            for _, fecha_programada, registro_id, estado in RecordatorioService.schedule(
+                self.patient, start, start + timedelta(days=days)
+            )
+        ]
+
+    def test_weekly_doses(self):
+        first_day = timezone.localdate() + timedelta(days=7)
+        matching = {first_day, first_day + timedelta(days=2)}
+        recordatorio = self.create_recordatorio(
+            'WEEKLY', ','.join(str(day.isoweekday()) for day in sorted(matching))
+        )
+        materialized, fallback = sorted(recordatorio.programada_en(day) for day in matching)
+        registro = RegistroToma.objects.create(recordatorio=recordatorio, fecha_programada=materialized)
+
+        self.assertEqual(self.schedule(first_day, 7), [
+            (materialized, registro.pk, RecordatorioService.PENDING),
+            (fallback, None, RecordatorioService.PENDING),
+        ])
+        # Día sin toma según dias_semana
+        self.assertEqual(self.schedule(first_day + timedelta(days=1), 1), [])
+
+    def test_past_doses_are_taken_or_missed(self):
+        first_day = timezone.localdate() - timedelta(days=3)
+        recordatorio = self.create_recordatorio('DAILY', fecha_inicio=first_day)
+        taken = RegistroToma.objects.create(
+            recordatorio=recordatorio, fecha_programada=recordatorio.programada_en(first_day), estado='TOMADO'
+        )
+        missed = RegistroToma.objects.create(
+            recordatorio=recordatorio, fecha_programada=recordatorio.programada_en(first_day + timedelta(days=1))
+        )
+        self.assertEqual(self.schedule(first_day, 3), [
+            (taken.fecha_programada, taken.pk, 'TOMADO'),
+            (missed.fecha_programada, missed.pk, 'OMITIDO'),
+            (recordatorio.programada_en(first_day + timedelta(days=2)), None, 'OMITIDO'),
+        ])
+
+    def test_monthly_and_custom_rules(self):
+        monthly = self.create_recordatorio('MONTHLY', fecha_inicio=date(2025, 1, 31))
+        self.assertEqual(
+            [day for day in (date(2025, 2, 27), date(2025, 2, 28), date(2025, 3, 30), date(2025, 3, 31),
+                             date(2025, 4, 30)) if monthly.aplica_en(day)],
+            [date(2025, 2, 28), date(2025, 3, 31), date(2025, 4, 30)]
+        )
+
+        weekend = self.create_recordatorio('CUSTOM', '6,7', fecha_inicio=date(2025, 1, 1))
+        every_day = self.create_recordatorio('CUSTOM', fecha_inicio=date(2025, 1, 1))
+        week = [date(2025, 1, 6) + timedelta(days=day) for day in range(7)]
+        self.assertEqual([day for day in week if weekend.aplica_en(day)], week[5:])
+        self.assertTrue(all(every_day.aplica_en(day) for day in week))
+
+
+class SparseFieldsetTests(TestCase):
+    """?fields= / ?exclude= y la lectura de listas con values()"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno', principio_activo='Ibuprofeno')
+        medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient)
+        recordatorio = Recordatorio.objects.create(
+            usuario=cls.patient, medicamento=medicamento, dosis='1', hora=time(9, 0), dias_semana='1,3'
+        )
+        now = timezone.now()
+        RegistroToma.objects.create(recordatorio=recordatorio, fecha_programada=now, estado='TOMADO', fecha_toma=now)
+        RegistroToma.objects.create(recordatorio=recordatorio, fecha_programada=now + timedelta(days=1))
+        effect = AdverseEffect.objects.get(pk=create_effect(cls.patient, medicamento, cls.institution).pk)
+        effect.status = 'APPROVED'
+        effect.save()
+        create_effect(cls.patient, medicamento, cls.institution, end_date=date.today())
+        AlertNotification.objects.create(
+            adverse_effect=effect, recipient=cls.patient, title='Aviso', message='Mensaje', priority='HIGH'
+        )
+
+    def test_values_rows_match_serializer(self):
+        cases = [
+            (MedicamentoMaestroSerializer, MedicamentoMaestro.objects.all()),
+            (MedicamentoSerializer, Medicamento.objects.all()),
+            (RecordatorioSerializer, Recordatorio.objects.all()),
+            (RegistroTomaSerializer, RegistroToma.objects.all()),
+            (AdverseEffectSerializer, AdverseEffect.objects.all()),
+            (AlertNotificationSerializer, AlertNotification.objects.all()),
+        ]
+        for serializer_class, queryset in cases:
+            queryset = queryset.order_by('id')
+            last_fields = ','.join(list(serializer_class().fields)[-2:])
+            for query in ('', '?exclude=id', f'?fields={last_fields}'):
+                request = Request(APIRequestFactory().get(f'/{query}'))
+                with self.subTest(serializer=serializer_class.__name__, query=query):
+                    serializer = serializer_class(context={'request': request})
+                    plan = ValuesRepresentation.for_serializer(serializer)
+                    self.assertIsNotNone(plan)
+                    expected = serializer_class(queryset, many=True, context={'request': request}).data
+                    self.assertEqual(
+                        [plan.represent(row) for row in plan.values(queryset)],
+                        [dict(row) for row in expected]
+                    )
+
+    def test_field_selection(self):
+        client = APIClient()
+        client.force_authenticate(self.patient)
+
+        response = client.get('/registros-toma/', {'fields': 'id,estado'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({tuple(row) for row in response.data['results']}, {('id', 'estado')})
+        response = client.get('/registros-toma/', {'exclude': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('notas', response.data['results'][0])
+
+        for params in ({'fields': 'id,unknown'}, {'exclude': 'unknown'}, {'fields': ''}, {'fields': ','},
+                       {'fields': 'id', 'exclude': 'id'}):
+            with self.subTest(params=params):
+                self.assertEqual(client.get('/registros-toma/', params).status_code, 400)
+
+
+class WireFormatTests(TestCase):
+    """Respuestas y cuerpos en MessagePack y compresión de las respuestas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient)
+        cls.recordatorio = Recordatorio.objects.create(
+            usuario=cls.patient, medicamento=medicamento, dosis='1', hora=time(9, 0)
+        )
+        now = timezone.now()
+        cls.registros = [
+            RegistroToma.objects.create(recordatorio=cls.recordatorio, fecha_programada=now - timedelta(hours=hours))
+            for hours in range(20)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def test_msgpack_round_trip(self):
+        as_json = self.client.get('/registros-toma/')
+        as_msgpack = self.client.get('/registros-toma/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(as_msgpack['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(as_msgpack.content, raw=False), json.loads(as_json.content))
+
+        registro = self.registros[0]
+        response = self.client.post(
+            f'/registros-toma/{registro.pk}/posponer/', msgpack.packb({'minutos': 30}),
+            content_type='application/msgpack', HTTP_ACCEPT='application/msgpack'
+        )
+        self.assertEqual(response.status_code, 200)
+        created = RegistroToma.objects.get(pk=msgpack.unpackb(response.content, raw=False)['new_registro_id'])
+        self.assertEqual(created.fecha_programada, registro.fecha_programada + timedelta(minutes=30))
+
+        response = self.client.post(
+            f'/registros-toma/{registro.pk}/posponer/', b'\xc1', content_type='application/msgpack'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_compression_threshold(self):
+        size = len(self.client.get('/registros-toma/').content)
+        with override_settings(COMPRESSION_MIN_SIZE=size):
+            response = self.client.get('/registros-toma/', HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertEqual(len(gzip.decompress(response.content)), size)
+        with override_settings(COMPRESSION_MIN_SIZE=size + 1):
+            response = self.client.get('/registros-toma/', HTTP_ACCEPT_ENCODING='gzip')
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(len(response.content), size)
+
+    @override_settings(COMPRESSION_MIN_SIZE=1)
+    def test_refused_encodings_are_not_used(self):
+        for header in ('gzip;q=0', 'gzip; q=0.0, identity', 'identity'):
+            with self.subTest(accept_encoding=header):
+                response = self.client.get('/registros-toma/', HTTP_ACCEPT_ENCODING=header)
+                self.assertFalse(response.has_header('Content-Encoding'))
+        response = self.client.get('/registros-toma/', HTTP_ACCEPT_ENCODING='identity;q=0.5, gzip;q=0.1')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    @override_settings(COMPRESSION_MIN_SIZE=1)
+    def test_malformed_q_values_are_ignored(self):
+        for header in ('gzip;q=1.2.3', 'gzip;q=.', 'gzip;q=2', 'gzip;q=abc', 'gzip;q=0.0001'):
+            with self.subTest(accept_encoding=header):
+                response = self.client.get('/registros-toma/', HTTP_ACCEPT_ENCODING=header)
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(response.has_header('Content-Encoding'))
+        response = self.client.get('/registros-toma/', HTTP_ACCEPT_ENCODING='br;q=1.2.3, gzip;q=0.8')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    @override_settings(COMPRESSION_MIN_SIZE=1)
+    def test_weak_etag_still_revalidates(self):
+        response = self.client.get('/home/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+
+        response = self.client.get('/home/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/home/', HTTP_IF_NONE_MATCH=etag.removeprefix('W/'))
+        self.assertEqual(response.status_code, 304)
+
+
+class AssignBacklogTests(TestCase):
+    """Reparto de los reportes que quedaron sin revisor (assign_backlog)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.other = Institution.objects.create(name='Clínica')
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient)
+        # Sin profesionales los reportes quedan en CREATED sin revisor
+        cls.backlog = [
+            create_effect(cls.patient, medicamento, cls.institution, severity=severity)
+            for severity in ('LEVE', 'MUY_GRAVE', 'LEVE', 'GRAVE', 'MODERADA', 'LEVE')
+        ]
+        cls.foreign = create_effect(cls.patient, medicamento, cls.other)
+        cls.busy = create_member('busy', 'PROFESSIONAL', cls.institution)
+        UserProfile.objects.filter(user=cls.busy).update(open_reviews=2)
+        cls.idle = create_member('idle', 'PROFESSIONAL', cls.institution)
+
+    def assign(self, *args):
+        output = StringIO()
+        with mock.patch.object(ReviewerAssignmentService, 'UPDATE_BATCH_SIZE', 2):
+            call_command('assign_backlog', *args, stdout=output)
+        return output.getvalue()
+
+    def test_backlog_is_balanced_in_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            output = self.assign('--institution', str(self.institution.pk))
+        self.assertIn('Reportes asignados: 6, sin profesional disponible: 0', output)
+
+        # idle recibe 4 (dos lotes) y busy 2 (un lote): ambos acaban con 4 abiertos
+        updates = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE "MediAlertServerApp_adverseeffect" SET "reviewer_id"')
+        ]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(
+            dict(UserProfile.objects.filter(user__in=[self.busy, self.idle]).values_list('user__username', 'open_reviews')),
+            {'busy': 4, 'idle': 4}
+        )
+        effects = AdverseEffect.objects.filter(pk__in=[effect.pk for effect in self.backlog])
+        self.assertEqual(set(effects.values_list('status', flat=True)), {'ASSIGNED'})
+        self.assertEqual(effects.filter(reviewer=self.idle).count(), 4)
+        # Primero los más graves: el MUY_GRAVE va al menos cargado
+        self.assertEqual(AdverseEffect.objects.get(pk=self.backlog[1].pk).reviewer, self.idle)
+        self.assertEqual(
+            AdverseEffectTransition.objects.filter(from_status='CREATED', to_status='ASSIGNED').count(), 6
+        )
+
+        self.foreign.refresh_from_db()
+        self.assertEqual((self.foreign.status, self.foreign.reviewer), ('CREATED', None))
+
+    def test_rerun_and_dry_run_change_nothing(self):
+        self.assertIn('[dry-run] Reportes asignados: 6', self.assign('--dry-run'))
+        self.assertFalse(AdverseEffect.objects.filter(status='ASSIGNED').exists())
+
+        self.assertIn('sin profesional disponible: 1', self.assign())
+        rollups = set(AdverseEffectDailyRollup.objects.filter(report_count__gt=0).values_list(
+            'status', 'report_count'
+        ))
+        self.assertIn('Reportes asignados: 0, sin profesional disponible: 1', self.assign())
+        self.assertEqual(
+            dict(UserProfile.objects.filter(user__in=[self.busy, self.idle]).values_list('user__username', 'open_reviews')),
+            {'busy': 4, 'idle': 4}
+        )
+        self.assertEqual(AdverseEffectTransition.objects.filter(to_status='ASSIGNED').count(), 6)
+        self.assertEqual(set(AdverseEffectDailyRollup.objects.filter(report_count__gt=0).values_list(
+            'status', 'report_count'
+        )), rollups)
+
+
+class AdverseEffectAnalyticsTests(TestCase):
+    """El motor en una pasada debe coincidir con las consultas agregadas por separado"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = create_synthetic_reports(400, medications=8, days=90, seed=7)
+
+    def test_matches_legacy_queries(self):
+        queryset = AdverseEffect.objects.filter(institution=self.institution)
+        result = AdverseEffectAnalytics(queryset).run()
+        severity, medication, monthly, weekly, by_type, severity_type, type_medication, severity_route = \
+            legacy_analysis(queryset)
+
+        self.assertEqual(
+            {row['severity']: row['count'] for row in result['severity_analysis']},
+            {row['severity']: row['count'] for row in severity}
+        )
+        for row in severity:
+            engine = next(item for item in result['severity_analysis'] if item['severity'] == row['severity'])
+            self.assertAlmostEqual(engine['percentage'], row['percentage'])
+            self.assertAlmostEqual(
+                engine['avg_resolution_time'].total_seconds(), row['avg_resolution_time'].total_seconds(), places=3
+            )
+
+        self.assertEqual(
+            {row['medication__medicamento_maestro__nombre']: (
+                row['total_reports'], row['severe_cases'], row['first_reported'], row['last_reported']
+            ) for row in result['medication_analysis']},
+            {row['medication__medicamento_maestro__nombre']: (
+                row['total_reports'], row['severe_cases'], row['first_reported'].date(), row['last_reported'].date()
+            ) for row in medication}
+        )
+        self.assertEqual(
+            result['temporal_analysis']['monthly'],
+            [{'month': row['month'].date(), 'count': row['count']} for row in monthly]
+        )
+        self.assertEqual(
+            result['temporal_analysis']['weekly'],
+            [{'week': row['week'].date(), 'count': row['count']} for row in weekly]
+        )
+        # Un solo paciente: cada medicamento maestro tiene un único Medicamento
+        self.assertEqual(
+            sorted((row['type'], row['count'], row['severe_cases'], row['medications_affected'])
+                   for row in result['type_analysis']),
+            sorted((row['type'], row['count'], row['severe_cases'], row['medications_affected']) for row in by_type)
+        )
+
+        def as_set(rows, *fields):
+            return {tuple(row[field] for field in fields) + (row['count'],) for row in rows}
+
+        self.assertEqual(as_set(result['severity_by_type'], 'severity', 'type'),
+                         as_set(severity_type, 'severity', 'type'))
+        self.assertEqual(
+            as_set(result['type_by_medication'], 'type', 'medication__medicamento_maestro__nombre'),
+            as_set(type_medication, 'type', 'medication__medicamento_maestro__nombre')
+        )
+        self.assertEqual(as_set(result['severity_by_route'], 'severity', 'administration_route'),
+                         as_set(severity_route, 'severity', 'administration_route'))
+
+
+class SignalDetectorTests(TestCase):
+    """Medidas de desproporcionalidad contra tablas 2x2 calculadas a mano"""
+
+    def test_measures_match_hand_computed_table(self):
+        # a=20, b=80, c=10, d=890 (n=1000) para el par (medicamento 0, evento 0)
+        measures = SignalDetector(counts=DrugEventCount.objects.none()).compute(
+            np.array([[20.0, 80.0], [10.0, 890.0]])
+        )
+        expected = {
+            'a': 20, 'b': 80, 'c': 10, 'd': 890,
+            # PRR = (20/100) / (10/900); ROR = 20*890 / (80*10)
+            'prr': 18.0, 'ror': 22.25,
+            # exp(ln(PRR) ± 1.96 * sqrt(1/a - 1/(a+b) + 1/c - 1/(c+d)))
+            'prr_lower': 8.670469, 'prr_upper': 37.368221,
+            # exp(ln(ROR) ± 1.96 * sqrt(1/a + 1/b + 1/c + 1/d))
+            'ror_lower': 10.069529, 'ror_upper': 49.164416,
+            # 1000 * (|17800 - 800| - 500)² / (100 * 900 * 30 * 970)
+            'chi_squared': 103.951890,
+        }
+        for name, value in expected.items():
+            self.assertAlmostEqual(float(measures[name][0, 0]), value, places=5, msg=name)
+        self.assertTrue(measures['signal'][0, 0])
+
+    def test_yates_correction_is_clipped(self):
+        # |ad - bc| = 0 < n/2: sin recorte saldría (0 - 10)² y chi² = 0.2
+        measures = SignalDetector(counts=DrugEventCount.objects.none()).compute(
+            np.array([[5.0, 5.0], [5.0, 5.0]])
+        )
+        self.assertEqual(float(measures['chi_squared'][0, 0]), 0.0)
+        self.assertAlmostEqual(float(measures['prr'][0, 0]), 1.0)
+
+        # |ad - bc| = 10 < n/2 = 20.5
+        measures = SignalDetector(counts=DrugEventCount.objects.none()).compute(
+            np.array([[10.0, 10.0], [10.0, 11.0]])
+        )
+        self.assertEqual(float(measures['chi_squared'][0, 0]), 0.0)
+        self.assertFalse(measures['signal'].any())
+
+
+class DuplicateDetectionTests(TestCase):
+    """Marcado de casi duplicados al crear reportes"""
+    DESCRIPTION = 'Mareo intenso y náuseas tras la segunda dosis de la mañana'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.other = Institution.objects.create(name='Clínica')
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        cls.medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def indexed_effect(self, institution, description=DESCRIPTION):
+        effect = create_effect(self.patient, self.medicamento, institution, description=description)
+        DuplicateDetector().index(effect)
+        return effect
+
+    def report(self, description):
+        response = self.client.post('/adverse-effects/', {
+            'medication': self.medicamento.pk, 'institution': self.institution.pk, 'patient': self.patient.pk,
+            'description': description, 'start_date': str(date.today()), 'severity': 'GRAVE', 'type': 'A',
+            'administration_route': 'ORAL', 'dosage': '1', 'frequency': '1'
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return AdverseEffect.objects.get(pk=response.data['id'])
+
+    def test_near_identical_report_is_flagged(self):
+        original = self.indexed_effect(self.institution)
+
+        effect = self.report('Mareo intenso y nauseas tras la segunda dosis de la mañana.')
+        self.assertEqual(effect.duplicate_of_id, original.pk)
+        self.assertGreaterEqual(effect.duplicate_score, DuplicateDetector.THRESHOLD)
+
+    def test_unrelated_report_is_not_flagged(self):
+        self.indexed_effect(self.institution)
+
+        effect = self.report('Erupción cutánea con picor en ambos brazos')
+        self.assertIsNone(effect.duplicate_of_id)
+        self.assertIsNone(effect.duplicate_score)
+
+    def test_other_institution_is_never_matched(self):
+        self.indexed_effect(self.other)
+
+        effect = self.report(self.DESCRIPTION)
+        self.assertIsNone(effect.duplicate_of_id)
+        self.assertIsNone(effect.duplicate_score)
+
+
+class DashboardExportTests(TestCase):
+    """Exportaciones en streaming del dashboard"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.other = Institution.objects.create(name='Clínica')
+        cls.supervisor = create_member('supervisor', 'SUPERVISOR', cls.institution)
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient)
+        cls.effects = [
+            create_effect(cls.patient, medicamento, cls.institution, severity=severity, description=description)
+            for severity, description in [
+                ('GRAVE', 'Mareo'), ('LEVE', 'Náuseas, vómitos'), ('GRAVE', 'Cefalea\ncon "aura"'), ('LEVE', 'Fatiga')
+            ]
+        ]
+        create_effect(cls.patient, medicamento, cls.other, description='Otra institución')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.supervisor)
+
+    def download(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def csv_rows(self, **params):
+        response, content = self.download('/dashboard/export_csv/', **params)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        return list(csv.reader(StringIO(content.decode('utf-8'))))
+
+    def test_csv_header_and_rows(self):
+        rows = self.csv_rows()
+        self.assertEqual(rows[0], ['Fecha', 'Medicamento', 'Severidad', 'Tipo', 'Descripción', 'Estado'])
+        self.assertEqual(len(rows) - 1, len(self.effects))
+        self.assertEqual(
+            sorted(row[4] for row in rows[1:]),
+            sorted(effect.description for effect in self.effects)
+        )
+        self.assertEqual({row[1] for row in rows[1:]}, {'Ibuprofeno'})
+
+    def test_csv_filters(self):
+        rows = self.csv_rows(severity='GRAVE')
+        self.assertEqual(len(rows) - 1, 2)
+        self.assertEqual({row[2] for row in rows[1:]}, {'GRAVE'})
+
+        self.assertEqual(self.csv_rows(type='B'), [rows[0]])
+
+    def test_csv_gzip(self):
+        response, content = self.download('/dashboard/export_csv/', compress='gzip')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.csv.gz"'))
+
+        rows = list(csv.reader(StringIO(gzip.decompress(content).decode('utf-8'))))
+        self.assertEqual(rows, self.csv_rows())
+
+    def test_json_array_parses(self):
+        response, content = self.download('/dashboard/export_json/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = json.loads(content)
+        self.assertIsInstance(data, list)
+        self.assertEqual(sorted(row['id'] for row in data), sorted(effect.pk for effect in self.effects))
+        self.assertEqual({row['medicamento_nombre'] for row in data}, {'Ibuprofeno'})
+
+        response, content = self.download('/dashboard/export_json/', fields='id,severity', compress='gzip')
+        data = json.loads(gzip.decompress(content))
+        self.assertEqual(len(data), len(self.effects))
+        self.assertEqual({tuple(row) for row in data}, {('id', 'severity')})
+
+    def test_ndjson_lines_parse(self):
+        response, content = self.download('/dashboard/export_json/', mode='ndjson', severity='GRAVE')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = content.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 2)
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual({row['severity'] for row in rows}, {'GRAVE'})
+        self.assertIn('Cefalea\ncon "aura"', [row['description'] for row in rows])
+
+    def test_json_empty_queryset(self):
+        _, content = self.download('/dashboard/export_json/', type='B')
+        self.assertEqual(json.loads(content), [])
+
+        _, content = self.download('/dashboard/export_json/', mode='ndjson', type='B')
+        self.assertEqual(content, b'')
+
+
+class PDFReportTests(TestCase):
+    """Renderizado del PDF por tramos en varios procesos y unión final"""
+
+    def report_data(self, count):
+        return {
+            'total_reports': count, 'severe_cases': 0, 'pending_cases': count,
+            'effects': ([f'Med {index:03d}', 'LEVE', 'A', '2026-01-01'] for index in range(count))
+        }
+
+    def assertRowsInOrder(self, pdf, count):
+        reader = PdfReader(BytesIO(pdf))
+        text = '\n'.join(page.extract_text() for page in reader.pages)
+        self.assertIn('Reporte de Efectos Adversos', reader.pages[0].extract_text())
+        self.assertEqual(re.findall(r'Med (\d{3})', text), [f'{index:03d}' for index in range(count)])
+        return reader
+
+    def test_parts_merge_into_one_pdf(self):
+        generator = ReportGenerator(rows_per_table=20)
+        with mock.patch.object(ReportGenerator, 'ROWS_PER_PART', 50):
+            # Tramos de 40 filas (múltiplo de rows_per_table): 40 + 40 + 20
+            pdf = generator.generate_adverse_effects_report(self.report_data(100), workers=2)
+
+        reader = self.assertRowsInOrder(pdf, 100)
+        summary = BytesIO()
+        ReportGenerator()._document(summary).build(ReportGenerator()._summary(self.report_data(100), None))
+        parts = [
+            _render_detail_part([[f'Med {index:03d}', 'LEVE', 'A', '2026-01-01'] for index in range(start, stop)], 20)
+            for start, stop in [(0, 40), (40, 80), (80, 100)]
+        ]
+        self.assertEqual(
+            len(reader.pages),
+            sum(len(PdfReader(BytesIO(pdf)).pages) for pdf in [summary.getvalue()] + parts)
+        )
+
+    def test_single_part_and_sequential_fallback(self):
+        # Menos filas que un tramo: un único proceso de renderizado
+        parallel = ReportGenerator(rows_per_table=20).generate_adverse_effects_report(self.report_data(30), workers=2)
+        self.assertRowsInOrder(parallel, 30)
+
+        sequential = ReportGenerator(rows_per_table=20).generate_adverse_effects_report(self.report_data(30))
+        self.assertRowsInOrder(sequential, 30)
+
+
+class ICSRWriterTests(TestCase):
+    """XML de los ICSR exportados"""
+
+    def test_control_characters_are_stripped(self):
+        institution = Institution.objects.create(name='Hospital\x0b Central')
+        patient = create_member('patient', 'PATIENT', institution)
+        User.objects.filter(pk=patient.pk).update(first_name='\x01Ana', last_name='Ruiz')
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibupro\x1ffeno', principio_activo='Ibuprofeno')
+        medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=patient)
+        create_effect(
+            patient, medicamento, institution,
+            description='Mareo\x00 y\x08 náuseas\tpor la\nmañana\x0c', dosage='1\x07', administration_route='Oral'
+        )
+
+        document = ''.join(ICSRWriter(AdverseEffect.objects.all(), message_number='1').chunks())
+        root = ET.fromstring(document.encode('utf-8'))
+
+        self.assertEqual(root.findtext('.//primarysourcereaction'), 'Mareo y náuseas\tpor la\nmañana')
+        self.assertEqual(root.findtext('.//medicinalproduct'), 'Ibuprofeno')
+        self.assertEqual(root.findtext('.//drugdosagetext'), '1 1')
+        self.assertEqual(root.findtext('.//reporterorganization'), 'Hospital Central')
+        self.assertEqual(root.findtext('.//patientinitial'), 'AR')
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class SyncTests(TestCase):
+    """Sincronización incremental de la app móvil (/sync/)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        institution = Institution.objects.create(name='Hospital')
+        cls.patient = create_member('patient', 'PATIENT', institution)
+        cls.other = create_member('other', 'PATIENT', institution)
+        cls.maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        cls.medicamento = Medicamento.objects.create(medicamento_maestro=cls.maestro, usuario=cls.patient)
+        cls.recordatorio = Recordatorio.objects.create(
+            usuario=cls.patient, medicamento=cls.medicamento, dosis='1', hora=time(8, 0)
+        )
+        RegistroToma.objects.create(recordatorio=cls.recordatorio, fecha_programada=timezone.now() - timedelta(hours=1))
+        Medicamento.objects.create(medicamento_maestro=cls.maestro, usuario=cls.other)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def sync(self, token=None, **headers):
+        response = self.client.get('/sync/', {'since': token} if token else {}, **headers)
+        self.assertIn(response.status_code, (200, 304))
+        return response
+
+    def ids(self, response, name, kind='updated'):
+        changes = response.data['changes'][name][kind]
+        return sorted(changes if kind == 'deleted' else [row['id'] for row in changes])
+
+    def test_first_sync_is_a_full_copy(self):
+        response = self.sync()
+        self.assertFalse(response.data['has_more'])
+        self.assertEqual(self.ids(response, 'medicamentos'), [self.medicamento.pk])
+        self.assertEqual(self.ids(response, 'recordatorios'), [self.recordatorio.pk])
+        self.assertEqual(
+            self.ids(response, 'registros_toma'),
+            sorted(RegistroToma.objects.filter(recordatorio__usuario=self.patient).values_list('id', flat=True))
+        )
+        for name in ('medicamentos', 'recordatorios', 'registros_toma'):
+            self.assertEqual(self.ids(response, name, 'deleted'), [])
+
+    def test_incremental_sync_returns_only_changes(self):
+        token = self.sync().data['token']
+        unchanged = self.sync(token)
+        self.assertEqual(self.ids(unchanged, 'medicamentos'), [])
+        self.assertEqual(self.ids(unchanged, 'recordatorios'), [])
+
+        self.recordatorio.dosis = '2'
+        self.recordatorio.save()
+        response = self.sync(unchanged.data['token'])
+        self.assertEqual(self.ids(response, 'recordatorios'), [self.recordatorio.pk])
+        self.assertEqual(response.data['changes']['recordatorios']['updated'][0]['dosis'], '2')
+        self.assertEqual(self.ids(response, 'medicamentos'), [])
+
+    def test_deletes_are_sent_as_tombstones(self):
+        token = self.sync().data['token']
+        registros = sorted(RegistroToma.objects.filter(recordatorio=self.recordatorio).values_list('id', flat=True))
+        medicamento_id, recordatorio_id = self.medicamento.pk, self.recordatorio.pk
+        self.medicamento.delete()
+
+        response = self.sync(token)
+        self.assertEqual(self.ids(response, 'medicamentos', 'deleted'), [medicamento_id])
+        self.assertEqual(self.ids(response, 'recordatorios', 'deleted'), [recordatorio_id])
+        self.assertEqual(self.ids(response, 'registros_toma', 'deleted'), registros)
+        # Las lápidas ya entregadas no se repiten
+        again = self.sync(response.data['token'])
+        self.assertEqual(self.ids(again, 'medicamentos', 'deleted'), [])
+
+    def test_token_from_another_user_is_rejected(self):
+        self.client.force_authenticate(self.other)
+        token = self.client.get('/sync/').data['token']
+
+        self.client.force_authenticate(self.patient)
+        self.assertEqual(self.client.get('/sync/', {'since': token}).status_code, 400)
+        self.assertEqual(self.client.get('/sync/', {'since': 'no-es-un-token'}).status_code, 400)
+
+    def test_unchanged_sync_is_not_modified(self):
+        token = self.sync().data['token']
+        response = self.sync(token)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.sync(token, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        self.recordatorio.dosis = '2'
+        self.recordatorio.save()
+        self.assertEqual(self.sync(token, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class HomeScreenTests(TestCase):
+    """Pantalla de inicio de la app (/home/)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = Institution.objects.create(name='Hospital')
+        cls.patient = create_member('patient', 'PATIENT', cls.institution)
+        cls.other = create_member('other', 'PATIENT', cls.institution)
+        maestro = MedicamentoMaestro.objects.create(nombre='Ibuprofeno')
+        cls.medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.patient)
+        cls.recordatorio = Recordatorio.objects.create(
+            usuario=cls.patient, medicamento=cls.medicamento, dosis='1', hora=time(8, 0)
+        )
+        cls.registro = RegistroToma.objects.create(
+            recordatorio=cls.recordatorio, fecha_programada=timezone.now() - timedelta(days=2), estado='TOMADO'
+        )
+        RegistroToma.objects.create(recordatorio=cls.recordatorio, fecha_programada=timezone.now() - timedelta(days=20))
+        cls.effect = create_effect(cls.patient, cls.medicamento, cls.institution)
+        other_medicamento = Medicamento.objects.create(medicamento_maestro=maestro, usuario=cls.other)
+        create_effect(cls.other, other_medicamento, cls.institution)
+        cls.unread = AlertNotification.objects.create(
+            adverse_effect=cls.effect, recipient=cls.patient, title='Aviso', message='Revisado', priority='HIGH'
+        )
+        AlertNotification.objects.create(
+            adverse_effect=cls.effect, recipient=cls.patient, title='Leída', message='x', priority='LOW',
+            read_at=timezone.now()
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        # Usuario recién leído, como en una petición real (el perfil no está en caché)
+        self.client.force_authenticate(User.objects.get(pk=self.patient.pk))
+
+    def test_sections(self):
+        response = self.client.get('/home/')
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual(
+            set(data), {'user', 'medicamentos', 'today', 'registros', 'notifications', 'adverse_effects'}
+        )
+        self.assertEqual((data['user']['id'], data['user']['user_type']), (self.patient.pk, 'PATIENT'))
+        self.assertEqual(data['user']['institution'], self.institution.pk)
+        self.assertEqual([row['id'] for row in data['medicamentos']], [self.medicamento.pk])
+        self.assertEqual(data['medicamentos'][0]['nombre'], 'Ibuprofeno')
+        self.assertEqual({row['recordatorio'] for row in data['today']}, {self.recordatorio.pk})
+        # Solo los últimos HOME_HISTORY_DAYS días
+        self.assertEqual([row['id'] for row in data['registros']], [self.registro.pk])
+        self.assertEqual([row['id'] for row in data['notifications']], [self.unread.pk])
+        self.assertEqual([row['id'] for row in data['adverse_effects']], [self.effect.pk])
+
+        self.assertEqual(self.client.get('/home/', {'days': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/home/', {'days': 'x'}).status_code, 400)
+
+    def test_queries_do_not_grow_with_history(self):
+        with self.assertNumQueries(8):
+            self.client.get('/home/')
+
+        for _ in range(3):
+            medicamento = Medicamento.objects.create(
+                medicamento_maestro=self.medicamento.medicamento_maestro, usuario=self.patient
+            )
+            recordatorio = Recordatorio.objects.create(
+                usuario=self.patient, medicamento=medicamento, dosis='1', hora=time(20, 0)
+            )
+            RegistroToma.objects.create(recordatorio=recordatorio, fecha_programada=timezone.now() - timedelta(days=1))
+            effect = create_effect(self.patient, medicamento, self.institution)
+            AlertNotification.objects.create(
+                adverse_effect=effect, recipient=self.patient, title='Aviso', message='x', priority='LOW'
+            )
+
+        self.client.force_authenticate(User.objects.get(pk=self.patient.pk))
+        with self.assertNumQueries(8):
+            response = self.client.get('/home/')
+        self.assertEqual(len(response.data['medicamentos']), 4)
+        self.assertEqual(len(response.data['notifications']), 4)
+
+    def test_etag_round_trip(self):
+        response = self.client.get('/home/')
+        etag = response['ETag']
+
+        response = self.client.get('/home/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        AlertNotification.objects.filter(pk=self.unread.pk).update(read_at=timezone.now())
+        response = self.client.get('/home/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['notifications'], [])
@@ -4,7 +4,8 @@ from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from . import views
 from .views import UserViewSet, DispositivoUsuarioViewSet, RegisterView, ProfileView, \
     MedicamentoMaestroViewSet, MedicamentoViewSet, RecordatorioViewSet, RegistroTomaViewSet, \
-    AdverseEffectViewSet, AlertNotificationViewSet, DashboardViewSet, InstitutionViewSet
+    AdverseEffectViewSet, AlertNotificationViewSet, DashboardViewSet, InstitutionViewSet, ExportJobViewSet, \
+    RegulatorySubmissionViewSet, AdherenceViewSet
 
 router = DefaultRouter()
 router.register(r'institutions', InstitutionViewSet, basename='institutions')
@@ -17,6 +18,9 @@ router.register(r'notifications', AlertNotificationViewSet, basename='notificati
 router.register(r'dashboard', DashboardViewSet, basename='dashboard')
 router.register(r'users', UserViewSet, basename='user')
 router.register(r'dispositivos', DispositivoUsuarioViewSet, basename='dispositivo')
+router.register(r'export-jobs', ExportJobViewSet, basename='export-job')
+router.register(r'regulatory-submissions', RegulatorySubmissionViewSet, basename='regulatory-submission')
+router.register(r'adherence', AdherenceViewSet, basename='adherence')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -29,4 +33,6 @@ urlpatterns = [
     path('login/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('register/', RegisterView.as_view(), name='auth_register'),
     path('profile/', ProfileView.as_view(), name='auth_profile'),
+    path('sync/', views.SyncView.as_view(), name='sync'),
+    path('home/', views.HomeView.as_view(), name='home'),
 ]
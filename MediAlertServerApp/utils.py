@@ -1,19 +1,40 @@
-from django.db.models import Count
 from django.contrib.auth.models import User
 
-def assign_reviewer_to_report():
-    professionals = User.objects.filter(profile__user_type='PROFESSIONAL')
+def assign_reviewer_to_report(institution_id):
+    """
+    Elegir el profesional de la institución con menos reportes abiertos.
+    Los empates se resuelven por id de usuario para que la asignación sea determinista.
+    """
+    return User.objects.filter(
+        profile__user_type='PROFESSIONAL',
+        profile__institution_id=institution_id
+    ).order_by('profile__open_reviews', 'profile__user_id').first()
 
-    professional_workload = professionals.annotate(report_count=Count('assigned_reviews')).order_by('report_count')
+def filter_adverse_effects(queryset, params):
+    """
+    Aplicar los filtros de dashboard y exportaciones a un queryset de reportes.
 
-    if professional_workload.exists():
-        min_reports = professional_workload.first().report_count
-        candidates = professional_workload.filter(report_count=min_reports)
+    Args:
+        queryset: Reportes ya limitados al ámbito del usuario
+        params (dict): from, to, severity, type (todos opcionales)
 
-        if candidates.count() > 1:
-            return None
+    Returns:
+        QuerySet: Reportes filtrados, más recientes primero
+    """
+    # Filtros por fecha
+    date_from = params.get('from')
+    date_to = params.get('to')
+    if date_from:
+        queryset = queryset.filter(reported_at__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(reported_at__lte=date_to)
 
-        return candidates.first()
-    
-    return None
+    # Filtros por severidad y tipo
+    severity = params.get('severity')
+    effect_type = params.get('type')
+    if severity:
+        queryset = queryset.filter(severity=severity)
+    if effect_type:
+        queryset = queryset.filter(type=effect_type)
 
+    return queryset.order_by('-reported_at')
@@ -1,24 +1,37 @@
-import csv
-import json
 from datetime import datetime, timedelta
-from rest_framework import generics, permissions, viewsets, status
+from rest_framework import generics, mixins, permissions, viewsets, status
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.response import Response
 from rest_framework.permissions import BasePermission, IsAuthenticated, DjangoModelPermissions
 from rest_framework.decorators import action
-from rest_framework.pagination import PageNumberPagination
-from django.db.models import Count, F, Q
-from django.db.models import Count, Avg, Max, Min
+from django.db.models import Count, F, Max, Min, Q, Sum
 from django.db.models.functions import TruncMonth, TruncWeek
+from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth.models import User, Group
-from django.http import HttpResponse
-from .models import DispositivoUsuario, MedicamentoMaestro, Medicamento, Recordatorio, RegistroToma, AdverseEffect, AlertNotification, Institution, UserProfile
+from django.db import IntegrityError
+from django.http import HttpResponse, FileResponse
+from .models import DispositivoUsuario, MedicamentoMaestro, Medicamento, Recordatorio, RegistroToma, AdverseEffect, AlertNotification, Institution, UserProfile, \
+    AdverseEffectDailyRollup, DrugEventCount, ExportJob, RegulatorySubmission, AdherenceDailyRollup
 from .serializers import UserSerializer, CombinedProfileSerializer, DispositivoUsuarioSerializer, \
     RegisterSerializer, MedicamentoMaestroSerializer, MedicamentoSerializer, RecordatorioSerializer, RegistroTomaSerializer, \
-    AdverseEffectSerializer, AlertNotificationSerializer, InstitutionSerializer
-from .services import FirebaseService
+    AdverseEffectSerializer, AlertNotificationSerializer, InstitutionSerializer, ExportJobSerializer, \
+    ExportJobRequestSerializer, RegulatorySubmissionSerializer, DoseActionBatchSerializer
+from .services import FirebaseService, ExportJobService, DoseActionService, RecordatorioService
 from .report_generator import ReportGenerator
+from .analytics import AdverseEffectAnalytics
+from .adherence import AdherenceAnalytics
+from .pharmacovigilance import SignalDetector
+from .caching import versioned_cache, etag_response
+from .pagination import KeysetPagination
+from .fieldsets import ValuesListMixin
+from .exports import AdverseEffectCSVExport, AdverseEffectJSONExport, streaming_response, wants_gzip
+from .icsr import ICSRWriter
+from .sync import DeltaSync
+from .home import HomeScreen
+from .idempotency import idempotent
+from .duplicates import DuplicateDetector
+from .utils import filter_adverse_effects
 from .permissions import IsProfessional, IsAdmin, IsSupervisor, IsSupervisorOrReadOnly, IsPatient, IsProfessionalOrSupervisorOrAdmin
 
 class InstitutionViewSet(viewsets.ModelViewSet):
@@ -44,7 +57,7 @@ class UserViewSet(viewsets.ModelViewSet):
         return [IsAuthenticated()]
 
     def get_queryset(self):
-        queryset = User.objects.all()
+        queryset = User.objects.select_related('profile')
         
         user_type = self.request.GET.get('user_type')
         if user_type:
@@ -203,6 +216,7 @@ class DispositivoUsuarioViewSet(viewsets.ModelViewSet):
             serializer.save(usuario=self.request.user)
     
     @action(detail=False, methods=['post'])
+    @idempotent('register-token')
     def register_token(self, request):
         """Endpoint simplificado para registrar token FCM"""
         token = request.data.get('token')
@@ -243,14 +257,16 @@ class DispositivoUsuarioViewSet(viewsets.ModelViewSet):
             return Response({'status': 'notification sent'})
         return Response({'error': 'Error al enviar notificación'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class MedicamentoMaestroViewSet(viewsets.ModelViewSet):
+class MedicamentoMaestroViewSet(ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = MedicamentoMaestroSerializer
     permission_classes = [IsSupervisorOrReadOnly]
     queryset = MedicamentoMaestro.objects.all()
 
-class MedicamentoViewSet(viewsets.ModelViewSet):
+class MedicamentoViewSet(ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = MedicamentoSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-id',)
 
     def get_queryset(self):
         if self.request.user.profile.user_type == 'PROFESSIONAL':
@@ -260,12 +276,12 @@ class MedicamentoViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(usuario=self.request.user)
 
-class RecordatorioViewSet(viewsets.ModelViewSet):
+class RecordatorioViewSet(ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = RecordatorioSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Recordatorio.objects.filter(usuario=self.request.user)
+        return Recordatorio.objects.filter(usuario=self.request.user).select_related('medicamento__medicamento_maestro')
     
     def perform_create(self, serializer):
         serializer.save(usuario=self.request.user)
@@ -277,59 +293,46 @@ class RecordatorioViewSet(viewsets.ModelViewSet):
         recordatorio.save()
         return Response({'status': 'success', 'active': recordatorio.activo})
     
+    def _doses_response(self, doses):
+        """Datos del recordatorio de cada toma junto con su fecha, registro y estado"""
+        reminders = {}
+        data = []
+        for recordatorio, fecha_programada, registro_id, estado in doses:
+            if recordatorio.id not in reminders:
+                reminders[recordatorio.id] = self.get_serializer(recordatorio).data
+            data.append({
+                **reminders[recordatorio.id],
+                'fecha_programada': fecha_programada,
+                'registro': registro_id,
+                'estado': estado
+            })
+        return Response(data)
+
     @action(detail=False, methods=['get'])
     def today(self, request):
-        """Obtener recordatorios para hoy"""
-        today = timezone.now().date()
-        queryset = self.get_queryset().filter(
-            activo=True
-        ).filter(
-            # Sin fecha de fin o con fecha de fin posterior o igual a hoy
-            Q(fecha_fin__isnull=True) | Q(fecha_fin__gte=today)
-        )
-        
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        """Obtener las tomas de hoy"""
+        start = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+        doses = RecordatorioService.schedule(request.user, start, start + timedelta(days=1))
+        return self._doses_response(doses)
     
     @action(detail=False, methods=['get'])
     def upcoming(self, request):
-        """Obtener próximos recordatorios (próximas 24 horas)"""
+        """Obtener próximas tomas (próximas 24 horas)"""
         now = timezone.now()
-        tomorrow = now + timedelta(days=1)
-        
-        # Obtener recordatorios activos
-        queryset = self.get_queryset().filter(
-            activo=True
-        ).filter(
-            # Sin fecha de fin o con fecha de fin posterior o igual a hoy
-            Q(fecha_fin__isnull=True) | Q(fecha_fin__gte=now.date())
-        )
-        
-        # Filtrar por hora (próximas 24 horas)
-        upcoming_reminders = []
-        for reminder in queryset:
-            # Crear datetime para hoy con la hora del recordatorio
-            reminder_time_today = datetime.combine(now.date(), reminder.hora)
-            reminder_datetime = timezone.make_aware(reminder_time_today)
-            
-            # Si la hora ya pasó hoy, usar mañana
-            if reminder_datetime < now:
-                reminder_time_tomorrow = datetime.combine(tomorrow.date(), reminder.hora)
-                reminder_datetime = timezone.make_aware(reminder_time_tomorrow)
-            
-            # Si está dentro de las próximas 24 horas
-            if reminder_datetime <= tomorrow:
-                upcoming_reminders.append(reminder)
-        
-        serializer = self.get_serializer(upcoming_reminders, many=True)
-        return Response(serializer.data)
+        doses = RecordatorioService.schedule(request.user, now, now + timedelta(days=1))
+        return self._doses_response(doses)
 
-class RegistroTomaViewSet(viewsets.ModelViewSet):
+class RegistroTomaViewSet(ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = RegistroTomaSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-fecha_programada', '-id')
+    MAX_STATISTICS_DAYS = 3650
     
     def get_queryset(self):
-        return RegistroToma.objects.filter(recordatorio__usuario=self.request.user)
+        return RegistroToma.objects.filter(
+            recordatorio__usuario=self.request.user
+        ).select_related('recordatorio__medicamento__medicamento_maestro')
     
     @action(detail=False, methods=['get'])
     def by_date_range(self, request):
@@ -359,35 +362,42 @@ class RegistroTomaViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
         
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.list_response(queryset, paginate=False)
     
     @action(detail=False, methods=['get'])
     def statistics(self, request):
         """Obtener estadísticas de tomas"""
-        days = int(request.query_params.get('days', 30))
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            days = -1
+        if not 0 <= days <= self.MAX_STATISTICS_DAYS:
+            return Response(
+                {'error': f'days debe ser un entero entre 0 y {self.MAX_STATISTICS_DAYS}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         start_date = timezone.now().date() - timedelta(days=days)
         
-        # Obtener registros en el rango de fechas
-        queryset = self.get_queryset().filter(fecha_programada__date__gte=start_date)
-        
-        # Calcular estadísticas
-        total = queryset.count()
-        tomados = queryset.filter(estado='TOMADO').count()
-        omitidos = queryset.filter(estado='OMITIDO').count()
-        pospuestos = queryset.filter(estado='POSPUESTO').count()
+        # Una única consulta sobre los agregados diarios, sea cual sea la ventana
+        totals = AdherenceDailyRollup.objects.filter(
+            usuario=request.user, day__gte=start_date
+        ).aggregate(
+            total=Sum('total'),
+            tomados=Sum('tomados'),
+            omitidos=Sum('omitidos'),
+            pospuestos=Sum('pospuestos')
+        )
+        totals = {field: value or 0 for field, value in totals.items()}
         
-        adherencia = (tomados / total * 100) if total > 0 else 0
+        adherencia = (totals['tomados'] / totals['total'] * 100) if totals['total'] > 0 else 0
         
         return Response({
-            'total': total,
-            'tomados': tomados,
-            'omitidos': omitidos,
-            'pospuestos': pospuestos,
+            **totals,
             'adherencia': round(adherencia, 2)
         })
     
     @action(detail=True, methods=['post'])
+    @idempotent('tomar')
     def tomar(self, request, pk=None):
         """Marcar un medicamento como tomado"""
         registro = self.get_object()
@@ -402,6 +412,7 @@ class RegistroTomaViewSet(viewsets.ModelViewSet):
         return Response({'status': 'success'})
     
     @action(detail=True, methods=['post'])
+    @idempotent('posponer')
     def posponer(self, request, pk=None):
         """Posponer un recordatorio"""
         registro = self.get_object()
@@ -426,6 +437,22 @@ class RegistroTomaViewSet(viewsets.ModelViewSet):
             'new_registro_id': nuevo_registro.id,
             'new_time': nueva_fecha
         })
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Aplicar en una transacción las acciones tomar/posponer encoladas sin conexión"""
+        serializer = DoseActionBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            results = DoseActionService.apply_batch(request.user, serializer.validated_data['actions'])
+        except IntegrityError:
+            # Otra petición con las mismas claves se está aplicando a la vez
+            return Response(
+                {'error': 'Acciones en curso con las mismas claves, reintente'},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response({'results': results})
     
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
@@ -461,9 +488,35 @@ class ProfileView(generics.RetrieveUpdateAPIView):
     def get_object(self):
         return self.request.user
 
-class AdverseEffectViewSet(viewsets.ModelViewSet):
+class SyncView(generics.GenericAPIView):
+    """Sincronización incremental de medicamentos, recordatorios y registros de toma"""
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request):
+        # El ETag no cambia mientras no haya cambios nuevos para el mismo token
+        return etag_response(request, DeltaSync(request.user, token=request.query_params.get('since')).changes())
+
+class HomeView(generics.GenericAPIView):
+    """Pantalla de inicio de la app en una sola llamada"""
+    permission_classes = (permissions.IsAuthenticated,)
+    MAX_DAYS = 31
+
+    def get(self, request):
+        try:
+            days = int(request.query_params.get('days', settings.HOME_HISTORY_DAYS))
+        except ValueError:
+            days = 0
+        if not 1 <= days <= self.MAX_DAYS:
+            return Response(
+                {'error': f'days debe ser un entero entre 1 y {self.MAX_DAYS}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return etag_response(request, HomeScreen(request.user, days).data())
+
+class AdverseEffectViewSet(ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = AdverseEffectSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
@@ -477,13 +530,24 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
         return [IsAuthenticated()]
 
     def get_queryset(self):
+        # medicamento_nombre recorre medication -> medicamento_maestro
+        queryset = AdverseEffect.objects.select_related('medication__medicamento_maestro')
         if self.request.user.profile.user_type == 'ADMIN':
-            return AdverseEffect.objects.all()
+            return queryset
         elif self.request.user.profile.user_type == 'SUPERVISOR':
-            return AdverseEffect.objects.filter(institution=self.request.user.profile.institution)
+            return queryset.filter(institution_id=self.request.user.profile.institution_id)
         elif self.request.user.profile.user_type == 'PROFESSIONAL':
-            return AdverseEffect.objects.filter(reviewer=self.request.user, institution=self.request.user.profile.institution)
-        return AdverseEffect.objects.filter(patient=self.request.user, institution=self.request.user.profile.institution)
+            return queryset.filter(reviewer=self.request.user, institution_id=self.request.user.profile.institution_id)
+        return queryset.filter(patient=self.request.user, institution_id=self.request.user.profile.institution_id)
+
+    @idempotent('adverse-effect-create')
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        adverse_effect = serializer.save()
+        # Marcar posibles duplicados comparando solo con los candidatos LSH
+        DuplicateDetector().index(adverse_effect)
 
     @action(detail=True, methods=['post'], permission_classes=[IsSupervisor])
     def assign_reviewer(self, request, pk=None):
@@ -495,7 +559,7 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
             if reviewer.profile.user_type == 'PROFESSIONAL':
                 adverse_effect.reviewer = reviewer
                 adverse_effect.status = 'ASSIGNED'
-                adverse_effect.save()
+                adverse_effect.save(actor=request.user)
                 return Response({'status': 'Reviewer assigned successfully'})
             else:
                 return Response({'error': 'User is not a professional'}, status=status.HTTP_400_BAD_REQUEST)
@@ -516,7 +580,7 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
         
         adverse_effect.revertion_reason = revertion_reason
         adverse_effect.status = 'IN_REVISION'
-        adverse_effect.save()
+        adverse_effect.save(actor=request.user)
         
         return Response({'status': 'Estado revertido', 'reason': revertion_reason})
 
@@ -528,7 +592,7 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
             return Response({'error': 'No se puede aprovar una reclamación en este estado'}, status=status.HTTP_400_BAD_REQUEST)
 
         adverse_effect.status = 'APPROVED'
-        adverse_effect.save()
+        adverse_effect.save(actor=request.user)
         return Response({'status': 'Reclamation accepted'})
     
     @action(detail=True, methods=['post'], permission_classes=[IsSupervisor])
@@ -539,7 +603,7 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
             return Response({'error': 'No se puede rechazar la reclamación en este estado'}, status=status.HTTP_400_BAD_REQUEST)
 
         adverse_effect.status = 'REJECTED'
-        adverse_effect.save()
+        adverse_effect.save(actor=request.user)
         return Response({'status': 'Reclamation rejected'})
 
     #Professional transitions
@@ -551,7 +615,7 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
             return Response({'error': 'No se puede iniciar la revisión en este estado'}, status=status.HTTP_400_BAD_REQUEST)
         
         adverse_effect.status = 'IN_REVISION'
-        adverse_effect.save()
+        adverse_effect.save(actor=request.user)
         return Response({'status': 'Revision initiated'})
 
     @action(detail=True, methods=['post'], permission_classes=[IsProfessional])
@@ -563,7 +627,7 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
 
         adverse_effect.status = 'PENDING_INFORMATION'
         adverse_effect.chat_active = True
-        adverse_effect.save()
+        adverse_effect.save(actor=request.user)
         return Response({'status': 'Additional info requested'})
 
     @action(detail=True, methods=['post'], permission_classes=[IsProfessional])
@@ -574,7 +638,7 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
             return Response({'error': 'No se puede aprobar un reporte en este estado'}, status=status.HTTP_400_BAD_REQUEST)
 
         adverse_effect.status = 'APPROVED'
-        adverse_effect.save()
+        adverse_effect.save(actor=request.user)
         return Response({'status': 'Report approved'})
 
     @action(detail=True, methods=['post'], permission_classes=[IsProfessional])
@@ -585,7 +649,7 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
             return Response({'error': 'No se puede rechazar un reporte en este estado'}, status=status.HTTP_400_BAD_REQUEST)
 
         adverse_effect.status = 'REJECTED'
-        adverse_effect.save()
+        adverse_effect.save(actor=request.user)
         return Response({'status': 'Report rejected'})
 
     #Patient transitions
@@ -605,7 +669,7 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
 
         adverse_effect.reclamation_reason = reclamation_reason
         adverse_effect.status = 'RECLAIMED'
-        adverse_effect.save()
+        adverse_effect.save(actor=request.user)
 
         return Response({'status': 'Reclamación iniciada', 'reclamation_reason': reclamation_reason})
 
@@ -626,7 +690,7 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
         # Guardar la información adicional en la base de datos
         adverse_effect.additional_info = additional_info
         adverse_effect.status = 'IN_REVISION'
-        adverse_effect.save()
+        adverse_effect.save(actor=request.user)
         
         return Response({'status': 'Información adicional proporcionada'})
 
@@ -637,7 +701,7 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
         
         if new_status in ['CREATED', 'ASSIGNED', 'IN_REVISION', 'PENDING_INFORMATION', 'REJECTED', 'RECLAIMED', 'APPROVED']:
             adverse_effect.status = new_status
-            adverse_effect.save()
+            adverse_effect.save(actor=request.user)
             return Response({'status': f'Estado actualizado a {new_status}'})
         else:
             return Response({'error': 'Estado no válido'}, status=status.HTTP_400_BAD_REQUEST)
@@ -654,7 +718,7 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
         
         medication = request.query_params.get('medication')
         if medication:
-            filters['medication__nombre__icontains'] = medication
+            filters['medication__medicamento_maestro__nombre__icontains'] = medication
         
         status = request.query_params.get('status')
         if status:
@@ -680,17 +744,12 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
             
             queryset = queryset.filter(date_filter)
         
-        queryset = queryset.filter(**filters).order_by('-reported_at')
-        
-        paginator = PageNumberPagination()
-        paginator.page_size = 20
-        result_page = paginator.paginate_queryset(queryset, request)
-        
-        serializer = AdverseEffectSerializer(result_page, many=True)
+        queryset = queryset.filter(**filters)
         
-        return paginator.get_paginated_response(serializer.data)
+        return self.list_response(queryset)
     
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    @idempotent('add-message')
     def add_message(self, request, pk=None):
         adverse_effect = self.get_object()
         
@@ -711,7 +770,7 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
             'message': message,
             'timestamp': datetime.now().isoformat()
         })
-        adverse_effect.save()
+        adverse_effect.save(actor=request.user)
         
         return Response({'status': 'Mensaje añadido'})
 
@@ -731,13 +790,15 @@ class AdverseEffectViewSet(viewsets.ModelViewSet):
         
         adverse_effect.status = 'IN_REVISION'
         adverse_effect.chat_active = False
-        adverse_effect.save()
+        adverse_effect.save(actor=request.user)
         
         return Response({'status': 'Chat cerrado'})
 
-class AlertNotificationViewSet(viewsets.ModelViewSet):
+class AlertNotificationViewSet(ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = AlertNotificationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         return AlertNotification.objects.filter(recipient=self.request.user)
@@ -751,9 +812,7 @@ class AlertNotificationViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def unread(self, request):
-        unread_notifications = self.get_queryset().filter(read_at__isnull=True)
-        serializer = self.get_serializer(unread_notifications, many=True)
-        return Response(serializer.data)
+        return self.list_response(self.get_queryset().filter(read_at__isnull=True), paginate=False)
 
 class DashboardViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
@@ -765,7 +824,7 @@ class DashboardViewSet(viewsets.ViewSet):
         """
         Verificar permisos específicos para cada endpoint.
         """
-        if self.action in ['statistics', 'medication_statistics', 'trends']:
+        if self.action in ['statistics', 'medication_statistics', 'trends', 'analysis_report', 'correlation_analysis', 'signals']:
             return [IsAuthenticated(), IsProfessionalOrSupervisorOrAdmin()]
         elif self.action in ['supervisor_view']:
             return [IsAuthenticated(), IsSupervisor()]
@@ -777,7 +836,7 @@ class DashboardViewSet(viewsets.ViewSet):
         """
         Vista general de reportes para supervisores.
         """
-        queryset = AdverseEffect.objects.all()
+        queryset = AdverseEffect.objects.select_related('medication__medicamento_maestro')
 
         # Aplicar filtros si existen
         filters = {}
@@ -788,7 +847,7 @@ class DashboardViewSet(viewsets.ViewSet):
 
         medication = request.query_params.get('medication')
         if medication:
-            filters['medication__nombre__icontains'] = medication
+            filters['medication__medicamento_maestro__nombre__icontains'] = medication
 
         status = request.query_params.get('status')
         if status:
@@ -816,69 +875,87 @@ class DashboardViewSet(viewsets.ViewSet):
                 date_filter &= Q(reported_at__lte=date_to)
             queryset = queryset.filter(date_filter)
 
-        queryset = queryset.filter(**filters).order_by('-reported_at')
+        queryset = queryset.filter(**filters)
 
-        paginator = PageNumberPagination()
-        paginator.page_size = 20
-        result_page = paginator.paginate_queryset(queryset, request)
+        paginator = KeysetPagination()
+        result_page = paginator.paginate_queryset(queryset, request, view=self)
         
         serializer = AdverseEffectSerializer(result_page, many=True)
         
         return paginator.get_paginated_response(serializer.data)
     
+    def _get_rollups(self, request):
+        """Agregados diarios visibles para el usuario (su institución salvo admins)"""
+        rollups = AdverseEffectDailyRollup.objects.exclude(report_count=0)
+        profile = request.user.profile
+        if profile.user_type != 'ADMIN':
+            rollups = rollups.filter(institution_id=profile.institution_id)
+        return rollups
+
     @action(detail=False, methods=['get'])
+    @versioned_cache('statistics')
     def statistics(self, request):
-        total_reports = AdverseEffect.objects.count()
-        by_severity = AdverseEffect.objects.values('severity').annotate(count=Count('id'))
-        by_type = AdverseEffect.objects.values('type').annotate(count=Count('id'))
+        rollups = self._get_rollups(request)
+        by_severity = list(rollups.values('severity').annotate(count=Sum('report_count')).order_by('severity'))
+        by_type = list(rollups.values('type').annotate(count=Sum('report_count')).order_by('type'))
         
         return Response({
-            'total_reports': total_reports,
+            'total_reports': sum(row['count'] for row in by_severity),
             'by_severity': by_severity,
             'by_type': by_type
         })
 
     @action(detail=False, methods=['get'])
+    @versioned_cache('medication_statistics')
     def medication_statistics(self, request):
+        rollups = self._get_rollups(request)
+        most_reported = rollups.values(
+            'medicamento_maestro__nombre'
+        ).annotate(
+            count=Sum('report_count')
+        ).order_by('-count')[:5]
+
+        by_severity = rollups.values(
+            'medicamento_maestro__nombre', 'severity'
+        ).annotate(
+            count=Sum('report_count')
+        ).order_by('medicamento_maestro__nombre', '-count')
+
         return Response({
-            'most_reported': AdverseEffect.objects.values(
-                'medication__medicamento_maestro__nombre'
-            ).annotate(
-                count=Count('id')
-            ).order_by('-count')[:5],
-            
-            'by_severity': AdverseEffect.objects.values(
-                'medication__medicamento_maestro__nombre', 'severity'
-            ).annotate(
-                count=Count('id')
-            ).order_by('medication__medicamento_maestro__nombre', '-count')
+            'most_reported': [{
+                'medication__medicamento_maestro__nombre': row['medicamento_maestro__nombre'],
+                'count': row['count']
+            } for row in most_reported],
+            'by_severity': [{
+                'medication__medicamento_maestro__nombre': row['medicamento_maestro__nombre'],
+                'severity': row['severity'],
+                'count': row['count']
+            } for row in by_severity]
         })
 
     @action(detail=False, methods=['get'])
+    @versioned_cache('trends')
     def trends(self, request):
-        thirty_days_ago = timezone.now() - timedelta(days=30)
+        thirty_days_ago = timezone.localdate() - timedelta(days=30)
+        rollups = self._get_rollups(request).filter(day__gte=thirty_days_ago)
         
         return Response({
-            'daily_reports': AdverseEffect.objects.filter(
-                reported_at__gte=thirty_days_ago
-            ).extra(
-                select={'date': 'date(reported_at)'}
-            ).values('date').annotate(
-                count=Count('id')
-            ).order_by('date'),
+            'daily_reports': list(rollups.values(
+                date=F('day')
+            ).annotate(
+                count=Sum('report_count')
+            ).order_by('date')),
             
-            'severity_trend': AdverseEffect.objects.filter(
-                reported_at__gte=thirty_days_ago
-            ).values('severity').annotate(
-                count=Count('id')
-            )
+            'severity_trend': list(rollups.values('severity').annotate(
+                count=Sum('report_count')
+            ).order_by('severity'))
         })
 
     @action(detail=False, methods=['get'])
     def pending_reviews(self, request):
         user = request.user
 
-        queryset = AdverseEffect.objects.filter(status='IN_REVISION')
+        queryset = AdverseEffect.objects.filter(status='IN_REVISION').select_related('medication__medicamento_maestro')
         if hasattr(user, 'profile') and user.profile.user_type == 'PROFESSIONAL':
             queryset = queryset.filter(reviewer=user)
 
@@ -893,149 +970,168 @@ class DashboardViewSet(viewsets.ViewSet):
     
     @action(detail=False, methods=['get'])
     def export_csv(self, request):
-        """Exportar datos a CSV"""
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="adverse_effects_{datetime.now().strftime("%Y%m%d")}.csv"'
-
+        """Exportar datos a CSV (en streaming; ?compress=gzip para comprimir)"""
         # Aplicar filtros si existen
         queryset = self._get_filtered_queryset(request)
 
-        writer = csv.writer(response)
-        writer.writerow(['Fecha', 'Medicamento', 'Severidad', 'Tipo', 'Descripción', 'Estado'])
-
-        for effect in queryset:
-            writer.writerow([
-                effect.reported_at.strftime("%Y-%m-%d"),
-                effect.medication.medicamento_maestro.nombre,
-                effect.severity,
-                effect.type,
-                effect.description,
-                effect.status
-            ])
-
-        return response
+        return AdverseEffectCSVExport(queryset).response(
+            f'adverse_effects_{datetime.now().strftime("%Y%m%d")}.csv',
+            compress=wants_gzip(request)
+        )
 
     @action(detail=False, methods=['get'])
     def export_json(self, request):
-        """Exportar datos a JSON"""
+        """
+        Exportar datos a JSON en streaming.
+
+        ?mode=json (array, por defecto) o ndjson, ?fields=campo1,campo2 para elegir
+        columnas y ?compress=gzip para comprimir.
+        """
         queryset = self._get_filtered_queryset(request)
-        serializer = AdverseEffectSerializer(queryset, many=True)
+        fields = [field for field in request.query_params.get('fields', '').split(',') if field]
+
+        try:
+            export = AdverseEffectJSONExport(queryset, fields=fields, mode=request.query_params.get('mode', 'json'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        response = HttpResponse(
-            json.dumps(serializer.data, indent=2),
-            content_type='application/json'
+        return export.response(
+            f'adverse_effects_{datetime.now().strftime("%Y%m%d")}',
+            compress=wants_gzip(request)
         )
-        response['Content-Disposition'] = f'attachment; filename="adverse_effects_{datetime.now().strftime("%Y%m%d")}.json"'
-        return response
+
+    def _get_scoped_queryset(self, request):
+        """Reportes visibles para el usuario (su institución salvo admins)"""
+        queryset = AdverseEffect.objects.select_related('medication__medicamento_maestro')
+        profile = request.user.profile
+        if profile.user_type != 'ADMIN':
+            queryset = queryset.filter(institution_id=profile.institution_id)
+        return queryset
 
     def _get_filtered_queryset(self, request):
         """Método auxiliar para aplicar filtros"""
-        queryset = AdverseEffect.objects.all()
-        
-        # Filtros por fecha
-        date_from = request.query_params.get('from')
-        date_to = request.query_params.get('to')
-        if date_from:
-            queryset = queryset.filter(reported_at__gte=date_from)
-        if date_to:
-            queryset = queryset.filter(reported_at__lte=date_to)
-
-        # Filtros por severidad y tipo
-        severity = request.query_params.get('severity')
-        effect_type = request.query_params.get('type')
-        if severity:
-            queryset = queryset.filter(severity=severity)
-        if effect_type:
-            queryset = queryset.filter(type=effect_type)
+        return filter_adverse_effects(self._get_scoped_queryset(request), request.query_params)
 
-        return queryset.order_by('-reported_at')
+    # Filtros que los agregados diarios no pueden resolver
+    ANALYSIS_FILTERS = ('from', 'to', 'severity', 'type')
 
     @action(detail=False, methods=['get'])
+    @versioned_cache('analysis_report')
     def analysis_report(self, request):
         """Análisis detallado de efectos adversos"""
+        if any(request.query_params.get(param) for param in self.ANALYSIS_FILTERS):
+            # Con filtros: una sola pasada sobre los reportes filtrados
+            analytics = AdverseEffectAnalytics(self._get_filtered_queryset(request))
+            return Response(analytics.run(sections=['severity', 'medication', 'temporal', 'type']))
+
+        rollups = self._get_rollups(request)
         return Response({
-            'severity_analysis': self._get_severity_analysis(),
-            'medication_analysis': self._get_medication_analysis(),
-            'temporal_analysis': self._get_temporal_analysis(),
-            'type_analysis': self._get_type_analysis()
+            'severity_analysis': self._get_severity_analysis(rollups),
+            'medication_analysis': self._get_medication_analysis(rollups),
+            'temporal_analysis': self._get_temporal_analysis(rollups),
+            'type_analysis': self._get_type_analysis(rollups)
         })
 
-    def _get_severity_analysis(self):
+    def _get_severity_analysis(self, rollups):
         """Análisis por severidad"""
-        return AdverseEffect.objects.values('severity').annotate(
-            count=Count('id'),
-            percentage=Count('id') * 100.0 / AdverseEffect.objects.count(),
-            avg_resolution_time=Avg('updated_at' - F('reported_at'))
-        ).order_by('-count')
-
-    def _get_medication_analysis(self):
+        # El tiempo de resolución se precalcula en cada cambio de estado (resolution_time)
+        by_severity = list(rollups.values('severity').annotate(
+            count=Sum('report_count'),
+            resolved_count=Sum('resolved_count'),
+            resolution_time_total=Sum('resolution_time_total')
+        ).order_by('-count', 'severity'))
+
+        total = sum(row['count'] for row in by_severity)
+        for row in by_severity:
+            resolved_count = row.pop('resolved_count')
+            resolution_time_total = row.pop('resolution_time_total')
+            row['percentage'] = row['count'] * 100.0 / total
+            row['avg_resolution_time'] = resolution_time_total / resolved_count if resolved_count else None
+        return by_severity
+
+    def _get_medication_analysis(self, rollups):
         """Análisis por medicamento"""
-        return AdverseEffect.objects.values(
-            'medication__nombre'
+        by_medication = rollups.values(
+            'medicamento_maestro__nombre'
         ).annotate(
-            total_reports=Count('id'),
-            severe_cases=Count('id', filter=Q(severity__in=['GRAVE', 'MUY_GRAVE'])),
-            most_common_type=Max('type'),
-            first_reported=Min('reported_at'),
-            last_reported=Max('reported_at')
-        ).order_by('-total_reports')
-
-    def _get_temporal_analysis(self):
+            total_reports=Sum('report_count'),
+            severe_cases=Sum('report_count', filter=Q(severity__in=['GRAVE', 'MUY_GRAVE'])),
+            type_a=Sum('report_count', filter=Q(type='A')),
+            type_b=Sum('report_count', filter=Q(type='B')),
+            first_reported=Min('day'),
+            last_reported=Max('day')
+        ).order_by('-total_reports', 'medicamento_maestro__nombre')
+
+        return [{
+            'medication__medicamento_maestro__nombre': row['medicamento_maestro__nombre'],
+            'total_reports': row['total_reports'],
+            'severe_cases': row['severe_cases'] or 0,
+            'most_common_type': 'A' if (row['type_a'] or 0) >= (row['type_b'] or 0) else 'B',
+            'first_reported': row['first_reported'],
+            'last_reported': row['last_reported']
+        } for row in by_medication]
+
+    def _get_temporal_analysis(self, rollups):
         """Análisis temporal"""
         return {
-            'monthly': AdverseEffect.objects.annotate(
-                month=TruncMonth('reported_at')
-            ).values('month').annotate(
-                count=Count('id')
-            ).order_by('month'),
+            'monthly': list(rollups.values(
+                month=TruncMonth('day')
+            ).annotate(
+                count=Sum('report_count')
+            ).order_by('month')),
             
-            'weekly': AdverseEffect.objects.annotate(
-                week=TruncWeek('reported_at')
-            ).values('week').annotate(
-                count=Count('id')
-            ).order_by('week')
+            'weekly': list(rollups.values(
+                week=TruncWeek('day')
+            ).annotate(
+                count=Sum('report_count')
+            ).order_by('week'))
         }
 
-    def _get_type_analysis(self):
+    def _get_type_analysis(self, rollups):
         """Análisis por tipo de efecto"""
-        return AdverseEffect.objects.values('type').annotate(
-            count=Count('id'),
-            severe_cases=Count('id', filter=Q(severity__in=['GRAVE', 'MUY_GRAVE'])),
-            medications_affected=Count('medication', distinct=True)
-        ).order_by('-count')
+        by_type = list(rollups.values('type').annotate(
+            count=Sum('report_count'),
+            severe_cases=Sum('report_count', filter=Q(severity__in=['GRAVE', 'MUY_GRAVE'])),
+            medications_affected=Count('medicamento_maestro', distinct=True)
+        ).order_by('-count', 'type'))
+
+        for row in by_type:
+            row['severe_cases'] = row['severe_cases'] or 0
+        return by_type
 
     @action(detail=False, methods=['get'])
+    @versioned_cache('correlation_analysis')
     def correlation_analysis(self, request):
-        """Análisis de correlaciones"""
-        return Response({
-            'severity_by_age': self._get_severity_age_correlation(),
-            'type_by_medication': self._get_type_medication_correlation(),
-            'severity_by_route': self._get_severity_route_correlation()
-        })
+        """Análisis de correlaciones (severidad x tipo, tipo x medicamento, severidad x vía)"""
+        analytics = AdverseEffectAnalytics(self._get_filtered_queryset(request))
+        return Response(analytics.run(sections=['correlations']))
 
-    def _get_severity_age_correlation(self):
-        """Correlación entre severidad y edad del paciente"""
-        return AdverseEffect.objects.values(
-            'severity', 'patient__profile__age_range'
-        ).annotate(
-            count=Count('id')
-        ).order_by('severity', 'patient__profile__age_range')
+    @action(detail=False, methods=['get'])
+    @versioned_cache('signals')
+    def signals(self, request):
+        """Señales de farmacovigilancia (PRR/ROR) por medicamento o principio activo"""
+        by = request.query_params.get('by', 'medicamento')
+        event = request.query_params.get('event', 'severity')
+        if by not in SignalDetector.DRUG_GROUPINGS or event not in SignalDetector.EVENT_DIMENSIONS:
+            return Response({'error': 'Parámetros no válidos: by=medicamento|principio_activo, event=severity|type'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            min_cases = int(request.query_params.get('min_cases', SignalDetector.MIN_CASES))
+            limit = min(int(request.query_params.get('limit', 50)), 500)
+        except ValueError:
+            return Response({'error': 'min_cases y limit deben ser números enteros'}, status=status.HTTP_400_BAD_REQUEST)
 
-    def _get_type_medication_correlation(self):
-        """Correlación entre tipo de efecto y medicamento"""
-        return AdverseEffect.objects.values(
-            'type', 'medication__nombre'
-        ).annotate(
-            count=Count('id')
-        ).order_by('-count')
+        counts = DrugEventCount.objects.all()
+        profile = request.user.profile
+        if profile.user_type != 'ADMIN':
+            counts = counts.filter(institution_id=profile.institution_id)
 
-    def _get_severity_route_correlation(self):
-        """Correlación entre severidad y vía de administración"""
-        return AdverseEffect.objects.values(
-            'severity', 'administration_route'
-        ).annotate(
-            count=Count('id')
-        ).order_by('severity', '-count')
+        detector = SignalDetector(counts)
+        return Response({
+            'by': by,
+            'event': event,
+            'results': detector.rank(by=by, event=event, min_cases=min_cases, limit=limit)
+        })
 
     @action(detail=False, methods=['get'])
     def generate_pdf_report(self, request):
@@ -1044,28 +1140,177 @@ class DashboardViewSet(viewsets.ViewSet):
         queryset = self._get_filtered_queryset(request)
         
         # Preparar datos para el reporte
-        report_data = {
-            'total_reports': queryset.count(),
-            'severe_cases': queryset.filter(severity__in=['GRAVE', 'MUY_GRAVE']).count(),
-            'pending_cases': queryset.filter(status='PENDING').count(),
-            'effects': [{
-                'medication': effect.medication.nombre,
-                'severity': effect.severity,
-                'type': effect.type,
-                'reported_at': effect.reported_at.strftime('%Y-%m-%d')
-            } for effect in queryset]
-        }
-        
-        # Generar PDF
-        generator = ReportGenerator()
-        pdf = generator.generate_adverse_effects_report(
-            report_data,
-            filters=dict(request.query_params)
-        )
+        report_data = ReportGenerator.build_report_data(queryset)
         
-        # Preparar respuesta
+        # Generar PDF directamente en la respuesta
         response = HttpResponse(content_type='application/pdf')
         response['Content-Disposition'] = f'attachment; filename="adverse_effects_report_{datetime.now().strftime("%Y%m%d")}.pdf"'
-        response.write(pdf)
+        ReportGenerator().generate_adverse_effects_report(
+            report_data,
+            filters=dict(request.query_params),
+            output=response
+        )
         
-        return response
\ No newline at end of file
+        return response
+
+class AdherenceViewSet(viewsets.ViewSet):
+    """
+    Análisis de adherencia (mapas de calor, adherencia por medicamento y móvil,
+    rachas y retrasos) de un paciente o de todos los de una institución.
+    """
+    permission_classes = [IsAuthenticated]
+    DEFAULT_DAYS = 90
+    MAX_DAYS = 3650
+
+    def get_permissions(self):
+        if self.action == 'institution':
+            return [IsAuthenticated(), IsProfessionalOrSupervisorOrAdmin()]
+        return [IsAuthenticated()]
+
+    def _analytics_params(self, request):
+        """Ventana (días) y secciones pedidas, o Response 400"""
+        try:
+            days = int(request.query_params.get('days', self.DEFAULT_DAYS))
+        except ValueError:
+            days = 0
+        if not 1 <= days <= self.MAX_DAYS:
+            return None, None, Response(
+                {'error': f'days debe ser un entero entre 1 y {self.MAX_DAYS}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        sections = [section for section in request.query_params.get('sections', '').split(',') if section]
+        unknown = [section for section in sections if section not in AdherenceAnalytics.SECTIONS]
+        if unknown:
+            return None, None, Response(
+                {'error': f'Secciones no válidas: {", ".join(unknown)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return days, sections, None
+
+    def _run(self, request, queryset):
+        days, sections, error = self._analytics_params(request)
+        if error:
+            return error
+        now = timezone.now()
+        queryset = queryset.filter(fecha_programada__gte=now - timedelta(days=days), fecha_programada__lte=now)
+        return Response(AdherenceAnalytics(queryset).run(sections=sections))
+
+    def retrieve(self, request, pk=None):
+        """Adherencia de un paciente (él mismo, profesionales y supervisores de su institución, admins)"""
+        patient = User.objects.filter(pk=pk).select_related('profile').first() if str(pk).isdigit() else None
+        if patient is None:
+            return Response({'error': 'Paciente no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+
+        if patient.pk != request.user.pk:
+            # Sin perfil no hay institución (getattr: el perfil que falta lanza AttributeError)
+            patient_profile = getattr(patient, 'profile', None)
+            if patient_profile is None:
+                return Response({'error': 'Paciente no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+
+            profile = getattr(request.user, 'profile', None)
+            allowed = profile is not None and (
+                profile.user_type == 'ADMIN' or
+                (profile.user_type in ('PROFESSIONAL', 'SUPERVISOR') and profile.institution_id is not None and
+                 patient_profile.institution_id == profile.institution_id)
+            )
+            if not allowed:
+                return Response({'error': 'No autorizado'}, status=status.HTTP_403_FORBIDDEN)
+
+        return self._run(request, RegistroToma.objects.filter(recordatorio__usuario=patient))
+
+    @action(detail=False, methods=['get'])
+    @versioned_cache('adherence_institution', version_field='adherence_version')
+    def institution(self, request):
+        """Adherencia de los pacientes de la institución (admins: ?institution=id)"""
+        profile = request.user.profile
+        institution_id = profile.institution_id
+        if profile.user_type == 'ADMIN':
+            institution_id = request.query_params.get('institution', '')
+            institution_id = int(institution_id) if institution_id.isdigit() else None
+        if not institution_id:
+            return Response({'error': 'Institución no indicada'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return self._run(request, RegistroToma.objects.filter(recordatorio__usuario__profile__institution_id=institution_id))
+
+class ExportJobViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Exportaciones en segundo plano: crear, consultar estado y descargar"""
+    serializer_class = ExportJobSerializer
+    permission_classes = [IsAuthenticated, IsProfessionalOrSupervisorOrAdmin]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-created_at', '-id')
+
+    def get_queryset(self):
+        # Trabajos sobre los datos visibles para el usuario (su institución salvo admins)
+        queryset = ExportJob.objects.all()
+        profile = self.request.user.profile
+        if profile.user_type != 'ADMIN':
+            queryset = queryset.filter(institution_id=profile.institution_id)
+        return queryset
+
+    def create(self, request):
+        serializer = ExportJobRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        params = dict(serializer.validated_data)
+        kind = params.pop('kind')
+
+        job, created = ExportJobService.submit(request.user, kind, params)
+        return Response(
+            self.get_serializer(job).data,
+            status=status.HTTP_200_OK if job.status == 'DONE' else status.HTTP_202_ACCEPTED
+        )
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != 'DONE':
+            return Response({'error': f'La exportación no está lista ({job.status})'}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            artifact = open(job.file_path, 'rb')
+        except FileNotFoundError:
+            return Response({'error': 'El fichero ya no está disponible'}, status=status.HTTP_410_GONE)
+
+        extension = ExportJobService.EXTENSIONS[job.kind] + ('.gz' if job.file_path.endswith('.gz') else '')
+        return FileResponse(
+            artifact,
+            as_attachment=True,
+            filename=f'adverse_effects_{job.created_at.strftime("%Y%m%d")}_{job.pk}.{extension}'
+        )
+
+class RegulatorySubmissionViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Lotes incrementales de casos aprobados para el regulador (ICSR en XML)"""
+    serializer_class = RegulatorySubmissionSerializer
+    permission_classes = [IsAuthenticated, IsSupervisor | IsAdmin]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-created_at', '-id')
+
+    def _scope(self):
+        """Institución de los datos (None = todas, administradores)"""
+        profile = self.request.user.profile
+        return None if profile.user_type == 'ADMIN' else profile.institution_id
+
+    def get_queryset(self):
+        return RegulatorySubmission.objects.filter(institution_id=self._scope())
+
+    def create(self, request):
+        """Crear el lote con los casos aprobados desde el último envío"""
+        submission = RegulatorySubmission.create_next(self._scope(), request.user)
+        if submission is None:
+            return Response({'status': 'Sin casos aprobados nuevos desde el último envío'})
+        return Response(self.get_serializer(submission).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'])
+    def xml(self, request, pk=None):
+        """Descargar el lote como ICSR en XML (en streaming; ?compress=gzip para comprimir)"""
+        submission = self.get_object()
+        writer = ICSRWriter(
+            submission.effects(),
+            message_number=f'MEDIALERT-{submission.pk}'
+        )
+        return streaming_response(
+            writer.chunks(),
+            f'icsr_{submission.pk}.xml',
+            'application/xml',
+            compress=wants_gzip(request)
+        )